@@ -11,53 +11,86 @@ Positional arguments:
 
 Optional arguments:
 -d, --debug: Activate debugging.
+-m, --materialize: Also materialize analysis_results.json from the results journal.
 -h: Print argument usage.
 
+The result is appended to the results journal. When analysing many folders one at a time, materialize
+analysis_results.json once at the end, with --materialize on the last folder or by running results_journal.py.
+
 """
 
 
-import json, argparse, os
-from deepdiff import DeepDiff
+import argparse, os, sys
+
+# Shared modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from compiled_pointsystem import CompiledPointsystem
+from fingerprint import Fingerprint, MISSING, get_json_data
+from results_journal import append_results, save_materialized
+from normalize import normalize_value, get_comparison_key
+from profiling import PROFILER
 
-def get_json_data(path):
+def get_fingerprints(path, date=None, pv=None, browser=None):
     """
-    Get content in a json file.
+    Get a list with all fingerprints in a provided path.
 
     Params:
-    [string] path: Path to json file.
+    [string] path: Path to directory containing fingerprints.
+    [string] date: Test date of the fingerprints.
+    [string] pv: Prefixed version of the fingerprints.
+    [string] browser: Browser of the fingerprints.
 
     Return:
-    Json content as a dictionary.
+    [list]: List of Fingerprint.
     """
-    with open(path, "r") as json_file:
-        data = json.load(json_file)
+    fingerprints = []
+    for f in os.listdir(path):
+        filepath = os.path.join(path, f)
+        if os.path.isfile(filepath):
+            with PROFILER.stage("read json"):
+                fingerprints.append(Fingerprint.load(filepath, date, pv, browser))
+                PROFILER.add_read(filepath)
 
-    return data
+    return fingerprints
 
 
-def get_fingerprints(path):
+def get_fingerprints_from_store(store, date, pv, browser):
     """
-    Get a list with all fingerprints in a provided path.
+    Get a list with all fingerprints of one browser folder from a fingerprint store.
 
     Params:
-    [string] path: Path to directory containing fingerprints.
+    [FingerprintStore] store: Fingerprint store.
+    [string] date: Test date.
+    [string] pv: Prefixed version.
+    [string] browser: Browser.
 
     Return:
-    A list of fingerprints.
-    Each fingerprint is a dictionary containing the following:
-        name: Name of fingerprint.
-        path: Path to fingerprint.
-        data: Contents of fingerprint.
+    [list]: List of Fingerprint.
     """
     fingerprints = []
-    for f in os.listdir(path):
-        filepath = os.path.join(path, f)
-        if os.path.isfile(filepath):
-            fingerprints.append({
-                "name": f,
-                "path": filepath,
-                "data": get_json_data(filepath)
-            })
+    for row in store.select(date, pv, browser):
+        test_num = store.meta[row][3]
+        fingerprints.append(Fingerprint.from_data(store.get_fingerprint(row), date, pv, browser, test_num))
+
+    return fingerprints
+
+
+def get_fingerprints_from_db(db, date, pv, browser):
+    """
+    Get a list with all fingerprints of one browser folder from a fingerprint database.
+
+    Params:
+    [FingerprintDatabase] db: Fingerprint database.
+    [string] date: Test date.
+    [string] pv: Prefixed version.
+    [string] browser: Browser.
+
+    Return:
+    [list]: List of Fingerprint.
+    """
+    fingerprints = []
+    for capture_id, _, _, _, test_num in db.get_captures(date, pv, browser):
+        fingerprints.append(Fingerprint.from_data(db.get_fingerprint(capture_id), date, pv, browser, test_num))
 
     return fingerprints
 
@@ -67,25 +100,39 @@ def find_missing_attr(f1, f2):
     Given two fingerprints, any attributes that are missing from one but not the other, will be detected.
 
     Params:
-    [dict] f1: First fingerprint.
-    [dict] f2: Second fingerprint.
+    [Fingerprint] f1: First fingerprint.
+    [Fingerprint] f2: Second fingerprint.
 
     Return:
     [list]: List of missing attributes.
     """
-    lst = []
-    for category in f1["data"]:
-        if category not in f2["data"]:
-            print(f"ERROR: The category '{category}' in {f1['name']}, does not exist in {f2['name']}")
+    for category in f1.layout[0]:
+        if category not in f2.layout[0]:
+            print(f"ERROR: The category '{category}' in {f1.name}, does not exist in {f2.name}")
             exit(1)
-        for attribute in f1["data"][category]:
-            if attribute not in f2["data"][category]:
-                print(f"ERROR: The attribute '{attribute}' in {f1['name']}, does not exist in {f2['name']}")
-                lst.append(attribute)
+
+    lst = []
+    for index, category, attribute, _ in f1.items():
+        if f2.get_value(index) is MISSING:
+            print(f"ERROR: The attribute '{attribute}' in {f1.name}, does not exist in {f2.name}")
+            lst.append(attribute)
 
     return lst
 
 
+def get_device_key(device):
+    """
+    Get a hashable key for a media device, two devices are equal when their keys are equal.
+
+    Params:
+    [dict] device: Media device.
+
+    Return:
+    [frozenset]: Key and value pairs of the device.
+    """
+    return frozenset(device.items())
+
+
 def lists_with_dict_changes(lst1, lst2):
     """
     Compare two lists of dictionaries and find differences.
@@ -102,65 +149,73 @@ def lists_with_dict_changes(lst1, lst2):
         "label": False,
         "deviceId": False
     }
+    devices2 = {get_device_key(d2) for d2 in lst2}
+    # Values of each key in lst2, created when first needed
+    values2 = {}
+
     # Find altered dictionaries
     for d1 in lst1:
         if False not in changes.values():
             return changes
 
-        equal = False
-        for d2 in lst2:
-            diff_value = DeepDiff(d1,d2)
-            # If identical found, break and continue with next dictionaty in lst1.
-            if not diff_value:
-                equal = True
-                break
+        # If identical found, continue with next dictionaty in lst1.
+        if get_device_key(d1) in devices2:
+            continue
+
         # If d1 not in lst2
-        if not equal:
-            for key in d1:
-                if key == "kind" or key == "groupId" or changes[key]:
-                    continue
-
-                exist = False
-                for d2 in lst2:
-                    if d1[key] == d2[key]:
-                        exist = True
-                        break
-                # If key has changed
-                if not exist:
-                    changes[key] = True
+        for key in d1:
+            if key == "kind" or key == "groupId" or changes[key]:
+                continue
+
+            if key not in values2:
+                values2[key] = {d2[key] for d2 in lst2}
+            # If key has changed
+            if d1[key] not in values2[key]:
+                changes[key] = True
 
     return changes
 
 
-def lists_equal(lst1, lst2):
+def get_canonical_key(value):
     """
-    Compare two lists and see if they are equal.
+    Get a key for a value, two values that compare_fingerprints see as equal have equal keys.
+    Strings are compared without case and surrounding whitespace, lists in any order
+    and media devices as sets of devices.
+    Value dictionaries use get_comparison_key, which gives the same key from the value's normalized form.
 
     Params:
-    [list] lst1: First list.
-    [list] lst2: Second list.
+    value: Attribute value.
 
     Return:
-    [bool]: True if equal, else false.    
+    Hashable key.
+    """
+    return get_comparison_key(normalize_value(value))
+
+
+def intern_fingerprints(fingerprints, values):
     """
-    for element in lst1:
-        if element not in lst2:
-            return False
-    for element in lst2:
-        if element not in lst1:
-            return False
-       
-    return True
+    Intern the values of fingerprints, so that compare_fingerprints compares them as integers.
+
+    Params:
+    [list] fingerprints: List of Fingerprint, each is given the canonical ids of its values.
+    [ValueDictionary] values: Value dictionary using get_comparison_key.
+
+    Return:
+    -
+    """
+    for fingerprint in fingerprints:
+        fingerprint.ids = values.intern_fingerprint(fingerprint)
 
 
 def compare_fingerprints(f1, f2, pointsystem):
     """
     Two fingerprints are compared to detect any differences.
+    If both fingerprints are interned (see intern_fingerprints), values are compared by canonical id.
 
     Params:
-    [dict] f1: First fingerprint.
-    [dict] f2: Second fingerprint.
-    [dict] pointsystem: Used pointsystem.
+    [Fingerprint] f1: First fingerprint.
+    [Fingerprint] f2: Second fingerprint.
+    [CompiledPointsystem] pointsystem: Used pointsystem.
 
     Return:
     [dict]: A dictionary with found differences.
@@ -169,6 +224,8 @@ def compare_fingerprints(f1, f2, pointsystem):
     missing_attr = find_missing_attr(f1, f2)
     missing_attr += find_missing_attr(f2, f1)
 
+    interned = f1.ids is not None and f2.ids is not None
+
     # Compare attribute values between fingerprints to find mismatched values.
     result = {
         "num_total": 0,
@@ -177,151 +234,83 @@ def compare_fingerprints(f1, f2, pointsystem):
         "ignored_changes": []
     }
 
-    for category in f1["data"]:
-        for attribute in f1["data"][category]:
-            if attribute == "Media Devices" or pointsystem[category][attribute][0]:
-                result["num_total"] += 1
-            if attribute in missing_attr:
-                continue
-            elif isinstance(f1["data"][category][attribute], str):
-                if f1["data"][category][attribute].upper().strip() != f2["data"][category][attribute].upper().strip():
-                    # print(f"MISMATCH between {f1['name']} and {f2['name']} in {attribute}.\n{f1['data'][category][attribute]}\n{f2['data'][category][attribute]}")
-                    if pointsystem[category][attribute][0]:
-                        result["changes"].append({
-                            "category": category,
-                            "name": attribute,
-                            "value1": f1['data'][category][attribute],
-                            "value2": f2['data'][category][attribute]
-                        })
-                        result["num_changed"] += 1
-                    else:
-                        result["ignored_changes"].append({
-                            "category": category,
-                            "name": attribute,
-                            "value1": f1['data'][category][attribute],
-                            "value2": f2['data'][category][attribute]
-                        })
+    for index, category, attribute, value1 in f1.items():
+        if attribute == "Media Devices" or pointsystem.is_scored(category, attribute):
+            result["num_total"] += 1
+        if attribute in missing_attr:
+            continue
+
+        value2 = f2.values[index]
+        if attribute != "Media Devices":
+            if interned:
+                changed = f1.ids[index] != f2.ids[index]
             else:
-                if attribute != "Media Devices":
-                    equal = lists_equal(f1["data"][category][attribute], f2["data"][category][attribute])
-                    if not equal:
-                        # print(f"MISMATCH between {f1['name']} and {f2['name']} in {attribute}.\n{f1['data'][category][attribute]}\n{f2['data'][category][attribute]}")
-                        if pointsystem[category][attribute][0]:
-                            result["changes"].append({
-                                "category": category,
-                                "name": attribute,
-                                "value1": f1['data'][category][attribute],
-                                "value2": f2['data'][category][attribute]
-                            })
-                            result["num_changed"] += 1
-                        else:
-                            result["ignored_changes"].append({
-                                "category": category,
-                                "name": attribute,
-                                "value1": f1['data'][category][attribute],
-                                "value2": f2['data'][category][attribute]
-                            })
+                changed = get_canonical_key(value1) != get_canonical_key(value2)
+
+            if changed:
+                # print(f"MISMATCH between {f1.name} and {f2.name} in {attribute}.\n{value1}\n{value2}")
+                change = {
+                    "category": category,
+                    "name": attribute,
+                    "value1": value1,
+                    "value2": value2
+                }
+                if pointsystem.is_scored(category, attribute):
+                    result["changes"].append(change)
+                    result["num_changed"] += 1
                 else:
-                    # Is number of media devices equal?
-                    if len(f1["data"][category][attribute]) != len(f2["data"][category][attribute]):
-                        result["changes"].append({
-                            "category": category,
-                            "name": "Media Devices: Quantity",
-                            "value1": len(f1["data"][category][attribute]),
-                            "value2": len(f2["data"][category][attribute])
-                        })
-                        result["num_changed"] += 1
-
-                    # Have any changes been made?
-
-                    # What changes has been made?
-                    changes = lists_with_dict_changes(f1["data"][category][attribute], f2["data"][category][attribute])
-
-                    for key in changes:
-                        if changes[key]:
-                            result["changes"].append({
-                                "category": category,
-                                "name": f"Media Devices: {key}",
-                                "value1": f1['data'][category][attribute],
-                                "value2": f2['data'][category][attribute]
-                            })
-                            result["num_changed"] += 1
+                    result["ignored_changes"].append(change)
+        else:
+            # Is number of media devices equal?
+            if len(value1) != len(value2):
+                result["changes"].append({
+                    "category": category,
+                    "name": "Media Devices: Quantity",
+                    "value1": len(value1),
+                    "value2": len(value2)
+                })
+                result["num_changed"] += 1
+
+            # Have any changes been made?
+
+            # What changes has been made?
+            changes = lists_with_dict_changes(value1, value2)
+
+            for key in changes:
+                if changes[key]:
+                    result["changes"].append({
+                        "category": category,
+                        "name": f"Media Devices: {key}",
+                        "value1": value1,
+                        "value2": value2
+                    })
+                    result["num_changed"] += 1
 
     return result
 
 
-def get_max_points(pointsystem):
-    """
-    Calculate max available points.
-
-    Params:
-    [dict] pointsystem: Used pointsystem.
-
-    Return:
-    Two variables. Max points and number of attributes.
-    """
-    max_points = 0
-    total_attr = 0
-    included_attr = []
-    for category in pointsystem:
-        if category == "pointsystem":
-            continue
-        
-        for attribute in pointsystem[category]:
-            if not pointsystem[category][attribute][0]:
-                continue
-
-            # Check if attr have friends
-            if pointsystem[category][attribute][1]:
-                included = False
-                for element in pointsystem[category][attribute][1]:
-                    if element in included_attr:
-                        included = True
-                        break
-                if not included:
-                    group = pointsystem[category][attribute][0]
-                    max_points += pointsystem["pointsystem"][group]
-                    included_attr.append(f"{category};{attribute}")
-                    total_attr += 1
-            else:
-                group = pointsystem[category][attribute][0]
-                max_points += pointsystem["pointsystem"][group]
-                total_attr += 1
-
-    max_points = max_points * pointsystem["pointsystem"]["bonus"]
-    total_attr = total_attr * pointsystem["pointsystem"]["bonus"]
-    return max_points, total_attr
-
 def award_points(changes, pointsystem):
     """
     Given occurred attribute changes, points are awared.
 
     Params:
     [dict] changes: Occurred attribute changes.
-    [dict] pointsystem: Used pointsystem.
+    [CompiledPointsystem] pointsystem: Used pointsystem.
 
     Return:
     Two variables. Points awarded and number of counted changes.
     """
     num_changed = 0
     points = 0
-    included_attr = []
+    included_attr = set()
     for attr in changes:
-        category = attr["category"]
-        attribute = attr["name"]
-        group = pointsystem[category][attribute][0]
-        included = False
-
-        # Check if attribute has friends
-        if pointsystem[category][attribute][1]:
-            for element in pointsystem[category][attribute][1]:
-                if element in included_attr:
-                    included = True
-                    break
-        if not included:
-            points += pointsystem["pointsystem"][group]
+        key = (attr["category"], attr["name"])
+
+        # Not counted if a friend is already counted
+        if pointsystem.friends[key].isdisjoint(included_attr):
+            points += pointsystem.points[key]
             num_changed += 1
-            included_attr.append(f"{category};{attribute}")
+            included_attr.add(key)
 
     return points, num_changed
 
@@ -333,14 +322,14 @@ def get_effective_change(d_1_2, d_1_3, pointsystem):
     Params:
     [dict] diff1_2: Differences between f1 and f2.
     [dict] diff1_3: Differences between f1 and f3.
-    [dict] pointsystem: Used pointsystem.
+    [CompiledPointsystem] pointsystem: Used pointsystem.
 
     Return:
     Two variables. Percentage effective change (using pointsystem) and percentage raw change (without pointsystem)
     """
 
-    # calculate max points
-    max_points, total_attr = get_max_points(pointsystem)
+    # max points are calculated once when the pointsystem is compiled
+    max_points, total_attr = pointsystem.max_points, pointsystem.total_attr
 
     # Remove attribute changes from d_1_3 that exist in d_1_2
     for a1 in d_1_2["changes"]:
@@ -351,8 +340,8 @@ def get_effective_change(d_1_2, d_1_3, pointsystem):
     
     # Give points for changes during session
     points, num = award_points(d_1_2["changes"], pointsystem)
-    points * pointsystem["pointsystem"]["bonus"]
-    num * pointsystem["pointsystem"]["bonus"]
+    points * pointsystem.bonus
+    num * pointsystem.bonus
     
     # Give points for changes between session
     tmp1, tmp2 = award_points(d_1_3["changes"], pointsystem)
@@ -369,14 +358,14 @@ def select_fingerprint(fingerprints, name):
     Given a specific fingerprint's name. This fingerprint will be found and returned.
 
     Params:
-    [list] fingerprints: List of fingerprints.
+    [list] fingerprints: List of Fingerprint.
     [string] name: Name of fingerprint
 
     Return:
-    [dict] fingerprint.
+    [Fingerprint] fingerprint.
     """
     for fingerprint in fingerprints:
-        if name in fingerprint["name"]:
+        if name in fingerprint.name:
             return fingerprint
 
 def print_diff(diff_1_2, diff_1_3):
@@ -411,7 +400,7 @@ def print_diff(diff_1_2, diff_1_3):
         print(attr["category"], "-", attr["name"])
     print("\n------------------------------------------\n")
 
-def analyze_fingerprints(fingerprints, pointsystem):
+def analyze_fingerprints(fingerprints, pointsystem, changes=None):
     """
     Three fingerprints are compared, f1, f2, f3. 
     f1 and f2 is compared for changes.
@@ -420,7 +409,8 @@ def analyze_fingerprints(fingerprints, pointsystem):
 
     Params:
     [list] fingerprints: A list of dictionaries who each represents a fingerprint.
-    [dict] pointsystem: A dictionary for used pointsystem.
+    [CompiledPointsystem] pointsystem: Used pointsystem.
+    [list] changes: If given, found changes are added as (session, category, attribute), session is "during" or "between".
 
     Return:
     Two variables. Percentage effective change (using pointsystem) and percentage raw change (without pointsystem)
@@ -429,14 +419,20 @@ def analyze_fingerprints(fingerprints, pointsystem):
     f2 = select_fingerprint(fingerprints, "fingerprint_2")
     f3 = select_fingerprint(fingerprints, "fingerprint_3")
     
-    # Compare fingerprint 1 and 2
-    diff_1_2 = compare_fingerprints(f1, f2, pointsystem)
+    with PROFILER.stage("compare"):
+        # Compare fingerprint 1 and 2
+        diff_1_2 = compare_fingerprints(f1, f2, pointsystem)
 
-    # Compare fingerprints 1 and 3
-    diff_1_3 = compare_fingerprints(f1, f3, pointsystem)
+        # Compare fingerprints 1 and 3
+        diff_1_3 = compare_fingerprints(f1, f3, pointsystem)
+
+    if changes is not None:
+        for session, diff in [("during", diff_1_2), ("between", diff_1_3)]:
+            changes += [(session, attr["category"], attr["name"]) for attr in diff["changes"]]
 
     # Determine effective changes with pointsystem and return result
-    return get_effective_change(diff_1_2, diff_1_3, pointsystem)
+    with PROFILER.stage("points"):
+        return get_effective_change(diff_1_2, diff_1_3, pointsystem)
 
 
 def get_browser_and_pv(path):
@@ -449,7 +445,7 @@ def get_browser_and_pv(path):
     Return:
     Two variables. Browser and Prefixed version.
     """
-    components = path.split("\\")
+    components = os.path.normpath(path).split(os.sep)
     pv = components[-2]
     browser = components[-1]
 
@@ -457,6 +453,19 @@ def get_browser_and_pv(path):
 
 
 
+def get_pointsystem_path():
+    """
+    Get path to the pointsystem, both when run from the repository root and from the script folder.
+
+    Return:
+    [string] Path to pointsystem.json.
+    """
+    pointsystem_path = os.path.join(".", "Pointsystem", "pointsystem.json")
+    if os.path.exists(pointsystem_path):
+        return pointsystem_path
+    return os.path.join("..", "Pointsystem", "pointsystem.json")
+
+
 def analyze():
     """
     Main function.
@@ -467,47 +476,48 @@ def analyze():
     Positional arguments:
     [string] source: Path to folder with fingerprints.
 
+    Optional arguments:
+    -m, --materialize: Also materialize analysis_results.json from the results journal.
+    --timing: Path to json report with time spent in each stage.
+    --profile: Folder where a cProfile dump of each stage is saved, used with --timing.
+
     """
     # Arguments from commandline
     parser = argparse.ArgumentParser()
     parser.add_argument("source", help="Path to folder with fingerprints")
+    parser.add_argument("-m", "--materialize", action="store_true", help="Also materialize analysis_results.json from the results journal")
+    parser.add_argument("--timing", help="Path to json report with time spent in each stage")
+    parser.add_argument("--profile", help="Folder where a cProfile dump of each stage is saved, used with --timing")
     args = parser.parse_args()
 
+    if args.timing:
+        PROFILER.enable(args.timing, args.profile)
+
     # Check provided paths
     if not os.path.isdir(args.source):
         print("Source path does not exist.")
         exit(1)
     
     # Get Pointsystem
-    exists = os.path.exists(".\\Pointsystem\\pointsystem.json")
-    pointsystem_path = ".\\Pointsystem\\pointsystem.json" if exists else "..\\Pointsystem\\pointsystem.json"
-    pointsystem = get_json_data(pointsystem_path)
+    pointsystem = CompiledPointsystem(get_json_data(get_pointsystem_path()))
 
     # Get three fingerprints from source argument
     fingerprints = get_fingerprints(args.source)
 
     point_result, raw_result = analyze_fingerprints(fingerprints, pointsystem)
 
-    # Save results
-    results_path = ".\\results\\analysis_results.json"
-    
-    saved_results = get_json_data(results_path)
-    browser, pv = get_browser_and_pv(args.source)
-    
-    # Pointsystem results
-    saved_results[browser][pv]["test_results"].append(point_result)
-    new_average = round(sum(saved_results[browser][pv]["test_results"])/len(saved_results[browser][pv]["test_results"]), 2)
-    saved_results[browser][pv]["pointsystem_average"] = new_average
-
-    # None pointsystem results
-    saved_results[browser][pv]["raw_results"].append(raw_result)
-    new_average = round(sum(saved_results[browser][pv]["raw_results"])/len(saved_results[browser][pv]["raw_results"]), 2)
-    saved_results[browser][pv]["raw_average"] = new_average
+    # Save results, the result is only appended to the journal that analysis_results.json is materialized from,
+    # so that analysing folders one at a time does not read the whole journal for every folder
+    results_path = os.path.join(".", "results", "analysis_results.json")
 
-    with open(results_path, "w") as json_file:
-        json.dump(saved_results, json_file, indent=1)
+    browser, pv = get_browser_and_pv(args.source)
+    folder = "/".join(os.path.normpath(args.source).split(os.sep)[-3:])
+    with PROFILER.stage("write results"):
+        append_results(results_path, [(browser, pv, point_result, raw_result)], [folder])
+        if args.materialize:
+            save_materialized(results_path)
 
-    
+    PROFILER.save("analysis_script")
 
     return
 
@@ -0,0 +1,334 @@
+"""
+Batch Analysis Script
+
+Description:
+Written to be run through the commandprompt with passing arguments.
+Traverse the whole fingerprints folder in one process and analyse every browser folder.
+Browser folders are analysed in chunks, and the fingerprints of a chunk are compared in one batch (see batch_compare.py).
+The pointsystem is read once, all results are appended to the results journal at once and analysis_results.json is written once,
+giving the same result as running analysis_script.py for each browser folder.
+
+Positional arguments:
+[string] source: Path to folder with all test cases (Fingerprints).
+
+Optional arguments:
+-e, --exclude: Test cases to skip.
+-i, --include: Only analyse these test cases.
+--done: Path to text file listing already analysed browser folders. Listed folders are skipped and new ones are appended.
+--results: Path to analysis_results.json.
+-s, --store: Read fingerprints from a fingerprint store instead of the source folder.
+-w, --workers: Number of processes used to analyse browser folders in parallel.
+--db: Read fingerprints from a fingerprint database instead of the source folder, and save results with found changes in it.
+--timing: Path to json report with time spent in each stage.
+--profile: Folder where a cProfile dump of each stage is saved, used with --timing.
+-h: Print argument usage.
+
+"""
+
+
+import argparse, os, sys
+from concurrent.futures import ProcessPoolExecutor
+from analysis_script import get_json_data, get_fingerprints, get_fingerprints_from_store, get_fingerprints_from_db, intern_fingerprints, analyze_fingerprints, get_pointsystem_path
+from results_journal import append_results, save_materialized
+
+# Shared modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from fingerprint_store import FingerprintStore
+from fingerprint_db import FingerprintDatabase
+from compiled_pointsystem import CompiledPointsystem
+from value_dictionary import ValueDictionary
+from normalize import get_comparison_key
+from profiling import PROFILER
+
+# numpy is optional, without it every browser folder is compared on its own
+try:
+    from batch_compare import analyze_batch
+    NUMPY_INSTALLED = True
+except ImportError:
+    NUMPY_INSTALLED = False
+
+# Number of browser folders compared in one batch
+CHUNK_SIZE = 256
+
+
+def get_browser_folders(source, exclude):
+    """
+    Get all browser folders in the fingerprints folder.
+    Folders are sorted by name to give the same order as Complete_analysis.ps1.
+
+    Params:
+    [string] source: Path to folder with all test cases.
+    [list] exclude: Test cases to skip.
+
+    Return:
+    [list]: List of tuples (path, date, pv, browser).
+    """
+    folders = []
+    for test_case in sorted(os.listdir(source)):
+        case_path = os.path.join(source, test_case)
+        if test_case in exclude or not os.path.isdir(case_path):
+            continue
+        for pv in sorted(os.listdir(case_path)):
+            pv_path = os.path.join(case_path, pv)
+            if not os.path.isdir(pv_path):
+                continue
+            for browser in sorted(os.listdir(pv_path)):
+                browser_path = os.path.join(pv_path, browser)
+                if os.path.isdir(browser_path):
+                    folders.append((browser_path, test_case, pv, browser))
+
+    return folders
+
+
+def get_store_folders(store, source, exclude):
+    """
+    Get all browser folders in a fingerprint store, sorted by name.
+
+    Params:
+    [FingerprintStore] store: Fingerprint store.
+    [string] source: Path to folder with all test cases, used to name the folders as in done_analysing.txt.
+    [list] exclude: Test cases to skip.
+
+    Return:
+    [list]: List of tuples (path, date, pv, browser).
+    """
+    folders = []
+    for date, pv, browser in sorted({m[:3] for m in store.meta}):
+        if date not in exclude:
+            folders.append((os.path.join(source, date, pv, browser), date, pv, browser))
+
+    return folders
+
+
+def get_db_folders(db, source, exclude):
+    """
+    Get all browser folders in a fingerprint database, sorted by name.
+
+    Params:
+    [FingerprintDatabase] db: Fingerprint database.
+    [string] source: Path to folder with all test cases, used to name the folders as in done_analysing.txt.
+    [list] exclude: Test cases to skip.
+
+    Return:
+    [list]: List of tuples (path, date, pv, browser).
+    """
+    folders = []
+    for date, pv, browser in db.get_browser_folders():
+        if date not in exclude:
+            folders.append((os.path.join(source, date, pv, browser), date, pv, browser))
+
+    return folders
+
+
+def get_done_list(path):
+    """
+    Read list of already analysed browser folders.
+
+    Params:
+    [string] path: Path to text file, one folder per line.
+
+    Return:
+    [set]: Set of analysed folders.
+    """
+    if not path or not os.path.isfile(path):
+        return set()
+
+    with open(path, "r") as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+# Pointsystem, fingerprint store, database and value dictionary used by analyze_folders, set by init_worker in each process
+worker_state = {}
+
+
+def init_worker(pointsystem, store_path, db_path, timing=False):
+    """
+    Prepare a process for analysing browser folders.
+
+    Params:
+    [CompiledPointsystem] pointsystem: Used pointsystem.
+    [string] store_path: Path to fingerprint store, or None.
+    [string] db_path: Path to fingerprint database, or None. If neither is given, fingerprints are read from folders.
+    [bool] timing: Record stages in a worker process, they are returned by analyze_in_worker.
+
+    Return:
+    -
+    """
+    if timing:
+        PROFILER.enable_worker()
+    worker_state["pointsystem"] = pointsystem
+    worker_state["store"] = FingerprintStore.load(store_path) if store_path else None
+    worker_state["db"] = FingerprintDatabase(db_path) if db_path else None
+    # Values are interned across all folders analysed by the process
+    worker_state["values"] = ValueDictionary(get_comparison_key)
+
+
+def analyze_groups(groups, pointsystem, values):
+    """
+    Analyse the fingerprints of many browser folders, compared in one batch if numpy is installed.
+
+    Params:
+    [list] groups: List with the fingerprints of each browser folder.
+    [CompiledPointsystem] pointsystem: Used pointsystem.
+    [ValueDictionary] values: Value dictionary using get_comparison_key, the fingerprints are interned with it.
+
+    Return:
+    Two variables. List with percentage effective change and percentage raw change of each folder,
+    and list with the changes of each folder as given by analyze_fingerprints.
+    """
+    for fingerprints in groups:
+        intern_fingerprints(fingerprints, values)
+
+    changes = []
+    if NUMPY_INSTALLED:
+        results = analyze_batch(groups, pointsystem, values, changes)
+    else:
+        results = []
+        for fingerprints in groups:
+            changes.append([])
+            results.append(analyze_fingerprints(fingerprints, pointsystem, changes[-1]))
+
+    return results, changes
+
+
+def analyze_folders(folders):
+    """
+    Analyse a chunk of browser folders. Results are returned instead of saved, so that results can be merged by a single writer.
+
+    Params:
+    [list] folders: List of tuples (path, date, pv, browser).
+
+    Return:
+    [list]: (browser, pv, point_result, raw_result, changes) of each folder, changes as given by analyze_fingerprints.
+    """
+    groups = []
+    for path, date, pv, browser in folders:
+        print(f"Working with {path}")
+        if worker_state["store"]:
+            fingerprints = get_fingerprints_from_store(worker_state["store"], date, pv, browser)
+        elif worker_state["db"]:
+            fingerprints = get_fingerprints_from_db(worker_state["db"], date, pv, browser)
+        else:
+            fingerprints = get_fingerprints(path, date, pv, browser)
+        groups.append(fingerprints)
+
+    results, changes = analyze_groups(groups, worker_state["pointsystem"], worker_state["values"])
+
+    return [(browser, pv, point_result, raw_result, folder_changes)
+            for (_, _, pv, browser), (point_result, raw_result), folder_changes in zip(folders, results, changes)]
+
+
+def analyze_in_worker(folders):
+    """
+    Analyse a chunk of browser folders in a worker process.
+
+    Params:
+    [list] folders: List of tuples (path, date, pv, browser).
+
+    Return:
+    Two variables. Results from analyze_folders and the stages recorded while analysing.
+    """
+    return analyze_folders(folders), PROFILER.take_stages()
+
+
+def analyze_all(folders, pointsystem, store_path=None, db_path=None, workers=1):
+    """
+    Analyse all given browser folders, in parallel if more than one worker is used.
+
+    Params:
+    [list] folders: List of tuples (path, date, pv, browser).
+    [CompiledPointsystem] pointsystem: Used pointsystem.
+    [string] store_path: If given, fingerprints are read from this fingerprint store instead of the folders.
+    [string] db_path: If given, fingerprints are read from this fingerprint database instead of the folders.
+    [int] workers: Number of processes.
+
+    Return:
+    [list]: Results from analyze_folders, in the same order as folders.
+    """
+    chunks = [folders[i:i + CHUNK_SIZE] for i in range(0, len(folders), CHUNK_SIZE)]
+    # Smaller chunks when there are too few to keep all workers busy
+    if workers > 1 and len(chunks) < workers * 4:
+        size = max(1, -(-len(folders) // (workers * 4)))
+        chunks = [folders[i:i + size] for i in range(0, len(folders), size)]
+
+    if workers > 1:
+        results = []
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(pointsystem, store_path, db_path, PROFILER.enabled)) as executor:
+            for chunk, stages in executor.map(analyze_in_worker, chunks):
+                PROFILER.merge_stages(stages)
+                results.extend(chunk)
+        return results
+
+    init_worker(pointsystem, store_path, db_path)
+    return [result for chunk in chunks for result in analyze_folders(chunk)]
+
+
+def main():
+    """
+    Main function.
+    Analyse all browser folders in the fingerprints folder and save the results once.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", help="Path to folder with all test cases")
+    parser.add_argument("-e", "--exclude", nargs="*", default=[], help="Test cases to skip")
+    parser.add_argument("-i", "--include", nargs="*", help="Only analyse these test cases")
+    parser.add_argument("--done", help="Text file with already analysed browser folders")
+    parser.add_argument("--results", default=os.path.join(".", "results", "analysis_results.json"), help="Path to analysis_results.json")
+    parser.add_argument("-s", "--store", help="Path to fingerprint store")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Number of processes")
+    parser.add_argument("--db", help="Path to fingerprint database")
+    parser.add_argument("--timing", help="Path to json report with time spent in each stage")
+    parser.add_argument("--profile", help="Folder where a cProfile dump of each stage is saved, used with --timing")
+    args = parser.parse_args()
+
+    if args.timing:
+        PROFILER.enable(args.timing, args.profile)
+
+    if not args.store and not os.path.isdir(args.source):
+        print("Source path does not exist.")
+        exit(1)
+
+    pointsystem = CompiledPointsystem(get_json_data(get_pointsystem_path()))
+
+    with PROFILER.stage("list"):
+        db = FingerprintDatabase(args.db) if args.db else None
+        if args.store:
+            folders = get_store_folders(FingerprintStore.load(args.store), args.source, args.exclude)
+        elif db:
+            folders = get_db_folders(db, args.source, args.exclude)
+        else:
+            folders = get_browser_folders(args.source, args.exclude)
+        if args.include:
+            folders = [f for f in folders if f[1] in args.include]
+
+        done = get_done_list(args.done)
+        folders = [f for f in folders if f[0] not in done]
+
+    with PROFILER.stage("analysis"):
+        results = analyze_all(folders, pointsystem, args.store, args.db, args.workers)
+
+    # Results are appended to the journal once, and analysis_results.json is materialized from it.
+    # A folder that is analysed again replaces its earlier result
+    with PROFILER.stage("write results"):
+        append_results(args.results, [result[:4] for result in results], ["/".join(f[1:]) for f in folders])
+        save_materialized(args.results)
+
+    if db:
+        with PROFILER.stage("db"):
+            for (_, date, _, _), (browser, pv, point_result, raw_result, changes) in zip(folders, results):
+                db.add_comparison(date, pv, browser, point_result, raw_result, changes)
+            db.close()
+
+    # Only mark folders as done once their results are saved
+    if args.done and folders:
+        with open(args.done, "a") as f:
+            for path, _, _, _ in folders:
+                f.write(path + "\n")
+
+    PROFILER.save("batch_analysis")
+
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""
+Batch Compare
+
+Description:
+Compare many pairs of fingerprints at once, giving the same result as compare_fingerprints for each pair.
+The values of each fingerprint are interned once into canonical ids (see intern_fingerprints), and all pairs are then
+compared as one numpy array operation, giving a mask of changed attributes for every pair.
+Media devices are compared as in compare_fingerprints, but only for pairs where they differ.
+The change records of a pair, with both values and the ignored changes, are only built when asked for.
+
+Pairs where one fingerprint has an attribute that the other does not are rare and compared with
+compare_fingerprints, so missing attributes are reported and handled exactly as before. Requires numpy.
+
+"""
+
+
+import os, sys
+import numpy as np
+from analysis_script import compare_fingerprints, lists_with_dict_changes, select_fingerprint, get_effective_change, intern_fingerprints
+
+# Shared modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from profiling import PROFILER
+
+
+class BatchComparison:
+    """
+    Differences found between many pairs of fingerprints.
+
+    pairs: List of (f1, f2), the compared fingerprints.
+    changed: Numpy bool array (pairs, attributes), True where the value of an attribute differs. Media devices are not included.
+    num_total: Numpy array with number of counted attributes of each pair, as in compare_fingerprints.
+    num_changed: Numpy array with number of counted changes of each pair, as in compare_fingerprints.
+    """
+
+    def __init__(self, pairs, pointsystem, values):
+        """
+        Compare all pairs.
+
+        Params:
+        [list] pairs: List of (f1, f2), fingerprints may be used in several pairs.
+        [CompiledPointsystem] pointsystem: Used pointsystem.
+        [ValueDictionary] values: Value dictionary using get_comparison_key, used for fingerprints that are not interned.
+            Fingerprints that are already interned must have been interned with the same dictionary.
+        """
+        self.pairs = pairs
+        self.pointsystem = pointsystem
+        self.media = {}
+        self.fallback = {}
+        self.positions = {}
+
+        # Each fingerprint is interned and turned into a row of ids once, -1 for missing attributes
+        rows = {}
+        fingerprints = []
+        for pair in pairs:
+            for fingerprint in pair:
+                if id(fingerprint) not in rows:
+                    rows[id(fingerprint)] = len(fingerprints)
+                    fingerprints.append(fingerprint)
+        intern_fingerprints([f for f in fingerprints if f.ids is None], values)
+
+        schema = fingerprints[0].schema if fingerprints else None
+        width = max((len(f.ids) for f in fingerprints), default=0)
+        ids = np.full((len(fingerprints), width), -1, dtype=np.int64)
+        for row, fingerprint in enumerate(fingerprints):
+            ids[row, :len(fingerprint.ids)] = [-1 if i is None else i for i in fingerprint.ids]
+
+        # Attributes given points, and media devices, of all attributes the fingerprints have
+        self.scored = np.zeros(width, dtype=bool)
+        self.is_media = np.zeros(width, dtype=bool)
+        for index in np.flatnonzero((ids >= 0).any(axis=0)):
+            category, attribute = schema.keys[index]
+            if attribute == "Media Devices":
+                self.is_media[index] = True
+            else:
+                self.scored[index] = pointsystem.is_scored(category, attribute)
+        counted = self.scored | self.is_media
+
+        first = np.array([rows[id(f1)] for f1, _ in pairs], dtype=np.int64)
+        second = np.array([rows[id(f2)] for _, f2 in pairs], dtype=np.int64)
+        ids1 = ids[first]
+        ids2 = ids[second]
+        present = ids1 >= 0
+
+        self.changed = (ids1 != ids2) & present & ~self.is_media
+        self.num_total = (present & counted).sum(axis=1)
+        self.num_changed = (self.changed & self.scored).sum(axis=1)
+
+        # Media devices are only compared where their canonical ids differ, or their number may differ
+        for index in np.flatnonzero(self.is_media):
+            for i in np.flatnonzero(present[:, index] & (ids2[:, index] >= 0)):
+                f1, f2 = pairs[i]
+                value1, value2 = f1.values[index], f2.values[index]
+                if ids1[i, index] == ids2[i, index] and len(value1) == len(value2):
+                    continue
+                found = []
+                if len(value1) != len(value2):
+                    found.append(("Media Devices: Quantity", len(value1), len(value2)))
+                for key, changed in lists_with_dict_changes(value1, value2).items():
+                    if changed:
+                        found.append((f"Media Devices: {key}", value1, value2))
+                if found:
+                    self.media.setdefault(int(i), {})[index] = found
+                    self.num_changed[i] += len(found)
+
+        # Pairs where an attribute is missing in one of the fingerprints
+        for i in np.flatnonzero((present != (ids2 >= 0)).any(axis=1)):
+            self.fallback[int(i)] = compare_fingerprints(*pairs[i], pointsystem)
+            self.num_total[i] = self.fallback[int(i)]["num_total"]
+            self.num_changed[i] = self.fallback[int(i)]["num_changed"]
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def get_changes(self, i):
+        """
+        Get the counted changes of a pair, without their values.
+
+        Params:
+        [int] i: Index of pair.
+
+        Return:
+        [list]: List of dictionaries with category and name, in the same order as "changes" of compare_fingerprints.
+        """
+        if i in self.fallback:
+            return [{"category": c["category"], "name": c["name"]} for c in self.fallback[i]["changes"]]
+
+        f1 = self.pairs[i][0]
+        media = self.media.get(i, {})
+        indexes = [int(index) for index in np.flatnonzero(self.changed[i] & self.scored)] + list(media)
+        indexes.sort(key=self.get_positions(f1).__getitem__)
+
+        changes = []
+        for index in indexes:
+            category, attribute = f1.schema.keys[index]
+            if index in media:
+                changes += [{"category": category, "name": name} for name, _, _ in media[index]]
+            else:
+                changes.append({"category": category, "name": attribute})
+
+        return changes
+
+    def get_positions(self, fingerprint):
+        """
+        Get the position of each attribute in the original order of a fingerprint.
+        Positions are kept per layout, which is shared by all fingerprints with the same attributes in the same order.
+
+        Params:
+        [Fingerprint] fingerprint: Fingerprint.
+
+        Return:
+        [dict]: Attribute index mapped to position.
+        """
+        positions = self.positions.get(id(fingerprint.layout))
+        if positions is None:
+            positions = self.positions[id(fingerprint.layout)] = {index: p for p, index in enumerate(fingerprint.layout[1])}
+        return positions
+
+    def get_result(self, i):
+        """
+        Build the full result of a pair, with values of changes and ignored changes.
+
+        Params:
+        [int] i: Index of pair.
+
+        Return:
+        [dict]: The same dictionary as compare_fingerprints gives for the pair.
+        """
+        if i in self.fallback:
+            return self.fallback[i]
+
+        f1, f2 = self.pairs[i]
+        media = self.media.get(i, {})
+        result = {
+            "num_total": int(self.num_total[i]),
+            "num_changed": int(self.num_changed[i]),
+            "changes": [],
+            "ignored_changes": []
+        }
+        for index, category, attribute, value1 in f1.items():
+            if index in media:
+                for name, media1, media2 in media[index]:
+                    result["changes"].append({"category": category, "name": name, "value1": media1, "value2": media2})
+            elif self.changed[i, index]:
+                change = {
+                    "category": category,
+                    "name": attribute,
+                    "value1": value1,
+                    "value2": f2.values[index]
+                }
+                if self.scored[index]:
+                    result["changes"].append(change)
+                else:
+                    result["ignored_changes"].append(change)
+
+        return result
+
+
+def analyze_batch(groups, pointsystem, values, changes=None):
+    """
+    Analyse many browser folders at once, giving the same result as analyze_fingerprints for each folder.
+    The pairs f1 and f2, and f1 and f3, of all folders are compared in one batch.
+
+    Params:
+    [list] groups: List with the fingerprints of each browser folder.
+    [CompiledPointsystem] pointsystem: Used pointsystem.
+    [ValueDictionary] values: Value dictionary using get_comparison_key.
+    [list] changes: If given, a list of found changes is added for each folder, see analyze_fingerprints.
+
+    Return:
+    [list]: Percentage effective change and percentage raw change of each folder.
+    """
+    pairs = []
+    for fingerprints in groups:
+        f1 = select_fingerprint(fingerprints, "fingerprint_1")
+        pairs += [(f1, select_fingerprint(fingerprints, "fingerprint_2")), (f1, select_fingerprint(fingerprints, "fingerprint_3"))]
+
+    with PROFILER.stage("compare"):
+        batch = BatchComparison(pairs, pointsystem, values)
+
+    results = []
+    for g in range(len(groups)):
+        diff_1_2 = {"changes": batch.get_changes(2 * g)}
+        diff_1_3 = {"changes": batch.get_changes(2 * g + 1)}
+        if changes is not None:
+            changes.append([(session, attr["category"], attr["name"])
+                            for session, diff in [("during", diff_1_2), ("between", diff_1_3)] for attr in diff["changes"]])
+        with PROFILER.stage("points"):
+            results.append(get_effective_change(diff_1_2, diff_1_3, pointsystem))
+
+    return results
@@ -0,0 +1,267 @@
+"""
+Distance Matrix Script
+
+Description:
+Written to be run through the commandprompt with passing arguments.
+Compare every fingerprint with every other fingerprint, across days, PVs and browsers, and save a weighted distance matrix.
+The distance between two fingerprints is the sum of points (from the pointsystem) of the attributes that differ.
+Attributes that are friends are counted once, with the highest points in the group.
+Attributes are compared as in compare_fingerprints: strings without case and surrounding whitespace,
+lists in any order, and media devices by quantity, labels and deviceIds.
+Unlike compare_fingerprints, labels and deviceIds are compared in both directions so that the distance is symmetric.
+
+The matrix is computed in blocks with numpy to bound memory, and saved as a .npy file together with a .json file
+describing the rows. Only the upper triangle is saved, as a condensed vector of n * (n - 1) / 2 distances in the
+layout of scipy's pdist: the distances of row 0 to rows 1..n-1, then of row 1 to rows 2..n-1, and so on.
+The matrix is symmetric with a zero diagonal, so this is half the size of the square matrix.
+Use get_distance, or scipy.spatial.distance.squareform, to read it. Requires numpy.
+
+Positional arguments:
+[string] source: Path to fingerprint store (.npz) or fingerprints folder.
+
+Optional arguments:
+-o, --output: Path to output without file extension.
+-b, --block-size: Number of fingerprints compared at once in each direction.
+-h: Print argument usage.
+
+"""
+
+
+import argparse, json, os, sys
+from analysis_script import get_json_data, get_pointsystem_path
+
+# Shared modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from fingerprint_store import FingerprintStore
+from compiled_pointsystem import CompiledPointsystem
+from normalize import get_comparison_key
+import numpy as np
+
+
+def get_media_device_keys(devices):
+    """
+    Get keys for the three compared properties of media devices.
+
+    Params:
+    [list] devices: List of media device dictionaries.
+
+    Return:
+    [dict]: Attribute name in the pointsystem mapped to key.
+    """
+    return {
+        "Media Devices: Quantity": len(devices),
+        "Media Devices: label": frozenset(d.get("label") for d in devices),
+        "Media Devices: deviceId": frozenset(d.get("deviceId") for d in devices)
+    }
+
+
+def get_friend_groups(pointsystem, keys):
+    """
+    Join attributes that are friends into groups, using union-find.
+
+    Params:
+    [CompiledPointsystem] pointsystem: Used pointsystem.
+    [list] keys: (category, attribute) of compared attributes.
+
+    Return:
+    [list]: Lists of (category, attribute), one list per group.
+    """
+    parent = {key: key for key in keys}
+
+    def find(key):
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    for key in keys:
+        for friend in pointsystem.friends.get(key, ()):
+            if friend in parent:
+                parent[find(key)] = find(friend)
+
+    groups = {}
+    for key in keys:
+        groups.setdefault(find(key), []).append(key)
+    return list(groups.values())
+
+
+def get_features(store, pointsystem):
+    """
+    Encode all compared attributes of all fingerprints as integer features.
+    Every feature holds a canonical id per fingerprint, -1 if the fingerprint does not have the attribute.
+
+    Params:
+    [FingerprintStore] store: Fingerprint store.
+    [CompiledPointsystem] pointsystem: Used pointsystem.
+
+    Return:
+    Three variables. Numpy array (fingerprints, features), list of (category, attribute) per feature
+    and list of (feature indexes, points) per friend group.
+    """
+    codes = store.get_codes()
+    features = []
+    keys = []
+
+    for column, (category, attribute) in enumerate(store.columns):
+        if attribute == "Media Devices":
+            # One feature per compared property of the media devices
+            per_value = [get_media_device_keys(value) for value in store.values[column]]
+            names = ["Media Devices: Quantity", "Media Devices: label", "Media Devices: deviceId"]
+            canonical = [[v[name] for v in per_value] for name in names]
+        elif pointsystem.groups.get((category, attribute)):
+            names = [attribute]
+            canonical = [[get_comparison_key(normalized) for normalized in store.normalized[column]]]
+        else:
+            continue
+
+        for name, values in zip(names, canonical):
+            ids = {}
+            lookup = np.array([ids.setdefault(key, len(ids)) for key in values] + [-1], dtype=np.int32)
+            # Code -1 (missing) is mapped to the last element, -1
+            features.append(lookup[codes[:, column]])
+            keys.append((category, name))
+
+    matrix = np.stack(features, axis=1) if features else np.zeros((len(store.meta), 0), dtype=np.int32)
+    index = {key: i for i, key in enumerate(keys)}
+
+    groups = []
+    for group in get_friend_groups(pointsystem, keys):
+        points = max(pointsystem.points.get(key, 0) for key in group)
+        if points:
+            groups.append(([index[key] for key in group], points))
+
+    return matrix, keys, groups
+
+
+def compute_block(features_a, features_b, groups, dtype):
+    """
+    Compute distances between two blocks of fingerprints.
+
+    Params:
+    [numpy array] features_a: Features (rows, features) of first block.
+    [numpy array] features_b: Features (rows, features) of second block.
+    [list] groups: List of (feature indexes, points) per friend group.
+    dtype: numpy type of the distances.
+
+    Return:
+    Numpy array (rows a, rows b) of distances.
+    """
+    a = features_a[:, None, :]
+    b = features_b[None, :, :]
+    # A missing attribute is never counted as a change, as in compare_fingerprints
+    changed = (a != b) & (a >= 0) & (b >= 0)
+
+    distance = np.zeros((features_a.shape[0], features_b.shape[0]), dtype=dtype)
+    for indexes, points in groups:
+        group_changed = changed[:, :, indexes[0]] if len(indexes) == 1 else changed[:, :, indexes].any(axis=2)
+        distance += group_changed.astype(dtype) * dtype(points)
+    return distance
+
+
+def get_condensed_index(n, i, j):
+    """
+    Get the position of the distance between two different fingerprints in the condensed matrix.
+
+    Params:
+    [int] n: Number of fingerprints.
+    [int] i: Row of first fingerprint.
+    [int] j: Row of second fingerprint, not equal to i.
+
+    Return:
+    [int]: Position in the condensed matrix.
+    """
+    if i > j:
+        i, j = j, i
+    return n * i - i * (i + 1) // 2 + j - i - 1
+
+
+def get_distance(condensed, n, i, j):
+    """
+    Get the distance between two fingerprints from the condensed matrix.
+
+    Params:
+    [numpy array] condensed: Condensed distance matrix.
+    [int] n: Number of fingerprints.
+    [int] i: Row of first fingerprint.
+    [int] j: Row of second fingerprint.
+
+    Return:
+    [int]: Distance, 0 if i and j are the same fingerprint.
+    """
+    if i == j:
+        return 0
+    return int(condensed[get_condensed_index(n, i, j)])
+
+
+def compute_distance_matrix(features, groups, output_path, block_size):
+    """
+    Compute the condensed distance matrix block by block, and write it to a memory mapped .npy file.
+    Blocks on and above the diagonal of one strip of rows are computed, and the part of each row above
+    the diagonal is written as one contiguous slice.
+
+    Params:
+    [numpy array] features: Features (fingerprints, features).
+    [list] groups: List of (feature indexes, points) per friend group.
+    [string] output_path: Path to .npy file.
+    [int] block_size: Number of fingerprints in a block.
+
+    Return:
+    Memory mapped numpy array with the condensed distance matrix.
+    """
+    n = features.shape[0]
+    dtype = np.uint16 if sum(points for _, points in groups) <= np.iinfo(np.uint16).max else np.uint32
+    condensed = np.lib.format.open_memmap(output_path, mode="w+", dtype=dtype, shape=(n * (n - 1) // 2,))
+
+    for i in range(0, n, block_size):
+        rows = features[i:i + block_size]
+        strip = np.empty((rows.shape[0], n - i), dtype=dtype)
+        for j in range(i, n, block_size):
+            strip[:, j - i:j - i + block_size] = compute_block(rows, features[j:j + block_size], groups, dtype)
+
+        for r in range(rows.shape[0]):
+            row = i + r
+            if row < n - 1:
+                start = get_condensed_index(n, row, row + 1)
+                condensed[start:start + n - row - 1] = strip[r, r + 1:]
+
+    condensed.flush()
+    return condensed
+
+
+def main():
+    """
+    Main function.
+    Compute and save the distance matrix of all fingerprints.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", help="Path to fingerprint store (.npz) or fingerprints folder")
+    parser.add_argument("-o", "--output", default=os.path.join(".", "results", "distance_matrix"), help="Path to output without file extension")
+    parser.add_argument("-b", "--block-size", type=int, default=512, help="Number of fingerprints compared at once")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.source):
+        store = FingerprintStore.from_folder(args.source)
+    elif os.path.isfile(args.source):
+        store = FingerprintStore.load(args.source)
+    else:
+        print("Source path does not exist.")
+        exit(1)
+
+    pointsystem = CompiledPointsystem(get_json_data(get_pointsystem_path()))
+    features, keys, groups = get_features(store, pointsystem)
+
+    compute_distance_matrix(features, groups, args.output + ".npy", args.block_size)
+
+    with open(args.output + ".json", "w") as json_file:
+        json.dump({
+            "rows": store.meta,
+            "layout": "condensed",
+            "attributes": keys,
+            "max_distance": sum(points for _, points in groups)
+        }, json_file, indent=1)
+
+    print(f"Saved condensed distance matrix of {len(store.meta)} fingerprints to {args.output}.npy")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Results Journal
+
+Description:
+Analysis results are recorded in an append-only journal (json lines), one line per analysed browser folder.
+analysis_results.json is materialized from the template and the journal, with averages kept as running sums.
+A crash while appending can at most leave an incomplete last line, which is ignored and removed on the next append.
+A result may be recorded with the browser folder it belongs to. When a folder is analysed again, only its latest result
+is used and it keeps the place of the first one, so that re-analysing changed fingerprints does not count a folder twice.
+
+Can be run through the commandprompt to materialize analysis_results.json on demand.
+
+Optional arguments:
+--results: Path to analysis_results.json.
+-h: Print argument usage.
+
+"""
+
+
+import os, sys, json, argparse
+
+# Shared modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from atomic_write import write_atomic
+
+
+def get_journal_path(results_path):
+    """
+    Get path to the journal belonging to a results file.
+
+    Params:
+    [string] results_path: Path to analysis_results.json.
+
+    Return:
+    [string]: Path to journal.
+    """
+    return os.path.join(os.path.dirname(results_path), "analysis_journal.jsonl")
+
+
+def get_template_path(results_path):
+    """
+    Get path to the empty results template belonging to a results file.
+
+    Params:
+    [string] results_path: Path to analysis_results.json.
+
+    Return:
+    [string]: Path to template.
+    """
+    return os.path.join(os.path.dirname(results_path), "analysis_results - Template.json")
+
+
+def remove_incomplete_line(journal_path):
+    """
+    Remove a last line that was not completely written.
+
+    Params:
+    [string] journal_path: Path to journal.
+
+    Return:
+    -
+    """
+    with open(journal_path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            step = min(4096, position)
+            f.seek(position - step)
+            block = f.read(step)
+            newline = block.rfind(b"\n")
+            if newline >= 0:
+                position = position - step + newline + 1
+                break
+            position -= step
+
+        if position != end:
+            f.truncate(position)
+
+
+def seed_journal(journal_path, results_path):
+    """
+    Create a journal from an existing analysis_results.json, so results saved before the journal existed are kept.
+
+    Params:
+    [string] journal_path: Path to journal.
+    [string] results_path: Path to analysis_results.json.
+
+    Return:
+    -
+    """
+    records = []
+    if os.path.isfile(results_path):
+        with open(results_path, "r") as json_file:
+            saved_results = json.load(json_file)
+        for browser in saved_results:
+            for pv in saved_results[browser]:
+                saved = saved_results[browser][pv]
+                for point_result, raw_result in zip(saved["test_results"], saved["raw_results"]):
+                    records.append((browser, pv, point_result, raw_result))
+
+    write_atomic(journal_path, lambda f: f.writelines(encode_record(record) for record in records))
+
+
+def encode_record(record, folder=None):
+    """
+    Encode one result as a journal line.
+
+    Params:
+    [tuple] record: (browser, pv, point_result, raw_result).
+    [string] folder: Browser folder of the result, date/pv/browser. Not saved if None.
+
+    Return:
+    [string]: Json line.
+    """
+    browser, pv, point_result, raw_result = record
+    line = {"browser": browser, "pv": pv, "point_result": point_result, "raw_result": raw_result}
+    if folder is not None:
+        line["folder"] = folder
+    return json.dumps(line) + "\n"
+
+
+def append_results(results_path, records, folders=None):
+    """
+    Append results to the journal. The journal is flushed to disk before returning.
+
+    Params:
+    [string] results_path: Path to analysis_results.json.
+    [list] records: List of (browser, pv, point_result, raw_result).
+    [list] folders: Browser folder of each record, date/pv/browser. A later result of a folder replaces the earlier one.
+
+    Return:
+    -
+    """
+    journal_path = get_journal_path(results_path)
+    if not os.path.isfile(journal_path):
+        seed_journal(journal_path, results_path)
+    else:
+        remove_incomplete_line(journal_path)
+
+    with open(journal_path, "a") as f:
+        if folders is None:
+            folders = [None] * len(records)
+        f.write("".join(encode_record(record, folder) for record, folder in zip(records, folders)))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_journal(journal_path):
+    """
+    Read all complete results in the journal.
+
+    Params:
+    [string] journal_path: Path to journal.
+
+    Return:
+    Generator of (folder, browser, pv, point_result, raw_result), folder is None if not recorded.
+    """
+    if not os.path.isfile(journal_path):
+        return
+
+    with open(journal_path, "r") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            record = json.loads(line)
+            yield record.get("folder"), record["browser"], record["pv"], record["point_result"], record["raw_result"]
+
+
+def get_latest_results(journal_path):
+    """
+    Get the results of the journal, with only the latest result of each browser folder.
+
+    Params:
+    [string] journal_path: Path to journal.
+
+    Return:
+    [list]: List of (browser, pv, point_result, raw_result) in journal order.
+    """
+    results = {}
+    for folder, browser, pv, point_result, raw_result in read_journal(journal_path):
+        # Results without a folder are never replaced
+        key = folder if folder is not None else len(results)
+        # A replaced result keeps the place of the first one
+        results[key] = (browser, pv, point_result, raw_result)
+    return list(results.values())
+
+
+def materialize(results_path):
+    """
+    Build the content of analysis_results.json from the template and the journal.
+    Averages are computed from running sums while the journal is read.
+    If there is no journal, it is first created from the existing analysis_results.json.
+
+    Params:
+    [string] results_path: Path to analysis_results.json.
+
+    Return:
+    [dict]: Content of analysis_results.json.
+    """
+    journal_path = get_journal_path(results_path)
+    if not os.path.isfile(journal_path):
+        seed_journal(journal_path, results_path)
+
+    with open(get_template_path(results_path), "r") as json_file:
+        saved_results = json.load(json_file)
+
+    sums = {}
+    for browser, pv, point_result, raw_result in get_latest_results(journal_path):
+        saved = saved_results[browser][pv]
+        saved["test_results"].append(point_result)
+        saved["raw_results"].append(raw_result)
+
+        point_sum, raw_sum = sums.get((browser, pv), (0, 0))
+        sums[(browser, pv)] = (point_sum + point_result, raw_sum + raw_result)
+
+    for browser, pv in sums:
+        saved = saved_results[browser][pv]
+        point_sum, raw_sum = sums[(browser, pv)]
+        saved["pointsystem_average"] = round(point_sum/len(saved["test_results"]), 2)
+        saved["raw_average"] = round(raw_sum/len(saved["raw_results"]), 2)
+
+    return saved_results
+
+
+def save_materialized(results_path):
+    """
+    Materialize and save analysis_results.json.
+
+    Params:
+    [string] results_path: Path to analysis_results.json.
+
+    Return:
+    -
+    """
+    saved_results = materialize(results_path)
+
+    write_atomic(results_path, lambda json_file: json.dump(saved_results, json_file, indent=1))
+
+
+def main():
+    """
+    Main function.
+    Materialize analysis_results.json from the journal.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--results", default=os.path.join(".", "results", "analysis_results.json"), help="Path to analysis_results.json")
+    args = parser.parse_args()
+
+    save_materialized(args.results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""
+Atomic Write
+
+Description:
+Files that are rewritten as a whole (caches, states, stores, materialized results) are written through write_atomic.
+The content is written to a temporary file next to the target, flushed to disk and then moved over the target.
+Replacing a file is atomic, so a crash leaves either the old or the new file, never a half-written one.
+
+"""
+
+
+import os
+
+
+def write_atomic(path, write, binary=False):
+    """
+    Write a file through a temporary file that replaces it once complete.
+
+    Params:
+    [string] path: Path to file.
+    [function] write: Called with the open temporary file, writes the content.
+    [bool] binary: Open the temporary file in binary mode.
+
+    Return:
+    -
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb" if binary else "w") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
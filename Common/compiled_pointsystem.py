@@ -0,0 +1,131 @@
+"""
+Compiled Pointsystem
+
+Description:
+The pointsystem from Pointsystem/pointsystem.json, validated and flattened once when loaded.
+Attributes are keyed by (category, attribute), with the points of their group and their friends as a set,
+and max points and number of attributes are calculated once.
+
+"""
+
+
+class CompiledPointsystem:
+    """
+    Flattened pointsystem.
+
+    groups: (category, attribute) mapped to its group, or 0 if the attribute is not given points.
+    points: (category, attribute) mapped to the points of its group, 0 if not given points.
+    friends: (category, attribute) mapped to a frozenset of (category, attribute) of its friends.
+    bonus: Bonus multiplier.
+    max_points: Max available points.
+    total_attr: Number of counted attributes.
+    """
+
+    def __init__(self, pointsystem):
+        """
+        Validate and compile a pointsystem. Will exit if the pointsystem is invalid.
+
+        Params:
+        [dict] pointsystem: Pointsystem as read from pointsystem.json.
+        """
+        errors = validate_pointsystem(pointsystem)
+        if errors:
+            for error in errors:
+                print(f"ERROR: {error}")
+            exit(1)
+
+        self.weights = pointsystem["pointsystem"]
+        self.bonus = self.weights["bonus"]
+        self.groups = {}
+        self.points = {}
+        self.friends = {}
+
+        for category in pointsystem:
+            if category == "pointsystem":
+                continue
+            for attribute in pointsystem[category]:
+                group, friends = pointsystem[category][attribute]
+                key = (category, attribute)
+                self.groups[key] = group
+                self.points[key] = self.weights[group] if group else 0
+                self.friends[key] = frozenset(tuple(friend.split(";", 1)) for friend in friends)
+
+        self.max_points, self.total_attr = self.get_max_points()
+
+    def is_scored(self, category, attribute):
+        """
+        Check if an attribute is given points.
+
+        Params:
+        [string] category: Category.
+        [string] attribute: Attribute.
+
+        Return:
+        [bool]: True if given points.
+        """
+        return bool(self.groups[(category, attribute)])
+
+    def get_max_points(self):
+        """
+        Calculate max available points.
+        Of attributes that are friends, only the first one is counted.
+
+        Return:
+        Two variables. Max points and number of attributes.
+        """
+        max_points = 0
+        total_attr = 0
+        included_attr = set()
+        for key in self.groups:
+            if not self.groups[key]:
+                continue
+
+            # Check if attr have friends
+            if self.friends[key]:
+                if self.friends[key].isdisjoint(included_attr):
+                    max_points += self.points[key]
+                    included_attr.add(key)
+                    total_attr += 1
+            else:
+                max_points += self.points[key]
+                total_attr += 1
+
+        return max_points * self.bonus, total_attr * self.bonus
+
+
+def validate_pointsystem(pointsystem):
+    """
+    Check that a pointsystem is correctly written.
+
+    Params:
+    [dict] pointsystem: Pointsystem as read from pointsystem.json.
+
+    Return:
+    [list]: Error messages, empty if valid.
+    """
+    if "pointsystem" not in pointsystem:
+        return ["The pointsystem is missing the 'pointsystem' category with group points."]
+
+    errors = []
+    weights = pointsystem["pointsystem"]
+    if "bonus" not in weights:
+        errors.append("The pointsystem is missing 'bonus'.")
+
+    for category in pointsystem:
+        if category == "pointsystem":
+            continue
+        for attribute in pointsystem[category]:
+            entry = pointsystem[category][attribute]
+            if not isinstance(entry, list) or len(entry) != 2 or not isinstance(entry[1], list):
+                errors.append(f"'{category};{attribute}' must be [group, [friends]].")
+                continue
+
+            group, friends = entry
+            if group and group not in weights:
+                errors.append(f"'{category};{attribute}' has unknown group '{group}'.")
+            for friend in friends:
+                friend_category, _, friend_attribute = friend.partition(";")
+                if friend_attribute not in pointsystem.get(friend_category, {}):
+                    errors.append(f"'{category};{attribute}' has unknown friend '{friend}'.")
+
+    return errors
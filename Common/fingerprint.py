@@ -0,0 +1,242 @@
+"""
+Fingerprint
+
+Description:
+Fingerprint model shared by all scripts. A fingerprint carries its test date, PV, browser and test number,
+and its attribute values in a flat list indexed by a global attribute schema, so that an attribute is found by index.
+The order of categories and attributes of each fingerprint is kept, so that a saved fingerprint is identical
+to the extracted one and fingerprints are compared in the same order as their json files.
+
+"""
+
+
+import json, os
+
+
+# Value of attributes that a fingerprint does not have
+MISSING = object()
+
+
+def get_json_data(path):
+    """
+    Read and return data from json file.
+
+    Params:
+    [string] path: Path to json file.
+
+    Return:
+    Json content as a dictionary.
+    """
+    with open(path, "r") as json_file:
+        data = json.load(json_file)
+
+    return data
+
+
+def get_test_num(filename):
+    """
+    Get the test number of a fingerprint file.
+
+    Params:
+    [string] filename: Name of fingerprint file, fingerprint_N.json.
+
+    Return:
+    [string]: Test number.
+    """
+    return os.path.splitext(filename)[0].split("_")[-1]
+
+
+class AttributeSchema:
+    """
+    Index of all attributes. An attribute is given the next index the first time it is seen.
+
+    keys: (category, attribute) of each index.
+    index: (category, attribute) mapped to index.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.index = {}
+        self.layouts = {}
+
+    def get_index(self, category, attribute):
+        """
+        Get the index of an attribute, it is added if it does not exist.
+
+        Params:
+        [string] category: Category.
+        [string] attribute: Attribute.
+
+        Return:
+        [int]: Index.
+        """
+        key = (category, attribute)
+        index = self.index.get(key)
+        if index is None:
+            index = self.index[key] = len(self.keys)
+            self.keys.append(key)
+        return index
+
+    def get_layout(self, categories, indexes):
+        """
+        Get the shared layout of fingerprints with the given categories and attributes in the given order.
+
+        Params:
+        [tuple] categories: Categories in order.
+        [tuple] indexes: Attribute indexes in order.
+
+        Return:
+        [tuple]: (categories, indexes), the same object for all equal layouts.
+        """
+        layout = (categories, indexes)
+        return self.layouts.setdefault(layout, layout)
+
+
+# Schema used by all fingerprints unless another is given
+SCHEMA = AttributeSchema()
+
+
+class Fingerprint:
+    """
+    One captured fingerprint.
+
+    values: Attribute values indexed by the schema, MISSING for attributes the fingerprint does not have.
+    layout: Categories and attribute indexes of the fingerprint in their original order.
+    ids: Canonical ids of the values indexed by the schema if interned, else None.
+    """
+
+    __slots__ = ("date", "pv", "browser", "test_num", "schema", "layout", "values", "ids")
+
+    def __init__(self, date, pv, browser, test_num, schema, layout, values):
+        self.date = date
+        self.pv = pv
+        self.browser = browser
+        self.test_num = test_num
+        self.schema = schema
+        self.layout = layout
+        self.values = values
+        self.ids = None
+
+    @classmethod
+    def from_data(cls, data, date=None, pv=None, browser=None, test_num=None, schema=SCHEMA):
+        """
+        Create a fingerprint from fingerprint data as saved in a json file.
+
+        Params:
+        [dict] data: Fingerprint data with categories and attributes.
+        [string] date: Test date.
+        [string] pv: Prefixed version.
+        [string] browser: Browser.
+        [string] test_num: Test number.
+        [AttributeSchema] schema: Attribute schema.
+
+        Return:
+        [Fingerprint]: Fingerprint.
+        """
+        indexes = []
+        found = []
+        for category in data:
+            attributes = data[category]
+            for attribute in attributes:
+                index = schema.get_index(category, attribute)
+                indexes.append(index)
+                found.append(attributes[attribute])
+
+        values = [MISSING] * len(schema.keys)
+        for index, value in zip(indexes, found):
+            values[index] = value
+
+        layout = schema.get_layout(tuple(data), tuple(indexes))
+        return cls(date, pv, browser, test_num, schema, layout, values)
+
+    @classmethod
+    def load(cls, path, date=None, pv=None, browser=None, schema=SCHEMA):
+        """
+        Load a fingerprint from a json file, the test number is taken from the filename.
+
+        Params:
+        [string] path: Path to fingerprint file.
+        [string] date: Test date.
+        [string] pv: Prefixed version.
+        [string] browser: Browser.
+        [AttributeSchema] schema: Attribute schema.
+
+        Return:
+        [Fingerprint]: Fingerprint.
+        """
+        test_num = get_test_num(os.path.basename(path))
+        return cls.from_data(get_json_data(path), date, pv, browser, test_num, schema)
+
+    def __reduce__(self):
+        # Indexes are only valid in the schema of this process, so fingerprints are sent to other processes as data
+        return (Fingerprint.from_data, (self.to_data(), self.date, self.pv, self.browser, self.test_num))
+
+    @property
+    def name(self):
+        """
+        Filename of the fingerprint.
+        """
+        return f"fingerprint_{self.test_num}.json"
+
+    def get_value(self, index):
+        """
+        Get the value of an attribute by index.
+
+        Params:
+        [int] index: Attribute index in the schema.
+
+        Return:
+        Attribute value, or MISSING.
+        """
+        return self.values[index] if index < len(self.values) else MISSING
+
+    def get(self, category, attribute):
+        """
+        Get the value of an attribute.
+
+        Params:
+        [string] category: Category.
+        [string] attribute: Attribute.
+
+        Return:
+        Attribute value, or MISSING.
+        """
+        index = self.schema.index.get((category, attribute))
+        return MISSING if index is None else self.get_value(index)
+
+    def items(self):
+        """
+        All attributes of the fingerprint in their original order.
+
+        Return:
+        Generator of (index, category, attribute, value).
+        """
+        keys = self.schema.keys
+        for index in self.layout[1]:
+            category, attribute = keys[index]
+            yield index, category, attribute, self.values[index]
+
+    def to_data(self):
+        """
+        Get fingerprint data as saved in a json file.
+
+        Return:
+        [dict]: Fingerprint data with categories and attributes.
+        """
+        data = {category: {} for category in self.layout[0]}
+        for _, category, attribute, value in self.items():
+            data[category][attribute] = value
+        return data
+
+    def save(self, path):
+        """
+        Save the fingerprint as a json file.
+
+        Params:
+        [string] path: Path to fingerprint file.
+
+        Return:
+        -
+        """
+        with open(path, "w") as json_file:
+            json.dump(self.to_data(), json_file, indent=1)
@@ -0,0 +1,294 @@
+"""
+Fingerprint Database
+
+Description:
+Optional SQLite database with all captured fingerprints and analysis results.
+
+Tables:
+captures: One row per fingerprint with date, PV, browser and test number.
+attributes: One row per (category, attribute).
+attr_values: Interned attribute values, each distinct (json encoded) value is stored once with its normalized form (see normalize.py).
+capture_values: Value of each attribute of each capture.
+comparisons: One row per analysed browser folder with its effective and raw change.
+changes: Changed attributes of each comparison, during ("during") or between ("between") sessions.
+
+Example, all Firefox PV2 captures where Fonts Enumeration changed:
+SELECT c.date FROM comparisons c JOIN changes ch ON ch.comparison_id = c.id
+WHERE c.browser = 'Firefox' AND c.pv = 'PV2' AND ch.attribute = 'Fonts Enumeration'
+
+"""
+
+
+import json, sqlite3
+from normalize import normalize_value
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS captures (
+    id INTEGER PRIMARY KEY,
+    date TEXT NOT NULL,
+    pv TEXT NOT NULL,
+    browser TEXT NOT NULL,
+    test_num TEXT NOT NULL,
+    UNIQUE (date, pv, browser, test_num)
+);
+CREATE INDEX IF NOT EXISTS captures_browser_pv_date ON captures (browser, pv, date);
+
+CREATE TABLE IF NOT EXISTS attributes (
+    id INTEGER PRIMARY KEY,
+    category TEXT NOT NULL,
+    attribute TEXT NOT NULL,
+    UNIQUE (category, attribute)
+);
+
+CREATE TABLE IF NOT EXISTS attr_values (
+    id INTEGER PRIMARY KEY,
+    value TEXT NOT NULL UNIQUE,
+    normalized TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS capture_values (
+    capture_id INTEGER NOT NULL REFERENCES captures (id) ON DELETE CASCADE,
+    attribute_id INTEGER NOT NULL REFERENCES attributes (id),
+    value_id INTEGER NOT NULL REFERENCES attr_values (id),
+    PRIMARY KEY (capture_id, attribute_id)
+);
+CREATE INDEX IF NOT EXISTS capture_values_attribute ON capture_values (attribute_id, value_id);
+
+CREATE TABLE IF NOT EXISTS comparisons (
+    id INTEGER PRIMARY KEY,
+    date TEXT NOT NULL,
+    pv TEXT NOT NULL,
+    browser TEXT NOT NULL,
+    point_result REAL NOT NULL,
+    raw_result REAL NOT NULL,
+    UNIQUE (date, pv, browser)
+);
+CREATE INDEX IF NOT EXISTS comparisons_browser_pv_date ON comparisons (browser, pv, date);
+
+CREATE TABLE IF NOT EXISTS changes (
+    comparison_id INTEGER NOT NULL REFERENCES comparisons (id) ON DELETE CASCADE,
+    session TEXT NOT NULL,
+    category TEXT NOT NULL,
+    attribute TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS changes_attribute ON changes (attribute, category);
+"""
+
+
+class FingerprintDatabase:
+    """
+    Connection to a fingerprint database. Changes are saved with commit.
+    """
+
+    def __init__(self, path):
+        """
+        Open a database, it is created if it does not exist.
+
+        Params:
+        [string] path: Path to database file.
+        """
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+        self.add_normalized()
+        self.attribute_ids = {}
+        self.value_ids = {}
+
+    def commit(self):
+        """
+        Save changes.
+        """
+        self.connection.commit()
+
+    def close(self):
+        """
+        Save changes and close the database.
+        """
+        self.connection.commit()
+        self.connection.close()
+
+    def add_normalized(self):
+        """
+        Add the normalized column to a database created before it existed, and fill it for all values.
+        """
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(attr_values)")]
+        if "normalized" in columns:
+            return
+
+        self.connection.execute("ALTER TABLE attr_values ADD COLUMN normalized TEXT NOT NULL DEFAULT ''")
+        rows = self.connection.execute("SELECT id, value FROM attr_values").fetchall()
+        self.connection.executemany("UPDATE attr_values SET normalized = ? WHERE id = ?",
+                                    [(json.dumps(normalize_value(json.loads(value))), value_id) for value_id, value in rows])
+        self.connection.commit()
+
+    def get_attribute_id(self, category, attribute):
+        """
+        Get id of an attribute, it is added if it does not exist.
+
+        Params:
+        [string] category: Category.
+        [string] attribute: Attribute.
+
+        Return:
+        [int]: Attribute id.
+        """
+        key = (category, attribute)
+        if key not in self.attribute_ids:
+            self.connection.execute("INSERT OR IGNORE INTO attributes (category, attribute) VALUES (?, ?)", key)
+            self.attribute_ids[key] = self.connection.execute(
+                "SELECT id FROM attributes WHERE category = ? AND attribute = ?", key).fetchone()[0]
+        return self.attribute_ids[key]
+
+    def get_value_id(self, value):
+        """
+        Get id of an interned value, it is added with its normalized form if it does not exist.
+
+        Params:
+        value: Attribute value.
+
+        Return:
+        [int]: Value id.
+        """
+        encoded = json.dumps(value, sort_keys=True)
+        if encoded not in self.value_ids:
+            self.connection.execute("INSERT OR IGNORE INTO attr_values (value, normalized) VALUES (?, ?)",
+                                    (encoded, json.dumps(normalize_value(value))))
+            self.value_ids[encoded] = self.connection.execute(
+                "SELECT id FROM attr_values WHERE value = ?", (encoded,)).fetchone()[0]
+        return self.value_ids[encoded]
+
+    def has(self, date, pv, browser, test_num):
+        """
+        Check if a capture exists.
+
+        Params:
+        [string] date: Test date.
+        [string] pv: Prefixed version.
+        [string] browser: Browser.
+        [string] test_num: Test number.
+
+        Return:
+        [bool]: True if it exists.
+        """
+        return self.connection.execute(
+            "SELECT 1 FROM captures WHERE date = ? AND pv = ? AND browser = ? AND test_num = ?",
+            (date, pv, browser, test_num)).fetchone() is not None
+
+    def add(self, date, pv, browser, test_num, fingerprint):
+        """
+        Add a fingerprint. An existing capture with the same date, pv, browser and test number is replaced.
+
+        Params:
+        [string] date: Test date.
+        [string] pv: Prefixed version.
+        [string] browser: Browser.
+        [string] test_num: Test number.
+        [dict] fingerprint: Fingerprint data.
+
+        Return:
+        -
+        """
+        self.connection.execute(
+            "DELETE FROM captures WHERE date = ? AND pv = ? AND browser = ? AND test_num = ?",
+            (date, pv, browser, test_num))
+        capture_id = self.connection.execute(
+            "INSERT INTO captures (date, pv, browser, test_num) VALUES (?, ?, ?, ?)",
+            (date, pv, browser, test_num)).lastrowid
+
+        rows = []
+        for category in fingerprint:
+            for attribute in fingerprint[category]:
+                rows.append((capture_id, self.get_attribute_id(category, attribute), self.get_value_id(fingerprint[category][attribute])))
+        self.connection.executemany("INSERT INTO capture_values (capture_id, attribute_id, value_id) VALUES (?, ?, ?)", rows)
+
+    def get_captures(self, date=None, pv=None, browser=None):
+        """
+        Get captures matching the given metadata.
+
+        Params:
+        [string] date: Test date, or None for all.
+        [string] pv: Prefixed version, or None for all.
+        [string] browser: Browser, or None for all.
+
+        Return:
+        [list]: List of (id, date, pv, browser, test_num), sorted by date, pv, browser and test number.
+        """
+        query = "SELECT id, date, pv, browser, test_num FROM captures WHERE 1 = 1"
+        params = []
+        for column, value in [("date", date), ("pv", pv), ("browser", browser)]:
+            if value is not None:
+                query += f" AND {column} = ?"
+                params.append(value)
+        query += " ORDER BY date, pv, browser, test_num"
+        return self.connection.execute(query, params).fetchall()
+
+    def get_browser_folders(self):
+        """
+        Get all captured (date, pv, browser), sorted.
+
+        Return:
+        [list]: List of (date, pv, browser).
+        """
+        return self.connection.execute("SELECT DISTINCT date, pv, browser FROM captures ORDER BY date, pv, browser").fetchall()
+
+    def get_fingerprint(self, capture_id):
+        """
+        Get the fingerprint of a capture.
+
+        Params:
+        [int] capture_id: Capture id.
+
+        Return:
+        [dict]: Fingerprint data with categories and attributes.
+        """
+        fingerprint = {}
+        rows = self.connection.execute(
+            "SELECT a.category, a.attribute, v.value FROM capture_values cv "
+            "JOIN attributes a ON a.id = cv.attribute_id JOIN attr_values v ON v.id = cv.value_id "
+            "WHERE cv.capture_id = ? ORDER BY a.id", (capture_id,))
+        for category, attribute, value in rows:
+            fingerprint.setdefault(category, {})[attribute] = json.loads(value)
+        return fingerprint
+
+    def count_values(self, browser, pv):
+        """
+        Count how many captures of a browser and PV have each attribute value.
+
+        Params:
+        [string] browser: Browser.
+        [string] pv: Prefixed version.
+
+        Return:
+        [list]: List of (category, attribute, value, normalized value, count), in order of first capture with the value.
+        """
+        rows = self.connection.execute(
+            "SELECT a.category, a.attribute, v.value, v.normalized, COUNT(*), MIN(c.id) AS first FROM capture_values cv "
+            "JOIN captures c ON c.id = cv.capture_id JOIN attributes a ON a.id = cv.attribute_id "
+            "JOIN attr_values v ON v.id = cv.value_id "
+            "WHERE c.browser = ? AND c.pv = ? GROUP BY cv.attribute_id, cv.value_id ORDER BY a.id, first",
+            (browser, pv))
+        return [(category, attribute, json.loads(value), json.loads(normalized), count)
+                for category, attribute, value, normalized, count, _ in rows]
+
+    def add_comparison(self, date, pv, browser, point_result, raw_result, changes):
+        """
+        Save the result of an analysed browser folder. An existing result for the same folder is replaced.
+
+        Params:
+        [string] date: Test date.
+        [string] pv: Prefixed version.
+        [string] browser: Browser.
+        [float] point_result: Percentage effective change (using pointsystem).
+        [float] raw_result: Percentage raw change (without pointsystem).
+        [list] changes: List of (session, category, attribute).
+
+        Return:
+        -
+        """
+        self.connection.execute("DELETE FROM comparisons WHERE date = ? AND pv = ? AND browser = ?", (date, pv, browser))
+        comparison_id = self.connection.execute(
+            "INSERT INTO comparisons (date, pv, browser, point_result, raw_result) VALUES (?, ?, ?, ?, ?)",
+            (date, pv, browser, point_result, raw_result)).lastrowid
+        self.connection.executemany(
+            "INSERT INTO changes (comparison_id, session, category, attribute) VALUES (?, ?, ?, ?)",
+            [(comparison_id, session, category, attribute) for session, category, attribute in changes])
@@ -0,0 +1,524 @@
+"""
+Fingerprint Store
+
+Description:
+Columnar store with all fingerprints in one file, used as an alternative to one json file per fingerprint.
+Every fingerprint is one row with its test date, PV, browser and test number.
+Every attribute is one column, dictionary encoded: the column holds an integer code per row and
+a list of the distinct values. Code -1 means the fingerprint does not have the attribute.
+The store is saved as a compressed numpy file (.npz), so numpy is needed to use it.
+The normalized form of each distinct value is computed once when the value is added, and saved with the values.
+
+A store can also be saved as a mapped store, a folder that is read without loading it:
+codes.N.npy: Codes in column order, memory-mapped so that reading a column only reads that column.
+values.N.bin: The distinct values of each column, json encoded one column after another.
+normalized.N.bin: The normalized form of the values (see normalize.py), laid out like the values file.
+header.json: Rows, columns, the names of the data files and the byte offsets of each column in the values files.
+Columns are only decoded when first used, so reading a few attributes costs as much as those attributes.
+Each save writes its data files under a new number N and then replaces header.json, so the header always names
+complete files and files held open by a reader are never rewritten. Data files of earlier saves are removed afterwards,
+files that are still open are left for the next save to remove.
+
+Can be run through the commandprompt to create a mapped store.
+
+Positional arguments:
+[string] source: Path to fingerprint store (.npz) or fingerprints folder.
+[string] output: Path to mapped store folder.
+
+Optional arguments:
+-h: Print argument usage.
+
+"""
+
+
+import json, os, mmap, argparse
+from normalize import normalize_value
+from atomic_write import write_atomic
+
+# numpy is optional, it is only needed when the fingerprint store is used
+try:
+    import numpy as np
+    NUMPY_INSTALLED = True
+except ImportError:
+    NUMPY_INSTALLED = False
+
+STORE_VERSION = 1
+
+# Data files of a mapped store, by name in the header
+MAPPED_FILES = {"codes": "codes.{}.npy", "values": "values.{}.bin", "normalized": "normalized.{}.bin"}
+
+# Data files of mapped stores saved before the data files were numbered
+UNNUMBERED_FILES = {"codes": "codes.npy", "values": "values.bin", "normalized": "normalized.bin"}
+
+
+def encode_value(value):
+    """
+    Get the string used to find a value in a column's dictionary.
+
+    Params:
+    value: Attribute value.
+
+    Return:
+    [string]: Json encoded value.
+    """
+    return json.dumps(value, sort_keys=True)
+
+
+def remove_unused_files(path, files):
+    """
+    Remove data files of a mapped store that are not named in its header.
+    Files that can not be removed, such as files still open by a reader on Windows, are kept.
+
+    Params:
+    [string] path: Path to mapped store folder.
+    [dict] files: Data files named in the header.
+
+    Return:
+    -
+    """
+    used = set(files.values())
+    prefixes = tuple(name.split(".")[0] + "." for name in MAPPED_FILES.values())
+    for f in os.listdir(path):
+        if f.startswith(prefixes) and f not in used:
+            try:
+                os.remove(os.path.join(path, f))
+            except OSError:
+                pass
+
+
+class MappedValues:
+    """
+    The distinct values of each column of a mapped store, indexed like FingerprintStore.values.
+    A column is decoded from the memory-mapped values file when it is first used.
+    """
+
+    def __init__(self, path, offsets):
+        """
+        Params:
+        [string] path: Path to values file.
+        [list] offsets: [start, end] byte offsets of each column.
+        """
+        self.offsets = offsets
+        self.columns = {}
+        self.data = b""
+        if os.path.getsize(path):
+            with open(path, "rb") as f:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, column):
+        if column not in self.columns:
+            start, end = self.offsets[column]
+            self.columns[column] = json.loads(self.data[start:end])
+        return self.columns[column]
+
+
+class NormalizedValues:
+    """
+    The normalized values of each column of a mapped store saved without them, indexed like FingerprintStore.values.
+    A column is normalized when it is first used.
+    """
+
+    def __init__(self, values):
+        """
+        Params:
+        [MappedValues] values: Values of the store.
+        """
+        self.values = values
+        self.columns = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, column):
+        if column not in self.columns:
+            self.columns[column] = [normalize_value(v) for v in self.values[column]]
+        return self.columns[column]
+
+
+class FingerprintStore:
+    """
+    All fingerprints as rows of dictionary encoded attribute columns.
+
+    meta: List of (date, pv, browser, test_num) per row.
+    columns: List of (category, attribute) per column.
+    values: List per column with the distinct values, indexed by code.
+    normalized: List per column with the normalized form of each distinct value, indexed by code.
+    codes: Numpy array (rows, columns) with codes, see get_codes.
+    """
+
+    def __init__(self):
+        if not NUMPY_INSTALLED:
+            print("ERROR: numpy is needed to use the fingerprint store.")
+            exit(1)
+
+        self.meta = []
+        self.columns = []
+        self.values = []
+        self.normalized = []
+        self.rows = {}
+        self.folders = None
+        self.column_index = {}
+        self.value_index = []
+        self.codes = np.zeros((0, 0), dtype=np.int32)
+        self.pending = []
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load store from file. A missing file gives an empty store.
+
+        Params:
+        [string] path: Path to store file.
+
+        Return:
+        [FingerprintStore]: Loaded store.
+        """
+        store = cls()
+        if not os.path.isfile(path):
+            return store
+
+        with np.load(path, allow_pickle=False) as data:
+            header = json.loads(str(data["header"]))
+            codes = data["codes"]
+
+        if header["version"] != STORE_VERSION:
+            print(f"ERROR: {path} is saved with another version of the fingerprint store.")
+            exit(1)
+
+        store.meta = [tuple(m) for m in header["meta"]]
+        store.columns = [tuple(c) for c in header["columns"]]
+        store.values = header["values"]
+        # Stores saved before normalized values were added
+        if "normalized" in header:
+            store.normalized = header["normalized"]
+        else:
+            store.normalized = [[normalize_value(v) for v in values] for values in store.values]
+        store.rows = {m: i for i, m in enumerate(store.meta)}
+        store.column_index = {c: i for i, c in enumerate(store.columns)}
+        store.value_index = [{encode_value(v): code for code, v in enumerate(values)} for values in store.values]
+        store.codes = codes
+        return store
+
+    @classmethod
+    def from_folder(cls, path):
+        """
+        Create a store from a fingerprints folder with date/pv/browser/fingerprint_N.json files.
+
+        Params:
+        [string] path: Path to fingerprints folder.
+
+        Return:
+        [FingerprintStore]: Store with all fingerprints in the folder.
+        """
+        store = cls()
+        for date in sorted(os.listdir(path)):
+            if not os.path.isdir(os.path.join(path, date)):
+                continue
+            for pv in sorted(os.listdir(os.path.join(path, date))):
+                for browser in sorted(os.listdir(os.path.join(path, date, pv))):
+                    browser_path = os.path.join(path, date, pv, browser)
+                    for f in sorted(os.listdir(browser_path)):
+                        test_num = os.path.splitext(f)[0].split("_")[-1]
+                        with open(os.path.join(browser_path, f), "r") as json_file:
+                            store.add(date, pv, browser, test_num, json.load(json_file))
+        return store
+
+    @classmethod
+    def load_mapped(cls, path):
+        """
+        Open a mapped store. Codes are memory-mapped and values decoded per column when used.
+        A mapped store is read only.
+
+        Params:
+        [string] path: Path to mapped store folder.
+
+        Return:
+        [FingerprintStore]: Opened store.
+        """
+        store = cls()
+        with open(os.path.join(path, "header.json"), "r") as json_file:
+            header = json.load(json_file)
+
+        if header["version"] != STORE_VERSION:
+            print(f"ERROR: {path} is saved with another version of the fingerprint store.")
+            exit(1)
+
+        files = header.get("files", UNNUMBERED_FILES)
+        store.meta = [tuple(m) for m in header["meta"]]
+        store.columns = [tuple(c) for c in header["columns"]]
+        store.values = MappedValues(os.path.join(path, files["values"]), header["offsets"])
+        if "normalized_offsets" in header:
+            store.normalized = MappedValues(os.path.join(path, files["normalized"]), header["normalized_offsets"])
+        else:
+            store.normalized = NormalizedValues(store.values)
+        store.rows = {m: i for i, m in enumerate(store.meta)}
+        store.column_index = {c: i for i, c in enumerate(store.columns)}
+        store.codes = np.load(os.path.join(path, files["codes"]), mmap_mode="r")
+        return store
+
+    def save_mapped(self, path):
+        """
+        Save store as a mapped store. Data files are written under a new number and the header is replaced last,
+        so the saved store is either the old or the new one.
+
+        Params:
+        [string] path: Path to mapped store folder, created if it does not exist.
+
+        Return:
+        -
+        """
+        os.makedirs(path, exist_ok=True)
+
+        generation = 1
+        header_path = os.path.join(path, "header.json")
+        if os.path.isfile(header_path):
+            with open(header_path, "r") as json_file:
+                generation = json.load(json_file).get("generation", 0) + 1
+        files = {key: name.format(generation) for key, name in MAPPED_FILES.items()}
+
+        offsets = {}
+        for key, columns in [("values", self.values), ("normalized", self.normalized)]:
+            encoded = [json.dumps(values).encode("UTF-8") for values in columns]
+            offsets[key] = []
+            position = 0
+            for e in encoded:
+                offsets[key].append([position, position + len(e)])
+                position += len(e)
+            write_atomic(os.path.join(path, files[key]), lambda f: f.writelines(encoded), binary=True)
+
+        # Column order keeps each column contiguous in the file
+        write_atomic(os.path.join(path, files["codes"]), lambda f: np.save(f, np.asfortranarray(self.get_codes())), binary=True)
+
+        header = {
+            "version": STORE_VERSION,
+            "generation": generation,
+            "files": files,
+            "meta": self.meta,
+            "columns": self.columns,
+            "offsets": offsets["values"],
+            "normalized_offsets": offsets["normalized"]
+        }
+        write_atomic(header_path, lambda json_file: json.dump(header, json_file))
+
+        remove_unused_files(path, files)
+
+    def save(self, path):
+        """
+        Save store to file.
+
+        Params:
+        [string] path: Path to store file.
+
+        Return:
+        -
+        """
+        header = {
+            "version": STORE_VERSION,
+            "meta": self.meta,
+            "columns": self.columns,
+            "values": self.values,
+            "normalized": self.normalized
+        }
+        write_atomic(path, lambda f: np.savez_compressed(f, header=np.array(json.dumps(header)), codes=self.get_codes()), binary=True)
+
+    def get_column(self, category, attribute):
+        """
+        Get the index of a column, it is added if it does not exist.
+
+        Params:
+        [string] category: Category.
+        [string] attribute: Attribute.
+
+        Return:
+        [int]: Column index.
+        """
+        key = (category, attribute)
+        if key not in self.column_index:
+            self.column_index[key] = len(self.columns)
+            self.columns.append(key)
+            self.values.append([])
+            self.normalized.append([])
+            self.value_index.append({})
+        return self.column_index[key]
+
+    def get_code(self, column, value):
+        """
+        Get the code of a value in a column, it is added to the column's dictionary with its normalized form if it does not exist.
+
+        Params:
+        [int] column: Column index.
+        value: Attribute value.
+
+        Return:
+        [int]: Code.
+        """
+        encoded = encode_value(value)
+        index = self.value_index[column]
+        if encoded not in index:
+            index[encoded] = len(self.values[column])
+            self.values[column].append(value)
+            self.normalized[column].append(normalize_value(value))
+        return index[encoded]
+
+    def add(self, date, pv, browser, test_num, fingerprint):
+        """
+        Add a fingerprint. An existing fingerprint with the same date, pv, browser and test number is replaced.
+
+        Params:
+        [string] date: Test date.
+        [string] pv: Prefixed version.
+        [string] browser: Browser.
+        [string] test_num: Test number.
+        [dict] fingerprint: Fingerprint data.
+
+        Return:
+        -
+        """
+        row = {}
+        for category in fingerprint:
+            for attribute in fingerprint[category]:
+                column = self.get_column(category, attribute)
+                row[column] = self.get_code(column, fingerprint[category][attribute])
+
+        key = (date, pv, browser, test_num)
+        if key not in self.rows:
+            self.rows[key] = len(self.meta)
+            self.meta.append(key)
+            self.folders = None
+        self.pending.append((self.rows[key], row))
+
+    def has(self, date, pv, browser, test_num):
+        """
+        Check if a fingerprint exists.
+
+        Params:
+        [string] date: Test date.
+        [string] pv: Prefixed version.
+        [string] browser: Browser.
+        [string] test_num: Test number.
+
+        Return:
+        [bool]: True if it exists.
+        """
+        return (date, pv, browser, test_num) in self.rows
+
+    def get_codes(self):
+        """
+        Get all codes, with rows and columns added since the last call included.
+
+        Return:
+        Numpy array (rows, columns) of codes.
+        """
+        num_rows, num_columns = len(self.meta), len(self.columns)
+        if self.codes.shape != (num_rows, num_columns):
+            codes = np.full((num_rows, num_columns), -1, dtype=np.int32)
+            codes[:self.codes.shape[0], :self.codes.shape[1]] = self.codes
+            self.codes = codes
+
+        for i, row in self.pending:
+            self.codes[i, :] = -1
+            for column, code in row.items():
+                self.codes[i, column] = code
+        self.pending = []
+
+        return self.codes
+
+    def select(self, date=None, pv=None, browser=None):
+        """
+        Get rows matching the given metadata.
+
+        Params:
+        [string] date: Test date, or None for all.
+        [string] pv: Prefixed version, or None for all.
+        [string] browser: Browser, or None for all.
+
+        Return:
+        [list]: Row indexes, sorted by date, pv, browser and test number.
+        """
+        folders = self.get_folders()
+        if date is not None and pv is not None and browser is not None:
+            return list(folders.get((date, pv, browser), []))
+
+        # Folders are sorted, so their rows joined in order are sorted as well
+        rows = []
+        for d, p, b in folders:
+            if (date is None or d == date) and (pv is None or p == pv) and (browser is None or b == browser):
+                rows += folders[(d, p, b)]
+        return rows
+
+    def get_folders(self):
+        """
+        Get the rows of each browser folder. The index is built on first use and again after rows are added.
+
+        Return:
+        [dict]: (date, pv, browser) mapped to row indexes sorted by test number, in sorted order of the folders.
+        """
+        if self.folders is None:
+            folders = {}
+            for i in sorted(range(len(self.meta)), key=self.meta.__getitem__):
+                folders.setdefault(self.meta[i][:3], []).append(i)
+            self.folders = folders
+        return self.folders
+
+    def get_fingerprint(self, row):
+        """
+        Decode one row into a fingerprint.
+
+        Params:
+        [int] row: Row index.
+
+        Return:
+        [dict]: Fingerprint data with categories and attributes.
+        """
+        codes = self.get_codes()[row]
+        fingerprint = {}
+        for column, (category, attribute) in enumerate(self.columns):
+            if codes[column] >= 0:
+                fingerprint.setdefault(category, {})[attribute] = self.values[column][codes[column]]
+        return fingerprint
+
+    def count_codes(self, rows, column):
+        """
+        Count how many times each code of a column occurs in the given rows.
+
+        Params:
+        [list] rows: Row indexes.
+        [int] column: Column index.
+
+        Return:
+        Two numpy arrays. Codes, and number of occurrences of each code, in order of first occurrence.
+        """
+        codes = self.get_codes()[rows, column]
+        codes = codes[codes >= 0]
+        unique, first, counts = np.unique(codes, return_index=True, return_counts=True)
+        order = np.argsort(first, kind="stable")
+        return unique[order], counts[order]
+
+
+def main():
+    """
+    Main function.
+    Create a mapped store from a fingerprint store or fingerprints folder.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", help="Path to fingerprint store (.npz) or fingerprints folder")
+    parser.add_argument("output", help="Path to mapped store folder")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.source):
+        store = FingerprintStore.from_folder(args.source)
+    elif os.path.isfile(args.source):
+        store = FingerprintStore.load(args.source)
+    else:
+        print("Source path does not exist.")
+        exit(1)
+
+    store.save_mapped(args.output)
+    print(f"Saved mapped store with {len(store.meta)} fingerprints to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Normalize
+
+Description:
+Normalized form of attribute values, computed once per distinct value when it is first stored or interned.
+Strings have no surrounding whitespace, lists are sorted and media devices are a sorted list of distinct devices.
+Case and repeated list elements are kept, as the statistics count them as different values.
+
+Comparing or counting values is then done on keys made from the normalized form:
+get_statistics_key: Equal for values counted as equal by fingerprint_statistics.py.
+get_comparison_key: Equal for values seen as equal by compare_fingerprints, strings are also compared
+    without case and lists without repeated elements.
+
+"""
+
+
+import json
+
+
+def get_sort_key(element):
+    """
+    Get the key a list element is sorted by, so that lists of mixed types can be sorted.
+
+    Params:
+    element: List element.
+
+    Return:
+    [tuple]: Sort key.
+    """
+    if isinstance(element, str):
+        return (0, element)
+    return (1, json.dumps(element, sort_keys=True))
+
+
+def normalize_value(value):
+    """
+    Get the normalized form of an attribute value.
+
+    Params:
+    value: Attribute value.
+
+    Return:
+    Normalized value, json encodable.
+    """
+    if isinstance(value, str):
+        return value.strip()
+
+    if isinstance(value, list):
+        if value and isinstance(value[0], dict):
+            devices = {json.dumps(d, sort_keys=True): d for d in value}
+            return [dict(sorted(devices[key].items())) for key in sorted(devices)]
+        return sorted(value, key=get_sort_key)
+
+    return value
+
+
+def get_statistics_key(normalized):
+    """
+    Get a hashable key for a normalized value, as counted by fingerprint_statistics.py.
+
+    Params:
+    normalized: Normalized value, see normalize_value.
+
+    Return:
+    Hashable key.
+    """
+    if isinstance(normalized, list):
+        return tuple(json.dumps(e, sort_keys=True) if isinstance(e, dict) else e for e in normalized)
+    return normalized
+
+
+def get_comparison_key(normalized):
+    """
+    Get a hashable key for a normalized value, as compared by compare_fingerprints.
+
+    Params:
+    normalized: Normalized value, see normalize_value.
+
+    Return:
+    Hashable key.
+    """
+    if isinstance(normalized, str):
+        return normalized.upper()
+    if isinstance(normalized, list):
+        # Sorted, so repeated elements follow each other
+        return tuple(dict.fromkeys(get_statistics_key(normalized)))
+    return normalized
@@ -0,0 +1,255 @@
+"""
+Profiling
+
+Description:
+Opt-in timing of the stages of a script. Each stage records number of calls, wall time, CPU time,
+and bytes and files read and written. Stages may be nested, the time of a stage includes its nested stages.
+The report is saved as json, and with a profile folder a cProfile dump is also saved for each stage.
+
+When not enabled, a stage is an empty context and counting files returns at once, so instrumentation costs nearly nothing.
+Stages run inside the workers of a process pool are recorded in each worker, returned with its results and merged
+into the stages of the main process, so their wall time is summed over the workers. The CPU time of the stage
+running the pool then also includes the finished workers.
+
+"""
+
+
+import os, json, time, cProfile
+from contextlib import nullcontext
+
+
+class Stage:
+    """
+    Context that records one call of a stage.
+    """
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler.enter(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.exit(self.name)
+        return False
+
+
+class Profiler:
+    """
+    Records stages of a script.
+
+    stages: Stage name mapped to its recorded values, in order of first call.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.report_path = None
+        self.profile_dir = None
+        self.stages = {}
+        self.stack = []
+        self.profiles = {}
+        self.disabled_stage = nullcontext()
+
+    def enable(self, report_path, profile_dir=None):
+        """
+        Start recording.
+
+        Params:
+        [string] report_path: Path to json report.
+        [string] profile_dir: If given, a cProfile dump of each stage is saved in this folder.
+
+        Return:
+        -
+        """
+        self.enabled = True
+        self.report_path = report_path
+        self.profile_dir = profile_dir
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    def enable_worker(self):
+        """
+        Start recording in a worker process. Stages inherited from the main process are dropped, and recorded stages are
+        returned with take_stages instead of saved.
+
+        Return:
+        -
+        """
+        self.enabled = True
+        self.report_path = None
+        self.profile_dir = None
+        self.stages = {}
+        self.stack = []
+        self.profiles = {}
+
+    def take_stages(self):
+        """
+        Get the stages recorded since the last call, used by worker processes to return them with their results.
+
+        Return:
+        [dict]: Stage name mapped to its recorded values, empty if not enabled.
+        """
+        stages = self.stages
+        self.stages = {}
+        return stages
+
+    def merge_stages(self, stages):
+        """
+        Add stages recorded in a worker process to the recorded stages.
+
+        Params:
+        [dict] stages: Stages from take_stages.
+
+        Return:
+        -
+        """
+        for name, values in stages.items():
+            stage = self.get_stage(name)
+            for key, value in values.items():
+                stage[key] += value
+
+    def get_cpu_time(self):
+        """
+        Get CPU time of this process and its finished child processes.
+
+        Return:
+        [float]: Seconds.
+        """
+        t = os.times()
+        return t.user + t.system + t.children_user + t.children_system
+
+    def get_stage(self, name):
+        """
+        Get the recorded values of a stage, it is added if it does not exist.
+
+        Params:
+        [string] name: Stage name.
+
+        Return:
+        [dict]: Recorded values.
+        """
+        if name not in self.stages:
+            self.stages[name] = {
+                "calls": 0,
+                "wall_seconds": 0.0,
+                "cpu_seconds": 0.0,
+                "bytes_read": 0,
+                "bytes_written": 0,
+                "files_read": 0,
+                "files_written": 0
+            }
+        return self.stages[name]
+
+    def stage(self, name):
+        """
+        Get a context that records a call of a stage.
+
+        Params:
+        [string] name: Stage name.
+
+        Return:
+        Context manager.
+        """
+        if not self.enabled:
+            return self.disabled_stage
+        return Stage(self, name)
+
+    def enter(self, name):
+        """
+        Start a call of a stage. Only one cProfile profiler can run at a time, so the profiler of the
+        enclosing stage is paused.
+
+        Params:
+        [string] name: Stage name.
+
+        Return:
+        -
+        """
+        if self.profile_dir:
+            if self.stack:
+                self.profiles[self.stack[-1][0]].disable()
+            self.profiles.setdefault(name, cProfile.Profile()).enable()
+        self.stack.append((name, time.perf_counter(), self.get_cpu_time()))
+
+    def exit(self, name):
+        """
+        End a call of a stage.
+
+        Params:
+        [string] name: Stage name.
+
+        Return:
+        -
+        """
+        _, wall_start, cpu_start = self.stack.pop()
+        stage = self.get_stage(name)
+        stage["calls"] += 1
+        stage["wall_seconds"] += time.perf_counter() - wall_start
+        stage["cpu_seconds"] += self.get_cpu_time() - cpu_start
+
+        if self.profile_dir:
+            self.profiles[name].disable()
+            if self.stack:
+                self.profiles[self.stack[-1][0]].enable()
+
+    def add_read(self, path):
+        """
+        Count a file read in the current stage.
+
+        Params:
+        [string] path: Path to file.
+
+        Return:
+        -
+        """
+        if not self.enabled or not self.stack:
+            return
+        stage = self.get_stage(self.stack[-1][0])
+        stage["files_read"] += 1
+        stage["bytes_read"] += os.path.getsize(path)
+
+    def add_written(self, path):
+        """
+        Count a file written in the current stage.
+
+        Params:
+        [string] path: Path to file.
+
+        Return:
+        -
+        """
+        if not self.enabled or not self.stack:
+            return
+        stage = self.get_stage(self.stack[-1][0])
+        stage["files_written"] += 1
+        stage["bytes_written"] += os.path.getsize(path)
+
+    def save(self, script):
+        """
+        Save the json report, and the cProfile dumps if a profile folder is given. Does nothing if not enabled.
+
+        Params:
+        [string] script: Name of the script, saved in the report and used to name the dumps.
+
+        Return:
+        -
+        """
+        if not self.enabled:
+            return
+
+        for stage in self.stages.values():
+            stage["wall_seconds"] = round(stage["wall_seconds"], 6)
+            stage["cpu_seconds"] = round(stage["cpu_seconds"], 6)
+
+        with open(self.report_path, "w") as json_file:
+            json.dump({"script": script, "stages": self.stages}, json_file, indent=1)
+
+        if self.profile_dir:
+            for name, profile in self.profiles.items():
+                profile.dump_stats(os.path.join(self.profile_dir, f"{script}_{name.replace(' ', '_')}.prof"))
+
+
+# Profiler used by all scripts, enabled with their --timing argument
+PROFILER = Profiler()
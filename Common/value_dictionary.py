@@ -0,0 +1,119 @@
+"""
+Value Dictionary
+
+Description:
+Interning of attribute values. Long values like User-Agent, Accept headers, plugin lists and fonts repeat
+across thousands of fingerprints, and are kept once in the dictionary instead of once per fingerprint.
+Each distinct value is given a small integer id, and a canonical id that is equal for values seen as equal
+by the given key function. Comparing or counting values is then done on integers.
+The key function is given the normalized form of the value (see normalize.py), which is only computed
+for values not yet in the dictionary, or taken from a fingerprint store or database where it is already stored.
+
+"""
+
+
+import json
+from normalize import normalize_value
+
+
+class ValueDictionary:
+    """
+    Interned attribute values.
+
+    values: Distinct values, indexed by value id.
+    canonical: Canonical id of each value, indexed by value id.
+    """
+
+    def __init__(self, get_key):
+        """
+        Create an empty dictionary.
+
+        Params:
+        [function] get_key: Gives a hashable key for a normalized value, two values are equal when their keys are equal.
+        """
+        self.get_key = get_key
+        self.values = []
+        self.canonical = []
+        self.ids = {}
+        self.canonical_ids = {}
+
+    @classmethod
+    def from_saved(cls, get_key, saved):
+        """
+        Restore a dictionary saved with get_saved. Value and canonical ids are kept, and the lookups used to
+        find values are only built when a value is first interned, so a restored dictionary that is only read costs nothing.
+
+        Params:
+        [function] get_key: Key function the dictionary was saved with.
+        [dict] saved: Saved dictionary.
+
+        Return:
+        [ValueDictionary]: Restored dictionary.
+        """
+        values = cls(get_key)
+        values.values = saved["values"]
+        values.canonical = saved["canonical"]
+        values.ids = None
+        return values
+
+    def get_saved(self):
+        """
+        Get the dictionary as json encodable data, restored with from_saved.
+
+        Return:
+        [dict]: Values and canonical ids.
+        """
+        return {"values": self.values, "canonical": self.canonical}
+
+    def build_lookups(self):
+        """
+        Build the lookups of a restored dictionary, the key of each canonical id is computed from its first value.
+        """
+        self.ids = {}
+        self.canonical_ids = {}
+        for value_id, value in enumerate(self.values):
+            self.ids[value if isinstance(value, str) else (json.dumps(value, sort_keys=True),)] = value_id
+            if self.canonical[value_id] == len(self.canonical_ids):
+                self.canonical_ids[self.get_key(normalize_value(value))] = self.canonical[value_id]
+
+    def intern(self, value, normalized=None):
+        """
+        Get the id of a value, it is added if it does not exist.
+
+        Params:
+        value: Attribute value.
+        normalized: Normalized form of the value if it is already known, else it is computed when the value is added.
+
+        Return:
+        [int]: Value id.
+        """
+        if self.ids is None:
+            self.build_lookups()
+        # Strings are found by themselves, other values by their json encoding
+        encoded = value if isinstance(value, str) else (json.dumps(value, sort_keys=True),)
+        value_id = self.ids.get(encoded)
+        if value_id is None:
+            value_id = self.ids[encoded] = len(self.values)
+            if normalized is None:
+                normalized = normalize_value(value)
+            self.values.append(value)
+            self.canonical.append(self.canonical_ids.setdefault(self.get_key(normalized), len(self.canonical_ids)))
+        return value_id
+
+    def intern_fingerprint(self, fingerprint):
+        """
+        Intern all values of a fingerprint. Values of the fingerprint are replaced by the interned ones.
+
+        Params:
+        [Fingerprint] fingerprint: Fingerprint, updated in place.
+
+        Return:
+        [list]: Canonical ids indexed by the fingerprint's schema, None for attributes the fingerprint does not have.
+        """
+        values = fingerprint.values
+        ids = [None] * len(values)
+        for index in fingerprint.layout[1]:
+            value_id = self.intern(values[index])
+            values[index] = self.values[value_id]
+            ids[index] = self.canonical[value_id]
+        return ids
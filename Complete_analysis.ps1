@@ -2,27 +2,27 @@ param (
     [switch]$extract = $false,
     [switch]$analyze = $false,
 	[switch]$statistics = $false,
-    [switch]$all = $false
+    [switch]$all = $false,
+    [switch]$timing = $false,
+    [int]$workers = 1
 )
 
 # Script paths
 $extract_script = ".\bl_extrator\bl_extract.py"
-$analyze_script = ".\Analysis_script\analysis_script.py"
+$batch_analyze_script = ".\Analysis_script\batch_analysis.py"
 $statistics_script = ".\Fingerprint_statistics\fingerprint_statistics.py"
 
 # data paths
 $testdata_path = ".\test_data"
 $fingerprints_path = ".\Fingerprints"
 
-# Get list of already done
-[string[]]$done_extracting = Get-Content -Path ".\done_extracting.txt"
-[string[]]$done_analysing = Get-Content -Path ".\done_analysing.txt"
-
 if ($all){
-    if ($extract){Clear-Content ".\done_extracting.txt"}
+    # Without the cache every test case is extracted again
+    if ($extract -and (Test-Path ".\extraction_cache.json")){Remove-Item -Path ".\extraction_cache.json"}
     if ($analyze){
         Clear-Content ".\done_analysing.txt"
         Remove-Item -Path ".\results\analysis_results.json"
+        if (Test-Path ".\results\analysis_journal.jsonl"){Remove-Item -Path ".\results\analysis_journal.jsonl"}
         Copy-Item -Path ".\results\analysis_results - Template.json" -Destination ".\results\analysis_results.json"
     } 
 }
@@ -31,64 +31,32 @@ if ($extract) {
     Write-Host "Extrating all fingerprints from $($testdata_path)" -ForegroundColor Yellow
     $test_cases = @(Get-ChildItem -Path $testdata_path -Name -Directory -Exclude "test","omitted")
 
-    # For each testcase
+    # For each testcase, test numbers with unchanged html files, m_data.json and config are skipped by the extraction cache
     for ($i = 0; $i -le ($test_cases.Length - 1); $i += 1){
         $test_case_path = Join-Path -Path $testdata_path -ChildPath $test_cases[$i]
-        if ($all){
-            Write-Host "Working with $($test_case_path)" -ForegroundColor Yellow
-            python $extract_script $test_case_path
-            Add-Content -Path ".\done_extracting.txt" -Value $test_case_path           
-        }
-        else {
-            if (!($done_extracting -contains $test_case_path)){
-                Write-Host "Working with $($test_case_path)" -ForegroundColor Yellow
-                python $extract_script $test_case_path
-                Add-Content -Path ".\done_extracting.txt" -Value $test_case_path 
-            }
-        }  
+        Write-Host "Working with $($test_case_path)" -ForegroundColor Yellow
+        $timing_args = @()
+        if ($timing){$timing_args = @("--timing", ".\results\timing_extract_$($test_cases[$i]).json")}
+        python $extract_script $test_case_path --workers $workers --parser auto --targeted --cache ".\extraction_cache.json" @timing_args
     }
     Write-Host "Done!" -ForegroundColor Yellow
 }
 
 if ($analyze) {
     Write-Host "Performing analysis on all fingerprints in $($fingerprints_path)" -ForegroundColor Yellow
-    $test_cases = @(Get-ChildItem -Path $fingerprints_path -Name -Directory -Exclude "2022-03-11")
-
-    # For each testcase
-    for ($iCase = 0; $iCase -le ($test_cases.Length - 1); $iCase += 1){
-        $case_path = Join-Path -Path $fingerprints_path -ChildPath $test_cases[$iCase]
-        $PVs = @(Get-ChildItem -Path $case_path -Name -Directory)
-
-        # For each PV
-        for ($iPV = 0; $iPV -le ($PVs.Length - 1); $iPV += 1){
-            $pv_path = Join-Path -Path $case_path -ChildPath $PVs[$iPV]
-            $browsers = @(Get-ChildItem -Path $pv_path -Name -Directory)
-
-            for ($iBrowser = 0; $iBrowser -le ($browsers.Length - 1); $iBrowser += 1){
-                $browser_path = Join-Path -Path $pv_path -ChildPath $browsers[$iBrowser]
-
-                if ($all){
-                    Write-Host "Working with $($browser_path)" -ForegroundColor Yellow
-                    python $analyze_script $browser_path
-                    Add-Content -Path ".\done_analysing.txt" -Value $browser_path           
-                }
-                else {
-                    if (!($done_analysing -contains $browser_path)){
-                        Write-Host "Working with $($browser_path)" -ForegroundColor Yellow
-                        python $analyze_script $browser_path
-                        Add-Content -Path ".\done_analysing.txt" -Value $browser_path 
-                    }
-                }
-            }
-
-        }
-
-    }
+    # All browser folders are analysed in one python process, previously analysed folders are listed in done_analysing.txt
+    $timing_args = @()
+    if ($timing){$timing_args = @("--timing", ".\results\timing_analyze.json")}
+    python $batch_analyze_script $fingerprints_path --exclude "2022-03-11" --done ".\done_analysing.txt" --workers $workers @timing_args
     Write-Host "Done!" -ForegroundColor Yellow
 }
 
 if ($statistics) {
     Write-Host "Generating statistics for all browsers' from fingerprints in $($fingerprints_path)" -ForegroundColor Yellow
-    python $statistics_script
+    # Only new or changed fingerprints are counted, unless all is set
+    $timing_args = @()
+    if ($timing){$timing_args = @("--timing", ".\results\timing_statistics.json")}
+    if ($all){python $statistics_script --full @timing_args}
+    else {python $statistics_script @timing_args}
     Write-Host "Done!" -ForegroundColor Yellow
 }
\ No newline at end of file
@@ -0,0 +1,217 @@
+"""
+Attribute Subsets Script
+
+Description:
+Written to be run through the commandprompt with passing arguments.
+Find small sets of attributes that already tell captures apart, that is the attributes a privacy browser most needs
+to randomize. Subsets are grown one attribute at a time, keeping the subsets with the most distinct value tuples
+(greedy with a beam width of 1, beam search otherwise), until the subset tells apart as many captures as all
+attributes together or the largest size is reached. Ties are broken by the number of unique captures.
+
+Each kept subset holds the id of every capture's partial tuple. Extending a subset with one attribute combines
+these ids with the attribute's value ids, so trying a candidate costs one pass over the captures whatever the size
+of the subset. When the combined ids are small enough they are counted with np.bincount in linear time, else with np.unique.
+
+All extracted attributes are searched by default, and values are compared as in fingerprint_statistics.py.
+The search is done for each browser and PV, and for all captures together. Requires numpy.
+
+Optional arguments:
+-b, --beam: Number of subsets kept at each size, 1 gives a greedy search.
+-m, --max-size: Largest subset size.
+--scored: Only search attributes used in the statistics.
+-s, --store: Read fingerprints from a fingerprint store (.npz) or mapped store (folder) instead of the fingerprints folder.
+-o, --output: Path to json report.
+-h: Print argument usage.
+
+"""
+
+
+import os, sys, json, argparse
+import numpy as np
+from fingerprint_entropy import get_tables_from_folder, get_tables_from_store, get_joint_ids
+
+# Shared modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from fingerprint_store import FingerprintStore
+from fingerprint import get_json_data
+
+# Combined ids are counted with np.bincount when there are at most this many possible ids per capture
+BINCOUNT_FACTOR = 8
+
+
+def get_dense_columns(table):
+    """
+    Number the values of each column from 0, so that combined ids stay small.
+
+    Params:
+    table: Numpy array (captures, columns) of value ids.
+
+    Return:
+    Two variables. Numpy array (captures, columns) of dense ids, and number of distinct values of each column.
+    """
+    dense = np.empty_like(table)
+    sizes = np.zeros(table.shape[1], dtype=np.int64)
+    for i in range(table.shape[1]):
+        _, inverse = np.unique(table[:, i], return_inverse=True)
+        dense[:, i] = inverse.reshape(-1)
+        sizes[i] = inverse.max() + 1 if len(inverse) else 0
+
+    return dense, sizes
+
+
+def extend_ids(ids, groups, column, size):
+    """
+    Combine the partial tuple ids of the captures with one more column.
+
+    Params:
+    ids: Numpy array with the dense partial tuple id of each capture.
+    [int] groups: Number of distinct partial tuples.
+    column: Numpy array with the dense value id of each capture.
+    [int] size: Number of distinct values of the column.
+
+    Return:
+    Two variables. Numpy array with the dense tuple id of each capture, and numpy array with the number of captures per tuple.
+    """
+    keys = ids * size + column
+    if groups * size <= BINCOUNT_FACTOR * len(ids):
+        counts = np.bincount(keys, minlength=groups * size)
+        present = counts > 0
+        new_ids = np.cumsum(present) - 1
+        return new_ids[keys], counts[present]
+
+    unique, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    return inverse.reshape(-1), counts
+
+
+def search_subsets(table, max_size, beam=1):
+    """
+    Search subsets of attributes with the most distinct tuples, one size at a time.
+
+    Params:
+    table: Numpy array (captures, columns) of value ids.
+    [int] max_size: Largest subset size.
+    [int] beam: Number of subsets kept at each size.
+
+    Return:
+    Two variables. Number of distinct tuples of all columns, and list with the best subset of each size
+        as (columns in the order they were added, distinct tuples, unique captures).
+    """
+    num_captures = table.shape[0]
+    target = int(get_joint_ids(table).max()) + 1
+    dense, sizes = get_dense_columns(table)
+    # Columns with one value never tell captures apart
+    candidates = [c for c in range(table.shape[1]) if sizes[c] > 1]
+
+    beams = [((), np.zeros(num_captures, dtype=np.int64), 1)]
+    best = []
+    for _ in range(max_size):
+        scores = {}
+        for columns, ids, groups in beams:
+            for c in candidates:
+                if c in columns:
+                    continue
+                key = frozenset(columns + (c,))
+                if key in scores:
+                    continue
+                _, counts = extend_ids(ids, groups, dense[:, c], int(sizes[c]))
+                scores[key] = (len(counts), int((counts == 1).sum()), columns + (c,), ids, groups)
+
+        if not scores:
+            break
+
+        # Only the ids of the kept subsets are computed again, so the ids of all candidates are never held at once
+        ranked = sorted(scores.values(), key=lambda s: (-s[0], -s[1], s[2]))[:beam]
+        beams = []
+        for distinct, _, columns, ids, groups in ranked:
+            new_ids, _ = extend_ids(ids, groups, dense[:, columns[-1]], int(sizes[columns[-1]]))
+            beams.append((columns, new_ids, distinct))
+
+        distinct, unique, columns = ranked[0][:3]
+        best.append((list(columns), distinct, unique))
+        if distinct == target:
+            break
+
+    return target, best
+
+
+def get_subsets_report(columns, table, max_size, beam):
+    """
+    Search subsets of one group of captures and describe them.
+
+    Params:
+    [list] columns: (category, attribute) of the columns.
+    table: Numpy array (captures, columns) of value ids.
+    [int] max_size: Largest subset size.
+    [int] beam: Number of subsets kept at each size.
+
+    Return:
+    [dict]: Number of captures, distinct tuples of all attributes and best subset of each size.
+    """
+    target, best = search_subsets(table, max_size, beam)
+    return {
+        "captures": int(table.shape[0]),
+        "distinct": target,
+        "subsets": [{
+            "size": len(subset),
+            "attributes": [list(columns[c]) for c in subset],
+            "distinct": distinct,
+            "unique_captures": unique
+        } for subset, distinct, unique in best]
+    }
+
+
+def main():
+    """
+    Main function.
+    Search identifying attribute subsets and save a json report.
+    """
+    result_path = os.path.join(".", "results")
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-b", "--beam", type=int, default=1, help="Number of subsets kept at each size, 1 gives a greedy search")
+    parser.add_argument("-m", "--max-size", type=int, default=10, help="Largest subset size")
+    parser.add_argument("--scored", action="store_true", help="Only search attributes used in the statistics")
+    parser.add_argument("-s", "--store", help="Path to fingerprint store (.npz) or mapped store (folder)")
+    parser.add_argument("-o", "--output", default=os.path.join(result_path, "attribute_subsets.json"), help="Path to json report")
+    args = parser.parse_args()
+
+    if args.beam < 1 or args.max_size < 1:
+        print("ERROR: beam and max-size must be at least 1.")
+        exit(1)
+
+    pointsystem = get_json_data(os.path.join(".", "Pointsystem", "pointsystem.json")) if args.scored else None
+    if args.store:
+        store = FingerprintStore.load_mapped(args.store) if os.path.isdir(args.store) else FingerprintStore.load(args.store)
+        columns, tables = get_tables_from_store(store, pointsystem)
+    else:
+        columns, tables = get_tables_from_folder(os.path.join(".", "Fingerprints"), pointsystem)
+
+    report = {}
+    for browser in sorted(tables):
+        report[browser] = {}
+        for pv in sorted(tables[browser]):
+            report[browser][pv] = get_subsets_report(columns, tables[browser][pv], args.max_size, args.beam)
+
+    all_tables = [tables[browser][pv] for browser in tables for pv in tables[browser]]
+    if all_tables:
+        report["All"] = {"All": get_subsets_report(columns, np.vstack(all_tables), args.max_size, args.beam)}
+
+    with open(args.output, "w") as json_file:
+        json.dump(report, json_file, indent=1)
+
+    for browser in report:
+        for pv in report[browser]:
+            r = report[browser][pv]
+            print(browser, "-", pv)
+            previous = []
+            for subset in r["subsets"]:
+                # With a beam, the best subset of a size does not always extend the best subset of the size before
+                added = subset["attributes"][-1:] if subset["attributes"][:-1] == previous else subset["attributes"]
+                names = ", ".join(f"{category} - {attribute}" for category, attribute in added)
+                print(f"{subset['size']}: {'+ ' if len(added) == 1 else ''}{names}, {subset['distinct']}/{r['distinct']} distinct, {subset['unique_captures']}/{r['captures']} unique captures")
+                previous = subset["attributes"]
+            print("")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+"""
+Fingerprint Entropy Script
+
+Description:
+Written to be run through the commandprompt with passing arguments.
+Rank fingerprinting surfaces by how much they identify a capture, per browser and PV.
+
+For each attribute counted in statistics_raw.json, the Shannon entropy of its values, the entropy normalized by
+the largest possible entropy log2(N) of N counted values, the number of distinct values, the number of captures
+alone with their value (anonymity set of size 1) and the mean anonymity set size of a capture are computed.
+All attributes of a browser and PV are computed at once with numpy from their count table.
+
+The joint entropy of attribute combinations needs the values of each capture, so it is computed from the fingerprints.
+Each capture becomes a row of canonical value ids, and the rows of a combination are reduced to one id per distinct
+tuple one column at a time. By default the combination of all attributes and one combination per category are computed.
+Attributes are the ones used in the statistics, and values are compared as in fingerprint_statistics.py.
+Requires numpy.
+
+Optional arguments:
+--raw: Path to statistics_raw.json.
+-s, --store: Read fingerprints from a fingerprint store (.npz) or mapped store (folder) instead of the fingerprints folder.
+-c, --combine: Attributes of an extra combination, as Category/Attribute or Category for all its attributes. May be repeated.
+-o, --output: Path to json report.
+-h: Print argument usage.
+
+"""
+
+
+import os, sys, json, argparse
+import numpy as np
+from fingerprint_statistics import is_scored
+
+# Shared modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from fingerprint_store import FingerprintStore
+from value_dictionary import ValueDictionary
+from normalize import get_statistics_key
+from fingerprint import Fingerprint, get_json_data
+
+
+def get_set_metrics(counts):
+    """
+    Get entropy and anonymity sets of one distribution.
+
+    Params:
+    counts: Numpy array with the number of captures having each distinct value.
+
+    Return:
+    [dict]: Entropy, normalized entropy, distinct values, unique captures, mean anonymity set size
+        and number of captures per anonymity set size.
+    """
+    total = counts.sum()
+    p = counts / total
+    entropy = float(-(p * np.log2(p)).sum())
+    sizes, captures = np.unique(counts, return_counts=True)
+
+    return {
+        "captures": int(total),
+        "entropy": round(entropy, 4),
+        "normalized_entropy": round(entropy / np.log2(total), 4) if total > 1 else 0.0,
+        "distinct": len(counts),
+        "unique_captures": int((counts == 1).sum()),
+        "mean_anonymity_set": round(float((counts * counts).sum() / total), 4),
+        # A value counted c times gives c captures an anonymity set of size c
+        "anonymity_sets": {str(size): int(size * num) for size, num in zip(sizes, captures)}
+    }
+
+
+def get_attribute_entropy(attributes):
+    """
+    Get entropy and anonymity set metrics of all attributes of one browser and PV from their count table.
+    The counts of all attributes are joined in one array and each metric is summed per attribute with np.add.reduceat.
+
+    Params:
+    [dict] attributes: Category mapped to attribute mapped to list of [count, value], as in statistics_raw.json.
+
+    Return:
+    [dict]: Category mapped to attribute mapped to metrics.
+    """
+    keys = []
+    lengths = []
+    counts = []
+    for category in attributes:
+        for attribute in attributes[category]:
+            entries = attributes[category][attribute]
+            if not entries:
+                continue
+            keys.append((category, attribute))
+            lengths.append(len(entries))
+            counts.extend(entry[0] for entry in entries)
+
+    result = {category: {} for category in attributes}
+    if not keys:
+        return result
+
+    lengths = np.array(lengths)
+    counts = np.array(counts, dtype=np.float64)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+
+    totals = np.add.reduceat(counts, starts)
+    p = counts / np.repeat(totals, lengths)
+    entropy = -np.add.reduceat(p * np.log2(p), starts)
+    max_entropy = np.log2(totals)
+    normalized = np.divide(entropy, max_entropy, out=np.zeros_like(entropy), where=totals > 1)
+    unique = np.add.reduceat((counts == 1).astype(np.int64), starts)
+    mean_set = np.add.reduceat(counts * counts, starts) / totals
+
+    for i, (category, attribute) in enumerate(keys):
+        result[category][attribute] = {
+            "captures": int(totals[i]),
+            "entropy": round(float(entropy[i]), 4),
+            "normalized_entropy": round(float(normalized[i]), 4),
+            "distinct": int(lengths[i]),
+            "unique_captures": int(unique[i]),
+            "mean_anonymity_set": round(float(mean_set[i]), 4)
+        }
+
+    return result
+
+
+def get_tables_from_folder(fingerprint_paths, pointsystem=None):
+    """
+    Get the canonical value ids of every capture in the fingerprints folder.
+
+    Params:
+    [string] fingerprint_paths: Path to fingerprints folder.
+    [dict] pointsystem: If given, only attributes used in the statistics are included, else all attributes.
+
+    Return:
+    Two variables. List of (category, attribute) of the columns,
+    and browser mapped to PV mapped to numpy array (captures, columns) of ids, 0 for missing attributes.
+    """
+    values = ValueDictionary(get_statistics_key)
+    columns = {}
+    rows = {}
+    for testCase in sorted(os.listdir(fingerprint_paths)):
+        for pv in sorted(os.listdir(os.path.join(fingerprint_paths, testCase))):
+            for browser in sorted(os.listdir(os.path.join(fingerprint_paths, testCase, pv))):
+                path = os.path.join(fingerprint_paths, testCase, pv, browser)
+                for f in sorted(os.listdir(path)):
+                    fingerprint = Fingerprint.load(os.path.join(path, f), testCase, pv, browser)
+                    row = {}
+                    for _, category, attribute, value in fingerprint.items():
+                        if pointsystem is None or is_scored(pointsystem, category, attribute):
+                            column = columns.setdefault((category, attribute), len(columns))
+                            row[column] = values.canonical[values.intern(value)] + 1
+                    rows.setdefault(browser, {}).setdefault(pv, []).append(row)
+
+    tables = {}
+    for browser in rows:
+        tables[browser] = {}
+        for pv in rows[browser]:
+            table = np.zeros((len(rows[browser][pv]), len(columns)), dtype=np.int64)
+            for i, row in enumerate(rows[browser][pv]):
+                table[i, list(row)] = list(row.values())
+            tables[browser][pv] = table
+
+    return list(columns), tables
+
+
+def get_tables_from_store(store, pointsystem=None):
+    """
+    Get the canonical value ids of every capture in a fingerprint store.
+    Codes of the store are mapped to canonical ids per column, using the normalized values saved in the store.
+
+    Params:
+    [FingerprintStore] store: Fingerprint store or mapped store.
+    [dict] pointsystem: If given, only attributes used in the statistics are included, else all attributes.
+
+    Return:
+    Two variables, see get_tables_from_folder.
+    """
+    values = ValueDictionary(get_statistics_key)
+    used = [i for i, (category, attribute) in enumerate(store.columns) if pointsystem is None or is_scored(pointsystem, category, attribute)]
+    codes = store.get_codes()
+
+    # Code -1 (missing) becomes 0, the last entry of each lookup
+    lookups = []
+    for column in used:
+        lookup = [values.canonical[values.intern(value, normalized)] + 1
+                  for value, normalized in zip(store.values[column], store.normalized[column])]
+        lookups.append(np.array(lookup + [0], dtype=np.int64))
+
+    tables = {}
+    for browser, pv in sorted({(browser, pv) for _, pv, browser, _ in store.meta}):
+        rows = store.select(pv=pv, browser=browser)
+        table = np.zeros((len(rows), len(used)), dtype=np.int64)
+        for i, column in enumerate(used):
+            table[:, i] = lookups[i][codes[rows, column]]
+        tables.setdefault(browser, {})[pv] = table
+
+    return [store.columns[column] for column in used], tables
+
+
+def get_joint_ids(table):
+    """
+    Give each capture the id of its tuple of values. Columns are added one at a time, and after each column
+    the ids are made dense again, so combined ids never exceed the number of captures.
+    Once every capture has its own id, more columns cannot change the ids and the rest are skipped.
+
+    Params:
+    table: Numpy array (captures, columns) of value ids.
+
+    Return:
+    Numpy array with one id per capture, equal ids for equal tuples.
+    """
+    ids = np.zeros(table.shape[0], dtype=np.int64)
+    for column in table.T:
+        ids = ids * (int(column.max()) + 1) + column
+        _, ids = np.unique(ids, return_inverse=True)
+        ids = ids.reshape(-1)
+        if ids[-1:].size and ids.max() + 1 == len(ids):
+            break
+    return ids
+
+
+def get_combinations(columns, combine):
+    """
+    Get the attribute combinations to compute joint entropy of.
+
+    Params:
+    [list] columns: (category, attribute) of the columns.
+    [list] combine: Extra combinations, each a list of Category/Attribute or Category.
+
+    Return:
+    [dict]: Name of combination mapped to list of column indexes.
+    """
+    combinations = {"All attributes": list(range(len(columns)))}
+    for category in dict.fromkeys(category for category, _ in columns):
+        combinations[category] = [i for i, (c, _) in enumerate(columns) if c == category]
+
+    for names in combine:
+        indexes = []
+        for name in names:
+            category, _, attribute = name.partition("/")
+            found = [i for i, (c, a) in enumerate(columns) if c == category and (not attribute or a == attribute)]
+            if not found:
+                print(f"ERROR: {name} is not a counted attribute.")
+                exit(1)
+            indexes.extend(found)
+        combinations[" + ".join(names)] = indexes
+
+    return combinations
+
+
+def get_joint_entropy(columns, tables, combine):
+    """
+    Get joint entropy and anonymity sets of attribute combinations for each browser and PV.
+
+    Params:
+    [list] columns: (category, attribute) of the columns.
+    [dict] tables: Browser mapped to PV mapped to numpy array of value ids.
+    [list] combine: Extra combinations, see get_combinations.
+
+    Return:
+    [dict]: Browser mapped to PV mapped to combination mapped to metrics.
+    """
+    combinations = get_combinations(columns, combine)
+    result = {}
+    for browser in tables:
+        result[browser] = {}
+        for pv in tables[browser]:
+            table = tables[browser][pv]
+            result[browser][pv] = {}
+            if not len(table):
+                continue
+            for name, indexes in combinations.items():
+                counts = np.bincount(get_joint_ids(table[:, indexes]))
+                metrics = get_set_metrics(counts[counts > 0])
+                metrics["attributes"] = len(indexes)
+                result[browser][pv][name] = metrics
+
+    return result
+
+
+def get_ranking(attributes):
+    """
+    Rank attributes by entropy, highest first.
+
+    Params:
+    [dict] attributes: Category mapped to attribute mapped to metrics.
+
+    Return:
+    [list]: List of [category, attribute, entropy].
+    """
+    ranking = [[category, attribute, attributes[category][attribute]["entropy"]]
+               for category in attributes for attribute in attributes[category]]
+    ranking.sort(key=lambda r: -r[2])
+    return ranking
+
+
+def main():
+    """
+    Main function.
+    Compute entropy of attributes and attribute combinations and save a json report.
+    """
+    result_path = os.path.join(".", "results")
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--raw", default=os.path.join(result_path, "statistics_raw.json"), help="Path to statistics_raw.json")
+    parser.add_argument("-s", "--store", help="Path to fingerprint store (.npz) or mapped store (folder)")
+    parser.add_argument("-c", "--combine", nargs="+", action="append", default=[], help="Attributes of an extra combination, Category/Attribute or Category")
+    parser.add_argument("-o", "--output", default=os.path.join(result_path, "entropy.json"), help="Path to json report")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.raw):
+        print(f"ERROR: {args.raw} does not exist, run fingerprint_statistics.py first.")
+        exit(1)
+
+    statistics_raw = get_json_data(args.raw)
+    pointsystem = get_json_data(os.path.join(".", "Pointsystem", "pointsystem.json"))
+
+    if args.store:
+        store = FingerprintStore.load_mapped(args.store) if os.path.isdir(args.store) else FingerprintStore.load(args.store)
+        columns, tables = get_tables_from_store(store, pointsystem)
+    else:
+        columns, tables = get_tables_from_folder(os.path.join(".", "Fingerprints"), pointsystem)
+    joint = get_joint_entropy(columns, tables, args.combine)
+
+    entropy = {}
+    for browser in statistics_raw:
+        entropy[browser] = {}
+        for pv in statistics_raw[browser]:
+            attributes = get_attribute_entropy(statistics_raw[browser][pv])
+            entropy[browser][pv] = {
+                "attributes": attributes,
+                "ranking": get_ranking(attributes),
+                "joint": joint.get(browser, {}).get(pv, {})
+            }
+
+    with open(args.output, "w") as json_file:
+        json.dump(entropy, json_file, indent=1)
+
+    for browser in entropy:
+        for pv in entropy[browser]:
+            all_attributes = entropy[browser][pv]["joint"].get("All attributes")
+            if not all_attributes:
+                continue
+            print(browser, "-", pv)
+            print(f"All attributes: {all_attributes['entropy']} bits, {all_attributes['unique_captures']}/{all_attributes['captures']} unique captures")
+            for category, attribute, bits in entropy[browser][pv]["ranking"][:5]:
+                print(f"{category} - {attribute}: {bits} bits")
+            print("")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,32 @@
-import os, json
+import os, sys, json, argparse, hashlib
 
-def is_equal(v1, v2):
-    if isinstance(v1, str) and isinstance(v2, str):
-        return v1.strip() == v2.strip()
+# Shared modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from fingerprint_store import FingerprintStore
+from fingerprint_db import FingerprintDatabase
+from value_dictionary import ValueDictionary
+from normalize import normalize_value, get_statistics_key
+from fingerprint import Fingerprint, get_json_data
+from profiling import PROFILER
+from atomic_write import write_atomic
 
-    if isinstance(v1, list) and isinstance(v2, list):
-        if isinstance(v1[0], str):
-            return sorted(v1) == sorted(v2)
-        elif isinstance(v1[0], dict):
-            for d in v1:
-                if d not in v2:
-                    return False
-            return True
+# Increase when the content of the statistics state changes, an old state is then discarded
+STATE_VERSION = 2
 
+def get_value_key(value):
+    """
+    Get a hashable key for an attribute value, two values are equal when their keys are equal.
+    Strings are compared without surrounding whitespace, lists of strings in any order and
+    lists of dictionaries (media devices) as sets of dictionaries.
+    Value dictionaries use get_statistics_key, which gives the same key from the value's normalized form.
 
-def get_json_data(path):
-    # Read json data that tells what and how to extract data
-    with open(path, "r") as json_file:
-        data = json.load(json_file)
+    Params:
+    value: Attribute value.
 
-    return data
+    Return:
+    Hashable key.
+    """
+    return get_statistics_key(normalize_value(value))
 
 
 def total_num_elements(lst):
@@ -72,106 +79,457 @@ def genereate_statistics(statistics_raw):
 
     return statistics
 
-def genereate_statistics_raw(fingerprint_paths):
-    pointsystem = get_json_data(".\\Pointsystem\\pointsystem.json")
+def is_scored(pointsystem, category, attribute):
+    """
+    Check if an attribute is used in the statistics, that is given points in the pointsystem or is the media devices.
 
-    statistics_raw = {
-        "Chrome": {
-            "PV1": {},
-            "PV2": {}
-        },
-        "Edge": {
-            "PV1": {},
-            "PV2": {}
-        },
-        "Firefox": {
-            "PV1": {},
-            "PV2": {}
+    Params:
+    [dict] pointsystem: Used pointsystem.
+    [string] category: Category.
+    [string] attribute: Attribute.
+
+    Return:
+    [bool]: True if used.
+    """
+    try:
+        if pointsystem[category][attribute][0] == False:
+            return False
+    except:
+        if attribute != "Media Devices":
+            return False
+    return True
+
+
+def get_scored_values(fingerprint, pointsystem):
+    """
+    Get all values in a fingerprint that are used in the statistics.
+    Attributes not given points in the pointsystem are skipped, and every media device gives one label and one deviceId value.
+
+    Params:
+    [Fingerprint] fingerprint: Fingerprint.
+    [dict] pointsystem: Used pointsystem.
+
+    Return:
+    Generator of (category, attribute, value).
+    """
+    for _, category, attribute, value in fingerprint.items():
+        if not is_scored(pointsystem, category, attribute):
+            continue
+
+        if attribute == "Media Devices":
+            for m in value:
+                for attr in ["Media Devices: label", "Media Devices: deviceId"]:
+                    yield category, attr, m[attr.split(":")[-1].strip()]
+        else:
+            yield category, attribute, value
+
+
+def add_value(statistics_raw, index, values, browser, pv, category, attribute, value, count=1, normalized=None):
+    """
+    Count an attribute value.
+    The [count, value] lists in statistics_raw are shared with index, where they are found by the value's canonical id.
+
+    Params:
+    [dict] statistics_raw: Counted values.
+    [dict] index: (browser, pv, category, attribute) mapped to a dictionary of canonical id to [count, value].
+    [ValueDictionary] values: Value dictionary using get_statistics_key.
+    [string] browser: Browser.
+    [string] pv: Prefixed version.
+    [string] category: Category.
+    [string] attribute: Attribute.
+    value: Attribute value.
+    [int] count: Number of occurrences of the value.
+    normalized: Normalized form of the value if it is already known, see ValueDictionary.intern.
+
+    Return:
+    -
+    """
+    entries = statistics_raw[browser][pv].setdefault(category, {}).setdefault(attribute, [])
+    counts = index.setdefault((browser, pv, category, attribute), {})
+
+    value_id = values.intern(value, normalized)
+    key = values.canonical[value_id]
+    if key in counts:
+        counts[key][0] += count
+    else:
+        counts[key] = [count, values.values[value_id]]
+        entries.append(counts[key])
+
+
+def remove_value(statistics_raw, index, values, browser, pv, category, attribute, value_id):
+    """
+    Retract one previously counted attribute value.
+    Values, attributes and categories that are no longer counted are removed.
+
+    Params:
+    Same as add_value, but with the value's id in the value dictionary instead of the value.
+
+    Return:
+    -
+    """
+    counts = index[(browser, pv, category, attribute)]
+    key = values.canonical[value_id]
+    entry = counts[key]
+    entry[0] -= 1
+    if entry[0] > 0:
+        return
+
+    del counts[key]
+    entries = statistics_raw[browser][pv][category][attribute]
+    entries[:] = [e for e in entries if e is not entry]
+    if not entries:
+        del statistics_raw[browser][pv][category][attribute]
+        del index[(browser, pv, category, attribute)]
+        if not statistics_raw[browser][pv][category]:
+            del statistics_raw[browser][pv][category]
+
+
+def build_index(statistics_raw, keys):
+    """
+    Build the index of counted values used by add_value, from a saved statistics_raw and the canonical ids of its values.
+
+    Params:
+    [dict] statistics_raw: Counted values.
+    [dict] keys: Canonical id of each counted value, nested and ordered as statistics_raw.
+
+    Return:
+    [dict]: Index of counted values.
+    """
+    index = {}
+    for browser in statistics_raw:
+        for pv in statistics_raw[browser]:
+            for category in statistics_raw[browser][pv]:
+                for attribute in statistics_raw[browser][pv][category]:
+                    entries = statistics_raw[browser][pv][category][attribute]
+                    index[(browser, pv, category, attribute)] = dict(zip(keys[browser][pv][category][attribute], entries))
+    return index
+
+
+def get_keys(index):
+    """
+    Get the canonical id of each counted value, saved in the statistics state to build the index again.
+
+    Params:
+    [dict] index: Index of counted values.
+
+    Return:
+    [dict]: Browser mapped to PV mapped to category mapped to attribute mapped to canonical ids,
+        ordered as the counted values in statistics_raw.
+    """
+    keys = {}
+    for (browser, pv, category, attribute), counts in index.items():
+        # Counted values are added to statistics_raw in the same order as to the index
+        keys.setdefault(browser, {}).setdefault(pv, {}).setdefault(category, {})[attribute] = list(counts)
+    return keys
+
+
+def get_pointsystem_hash(pointsystem):
+    """
+    Hash a pointsystem, the statistics state is only valid for the pointsystem it was created with.
+
+    Params:
+    [dict] pointsystem: Used pointsystem.
+
+    Return:
+    [string]: Hex digest.
+    """
+    return hashlib.sha256(json.dumps(pointsystem, sort_keys=True).encode("UTF-8")).hexdigest()
+
+
+def new_state(pointsystem):
+    """
+    Create an empty statistics state.
+
+    Params:
+    [dict] pointsystem: Used pointsystem.
+
+    Return:
+    [dict]: State with counted values (statistics_raw), the canonical id of each counted value (keys),
+        the value dictionary (values), counted attributes (attributes) and the ids of the attributes and values
+        counted from each fingerprint file (files).
+    """
+    return {
+        "version": STATE_VERSION,
+        "pointsystem": get_pointsystem_hash(pointsystem),
+        "values": ValueDictionary(get_statistics_key).get_saved(),
+        "attributes": [],
+        "files": {},
+        "keys": {},
+        "statistics_raw": {
+            "Chrome": {
+                "PV1": {},
+                "PV2": {}
+            },
+            "Edge": {
+                "PV1": {},
+                "PV2": {}
+            },
+            "Firefox": {
+                "PV1": {},
+                "PV2": {}
+            }
         }
     }
 
-    for testCase in os.listdir(fingerprint_paths):
-        for pv in os.listdir(os.path.join(fingerprint_paths, testCase)):
-            for browser in os.listdir(os.path.join(fingerprint_paths, testCase, pv)):
-                # path to browser
-                path = os.path.join(fingerprint_paths, testCase, pv, browser)
-                # for each fingerprint
-                for f in os.listdir(path):              
-                    fingerprint = get_json_data(os.path.join(path, f))
-
-                    for category in fingerprint:
-                        for attribute in fingerprint[category]:
-                            try:
-                                if pointsystem[category][attribute][0] == False:
-                                    continue
-                            except:
-                                if attribute != "Media Devices":
-                                    continue
-
-                            value = fingerprint[category][attribute]
-
-
-                            if attribute == "Media Devices":
-                                for m in value:
-                                    # Check if category exist within statistics.
-                                    if category in statistics_raw[browser][pv]:
-                                        # Check if attribute exist within statistics.
-                                        for attr in ["Media Devices: label", "Media Devices: deviceId"]:
-                                            attr_value = m[attr.split(":")[-1].strip()]
-                                            if attr in statistics_raw[browser][pv][category]:
-                                                found = False
-                                                for a in statistics_raw[browser][pv][category][attr]:
-                                                    if is_equal(attr_value, a[1]):
-                                                        a[0] += 1
-                                                        found = True
-                                                        break
-                                                if not found:
-                                                    statistics_raw[browser][pv][category][attr].append([1, attr_value])
-                                            else:
-                                                statistics_raw[browser][pv][category][attr] = [[1, attr_value]]
-                                        
-                                    else:
-                                        # Add category and add attribute
-                                        statistics_raw[browser][pv][category] = {}
-                                        statistics_raw[browser][pv][category]["Media Devices: label"] = [[1, m['label']]]
-                                        statistics_raw[browser][pv][category]["Media Devices: deviceId"] = [[1, m['deviceId']]]
-                                    
-                            else:
-                                # Check if category exist within statistics.
-                                if category in statistics_raw[browser][pv]:
-                                    # Check if attribute exist within statistics.
-                                    if attribute in statistics_raw[browser][pv][category]:
-                                        found = False
-                                        for a in statistics_raw[browser][pv][category][attribute]:
-                                            if is_equal(value, a[1]):
-                                                a[0] += 1
-                                                found = True
-                                                break
-                                        if not found:
-                                            statistics_raw[browser][pv][category][attribute].append([1, value])
-                                    else:
-                                        statistics_raw[browser][pv][category][attribute] = [[1, value]]
-                                        
-                                else:
-                                    # Add category and add attribute
-                                    statistics_raw[browser][pv][category] = {}
-                                    statistics_raw[browser][pv][category][attribute] = [[1, value]]
+
+def load_state(path, pointsystem):
+    """
+    Load a saved statistics state. A missing state, or one created by another version or pointsystem, gives an empty state.
+
+    Params:
+    [string] path: Path to state file.
+    [dict] pointsystem: Used pointsystem.
+
+    Return:
+    [dict]: Statistics state.
+    """
+    if path and os.path.isfile(path):
+        state = get_json_data(path)
+        if state["version"] == STATE_VERSION and state["pointsystem"] == get_pointsystem_hash(pointsystem):
+            return state
+        print("Statistics state is outdated, all fingerprints are counted again.")
+
+    return new_state(pointsystem)
+
+
+def save_state(state, path):
+    """
+    Save statistics state.
+
+    Params:
+    [dict] state: Statistics state.
+    [string] path: Path to state file.
+
+    Return:
+    -
+    """
+    write_atomic(path, lambda json_file: json.dump(state, json_file))
+
+
+def genereate_statistics_raw(fingerprint_paths, state=None):
+    """
+    Count all attribute values in the fingerprints folder.
+    Given a saved state, only new fingerprint files are read and counted, and values from changed or deleted files are retracted.
+    Files keep the ids of their values in the saved value dictionary, so unchanged files only cost a stat call.
+
+    Params:
+    [string] fingerprint_paths: Path to fingerprints folder.
+    [dict] state: Statistics state, updated in place. If not given, all fingerprints are counted.
+
+    Return:
+    [dict]: Counted values.
+    """
+    pointsystem = get_json_data(os.path.join(".", "Pointsystem", "pointsystem.json"))
+
+    if state is None:
+        state = new_state(pointsystem)
+    statistics_raw = state["statistics_raw"]
+    values = ValueDictionary.from_saved(get_statistics_key, state["values"])
+    index = build_index(statistics_raw, state["keys"])
+    attributes = state["attributes"]
+    attribute_ids = {tuple(a): i for i, a in enumerate(attributes)}
+
+    # Find new and changed fingerprint files
+    with PROFILER.stage("scan"):
+        found = {}
+        for testCase in os.listdir(fingerprint_paths):
+            for pv in os.listdir(os.path.join(fingerprint_paths, testCase)):
+                for browser in os.listdir(os.path.join(fingerprint_paths, testCase, pv)):
+                    # path to browser
+                    path = os.path.join(fingerprint_paths, testCase, pv, browser)
+                    # for each fingerprint
+                    for f in os.listdir(path):
+                        stat = os.stat(os.path.join(path, f))
+                        found["/".join([testCase, pv, browser, f])] = [stat.st_mtime_ns, stat.st_size]
+
+    # Retract values from changed and deleted files
+    for name in list(state["files"]):
+        saved = state["files"][name]
+        if found.get(name) == [saved["mtime"], saved["size"]]:
+            continue
+        testCase, pv, browser, f = name.split("/")
+        for attribute_id, value_id in saved["values"]:
+            category, attribute = attributes[attribute_id]
+            remove_value(statistics_raw, index, values, browser, pv, category, attribute, value_id)
+        del state["files"][name]
+
+    # Count values from new and changed files
+    for name in found:
+        if name in state["files"]:
+            continue
+        testCase, pv, browser, f = name.split("/")
+        path = os.path.join(fingerprint_paths, testCase, pv, browser, f)
+        with PROFILER.stage("read json"):
+            fingerprint = Fingerprint.load(path, testCase, pv, browser)
+            PROFILER.add_read(path)
+
+        with PROFILER.stage("count"):
+            file_values = []
+            for category, attribute, value in get_scored_values(fingerprint, pointsystem):
+                add_value(statistics_raw, index, values, browser, pv, category, attribute, value)
+                if (category, attribute) not in attribute_ids:
+                    attribute_ids[(category, attribute)] = len(attributes)
+                    attributes.append([category, attribute])
+                file_values.append([attribute_ids[(category, attribute)], values.intern(value)])
+
+        state["files"][name] = {
+            "mtime": found[name][0],
+            "size": found[name][1],
+            "values": file_values
+        }
+
+    state["values"] = values.get_saved()
+    state["keys"] = get_keys(index)
     return statistics_raw
     
 
-def main():
-    fingerprint_paths = ".\\Fingerprints\\"
-    result_path = ".\\results\\"    
+def genereate_statistics_raw_from_store(store):
+    """
+    Count all attribute values in a fingerprint store.
+    Values are counted per column with numpy, and each distinct value is only decoded once.
+    Only attributes used in the statistics are read, so with a mapped store other columns are never decoded.
+
+    Params:
+    [FingerprintStore] store: Fingerprint store or mapped store.
+
+    Return:
+    [dict]: Counted values.
+    """
+    pointsystem = get_json_data(os.path.join(".", "Pointsystem", "pointsystem.json"))
+    statistics_raw = new_state(pointsystem)["statistics_raw"]
+    index = {}
+    values = ValueDictionary(get_statistics_key)
+
+    for browser in statistics_raw:
+        for pv in statistics_raw[browser]:
+            rows = store.select(pv=pv, browser=browser)
+            if not rows:
+                continue
+
+            for column, (category, attribute) in enumerate(store.columns):
+                if not is_scored(pointsystem, category, attribute):
+                    continue
+
+                codes, counts = store.count_codes(rows, column)
+                for code, count in zip(codes, counts):
+                    value = store.values[column][code]
+                    if attribute == "Media Devices":
+                        for m in value:
+                            for attr in ["Media Devices: label", "Media Devices: deviceId"]:
+                                add_value(statistics_raw, index, values, browser, pv, category, attr, m[attr.split(":")[-1].strip()], int(count))
+                    else:
+                        add_value(statistics_raw, index, values, browser, pv, category, attribute, value, int(count), store.normalized[column][code])
 
-    statistics_raw = genereate_statistics_raw(fingerprint_paths)
-    statistics = genereate_statistics(statistics_raw)
-                                
+    return statistics_raw
+
+
+def genereate_statistics_raw_from_db(db):
+    """
+    Count all attribute values in a fingerprint database.
+    Values are counted with one grouped query per browser and PV.
+
+    Params:
+    [FingerprintDatabase] db: Fingerprint database.
+
+    Return:
+    [dict]: Counted values.
+    """
+    pointsystem = get_json_data(os.path.join(".", "Pointsystem", "pointsystem.json"))
+    statistics_raw = new_state(pointsystem)["statistics_raw"]
+    index = {}
+    values = ValueDictionary(get_statistics_key)
+
+    for browser in statistics_raw:
+        for pv in statistics_raw[browser]:
+            for category, attribute, value, normalized, count in db.count_values(browser, pv):
+                if not is_scored(pointsystem, category, attribute):
+                    continue
+                if attribute == "Media Devices":
+                    for m in value:
+                        for attr in ["Media Devices: label", "Media Devices: deviceId"]:
+                            add_value(statistics_raw, index, values, browser, pv, category, attr, m[attr.split(":")[-1].strip()], count)
+                else:
+                    add_value(statistics_raw, index, values, browser, pv, category, attribute, value, count, normalized)
+
+    return statistics_raw
+
+
+def save_results(statistics_raw, statistics, result_path):
+    """
+    Save statistics_raw.json and statistics.json.
+
+    Params:
+    [dict] statistics_raw: Counted values.
+    [dict] statistics: Statistics from genereate_statistics.
+    [string] result_path: Path to results folder.
+
+    Return:
+    -
+    """
     with open(os.path.join(result_path, "statistics_raw.json"), "w") as json_file:
-        json.dump(statistics_raw, json_file, indent=1) 
+        json.dump(statistics_raw, json_file, indent=1)
+    PROFILER.add_written(os.path.join(result_path, "statistics_raw.json"))
 
     with open(os.path.join(result_path, "statistics.json"), "w") as json_file:
-        json.dump(statistics, json_file, indent=1)          
+        json.dump(statistics, json_file, indent=1)
+    PROFILER.add_written(os.path.join(result_path, "statistics.json"))
+
+
+def main():
+    """
+    Main function.
+    Count attribute values in all fingerprints and save statistics_raw.json and statistics.json.
+    Counted values are saved in a state file so that the next run only reads new or changed fingerprints.
+
+    Optional arguments:
+    --full: Ignore the saved state and count all fingerprints.
+    --state: Path to state file.
+    --store: Read fingerprints from a fingerprint store (.npz) or mapped store (folder) instead of the fingerprints folder.
+    --db: Read fingerprints from a fingerprint database instead of the fingerprints folder.
+    --timing: Path to json report with time spent in each stage.
+    --profile: Folder where a cProfile dump of each stage is saved, used with --timing.
+    """
+    fingerprint_paths = os.path.join(".", "Fingerprints")
+    result_path = os.path.join(".", "results")
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--full", action="store_true", help="Ignore saved state and count all fingerprints")
+    parser.add_argument("--state", default=os.path.join(result_path, "statistics_state.json"), help="Path to state file")
+    parser.add_argument("--store", help="Path to fingerprint store (.npz) or mapped store (folder)")
+    parser.add_argument("--db", help="Path to fingerprint database")
+    parser.add_argument("--timing", help="Path to json report with time spent in each stage")
+    parser.add_argument("--profile", help="Folder where a cProfile dump of each stage is saved, used with --timing")
+    args = parser.parse_args()
+
+    if args.timing:
+        PROFILER.enable(args.timing, args.profile)
+
+    if args.store:
+        with PROFILER.stage("statistics raw"):
+            store = FingerprintStore.load_mapped(args.store) if os.path.isdir(args.store) else FingerprintStore.load(args.store)
+            statistics_raw = genereate_statistics_raw_from_store(store)
+    elif args.db:
+        with PROFILER.stage("statistics raw"):
+            statistics_raw = genereate_statistics_raw_from_db(FingerprintDatabase(args.db))
+    else:
+        with PROFILER.stage("load state"):
+            pointsystem = get_json_data(os.path.join(".", "Pointsystem", "pointsystem.json"))
+            state = new_state(pointsystem) if args.full else load_state(args.state, pointsystem)
+        with PROFILER.stage("statistics raw"):
+            statistics_raw = genereate_statistics_raw(fingerprint_paths, state)
+    with PROFILER.stage("statistics"):
+        statistics = genereate_statistics(statistics_raw)
+
+    with PROFILER.stage("write results"):
+        save_results(statistics_raw, statistics, result_path)
+
+    if not args.store and not args.db:
+        with PROFILER.stage("save state"):
+            save_state(state, args.state)
+            PROFILER.add_written(args.state)
+
+    PROFILER.save("fingerprint_statistics")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,4 +1,4 @@
-import json
+import json, os
 from unicodedata import category
 
 
@@ -32,7 +32,7 @@ def get_distribution(data, browser, pv):
 
 
 def main():
-    data = get_json_data(".\\results\\statistics.json")
+    data = get_json_data(os.path.join(".", "results", "statistics.json"))
 
     distribution = {}
 
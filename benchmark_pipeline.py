@@ -0,0 +1,176 @@
+"""
+Benchmark Pipeline
+
+Description:
+Written to be run through the commandprompt with passing arguments.
+Time extraction, analysis, statistics and summary on synthetic corpora at several scales, to measure how
+the pipeline scales and to find regressions offline. Scale 1 is 'days' test days, scale N is N times as many days.
+Each scale is run in its own workspace folder with the files the scripts expect (Pointsystem, extraction_config
+and the results template), and the scripts are run the same way as Complete_analysis.ps1 runs them.
+
+Optional arguments:
+--scales: Scales to run.
+--days: Number of test days at scale 1.
+--entropy: Probability that an attribute differs from its baseline, see generate_corpus.py.
+--padding: Kilobytes of unrelated markup added to each html file.
+--workers: Number of processes used by extraction and analysis.
+--workspace: Folder where workspaces are created, kept after the run. A temporary folder is used if not given.
+--output: Path to json report.
+-h: Print argument usage.
+
+"""
+
+
+import os, sys, json, time, shutil, argparse, subprocess, tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(ROOT, "test_data"))
+from generate_corpus import generate_corpus
+
+STAGES = ["extract", "analyze", "statistics", "summary"]
+
+
+def prepare_workspace(path):
+    """
+    Create a workspace with the files the scripts read relative to the working directory.
+
+    Params:
+    [string] path: Path to workspace.
+
+    Return:
+    -
+    """
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.makedirs(os.path.join(path, "results"))
+    os.makedirs(os.path.join(path, "Fingerprints"))
+    shutil.copytree(os.path.join(ROOT, "Pointsystem"), os.path.join(path, "Pointsystem"))
+    shutil.copytree(os.path.join(ROOT, "bl_extrator", "extraction_config"), os.path.join(path, "bl_extrator", "extraction_config"))
+
+    template = os.path.join(ROOT, "results", "analysis_results - Template.json")
+    shutil.copy(template, os.path.join(path, "results"))
+    shutil.copy(template, os.path.join(path, "results", "analysis_results.json"))
+
+
+def get_commands(test_cases, workers):
+    """
+    Get the commands of each stage, as run by Complete_analysis.ps1.
+
+    Params:
+    [list] test_cases: Paths to test case folders, relative to the workspace.
+    [int] workers: Number of processes used by extraction and analysis.
+
+    Return:
+    [dict]: Stage mapped to list of commands.
+    """
+    python = sys.executable
+    return {
+        "extract": [[python, os.path.join(ROOT, "bl_extrator", "bl_extract.py"), test_case,
+                     "--parser", "auto", "--targeted", "--workers", str(workers)] for test_case in test_cases],
+        "analyze": [[python, os.path.join(ROOT, "Analysis_script", "batch_analysis.py"), "Fingerprints",
+                     "--done", "done_analysing.txt", "--workers", str(workers)]],
+        "statistics": [[python, os.path.join(ROOT, "Fingerprint_Statistics", "fingerprint_statistics.py"), "--full"]],
+        "summary": [[python, os.path.join(ROOT, "Statistics_summary.py")]]
+    }
+
+
+def run_stage(commands, workspace):
+    """
+    Run the commands of a stage and time them. Will exit if a command fails.
+
+    Params:
+    [list] commands: Commands to run.
+    [string] workspace: Working directory.
+
+    Return:
+    [float]: Seconds.
+    """
+    start = time.perf_counter()
+    for command in commands:
+        result = subprocess.run(command, cwd=workspace, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if result.returncode != 0:
+            print(f"ERROR: {' '.join(command)} failed.\n{result.stderr}")
+            exit(1)
+    return time.perf_counter() - start
+
+
+def benchmark_scale(scale, workspace, args):
+    """
+    Generate a corpus at one scale and time each stage on it.
+
+    Params:
+    [int] scale: Scale, the corpus has scale times 'days' test days.
+    [string] workspace: Path to workspace.
+    args: Commandline arguments.
+
+    Return:
+    [dict]: Result of the scale.
+    """
+    prepare_workspace(workspace)
+
+    days = args.days * scale
+    start = time.perf_counter()
+    test_cases = generate_corpus(os.path.join(workspace, "test_data"), days=days, entropy=args.entropy, padding=args.padding, seed=scale)
+    generate_time = time.perf_counter() - start
+
+    test_cases = [os.path.relpath(test_case, workspace) for test_case in test_cases]
+    captures = sum(1 for _, _, files in os.walk(os.path.join(workspace, "test_data")) if "m_data.json" in files)
+
+    commands = get_commands(test_cases, args.workers)
+    stages = {}
+    for stage in STAGES:
+        seconds = run_stage(commands[stage], workspace)
+        stages[stage] = {
+            "seconds": round(seconds, 3),
+            "ms_per_capture": round(seconds * 1000 / captures, 3)
+        }
+        print(f"{scale}x {stage}: {seconds:.2f} s ({stages[stage]['ms_per_capture']} ms per capture)")
+
+    return {
+        "scale": scale,
+        "days": days,
+        "captures": captures,
+        "generate_seconds": round(generate_time, 3),
+        "stages": stages
+    }
+
+
+def main():
+    """
+    Main function.
+    Run the benchmark at each scale and save a json report.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100], help="Scales to run")
+    parser.add_argument("--days", type=int, default=1, help="Number of test days at scale 1")
+    parser.add_argument("--entropy", type=float, default=0.1, help="Probability that an attribute differs from its baseline")
+    parser.add_argument("--padding", type=int, default=50, help="Kilobytes of unrelated markup added to each html file")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes used by extraction and analysis")
+    parser.add_argument("--workspace", help="Folder where workspaces are created, kept after the run")
+    parser.add_argument("--output", default=os.path.join(ROOT, "results", "benchmark.json"), help="Path to json report")
+    args = parser.parse_args()
+
+    root = args.workspace or tempfile.mkdtemp(prefix="fingerprint_benchmark_")
+    results = []
+    try:
+        for scale in args.scales:
+            results.append(benchmark_scale(scale, os.path.join(root, f"{scale}x"), args))
+    finally:
+        if not args.workspace:
+            shutil.rmtree(root, ignore_errors=True)
+
+    # Time per capture relative to the first scale, 1.0 means linear scaling
+    base = results[0]
+    for result in results:
+        for stage in STAGES:
+            result["stages"][stage]["relative_per_capture"] = round(
+                result["stages"][stage]["ms_per_capture"] / base["stages"][stage]["ms_per_capture"], 2) if base["stages"][stage]["ms_per_capture"] else None
+
+    with open(args.output, "w") as json_file:
+        json.dump({"entropy": args.entropy, "padding": args.padding, "workers": args.workers, "results": results}, json_file, indent=1)
+
+    print(f"Saved benchmark report to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
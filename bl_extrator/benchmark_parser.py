@@ -0,0 +1,130 @@
+"""
+Parser Benchmark
+
+Description:
+Written to be run through the commandprompt with passing arguments.
+Time parsing and extraction of the browserleaks html files with every available parser backend,
+both parsing the whole page and only the elements listed in the config files.
+The extracted data is compared with the default backend (html.parser, whole page) to make sure the fingerprint does not change.
+
+Positional arguments:
+[string] source: Path to test case folder, or to folder with several test cases.
+
+Optional arguments:
+-r, --repeat: Number of times each page is parsed.
+-h: Print argument usage.
+
+"""
+
+
+import os, argparse, time
+from bl_extract import get_html_content, get_json_data, extract_data, extract_data_webRTC, LXML_INSTALLED, LOOKUP
+
+
+def find_html_files(source):
+    """
+    Find all browserleaks html files below a folder.
+
+    Params:
+    [string] source: Path to folder.
+
+    Return:
+    [dict]: Page type mapped to a sorted list of paths.
+    """
+    pages = {name: [] for name in LOOKUP}
+    for root, dirs, files in os.walk(source):
+        for f in files:
+            if f in LOOKUP:
+                pages[f].append(os.path.join(root, f))
+
+    for name in pages:
+        pages[name].sort()
+    return pages
+
+
+def extract_page(path, name, config, parser, targeted):
+    """
+    Parse one html file and extract its attributes.
+
+    Params:
+    [string] path: Path to html file.
+    [string] name: Page type.
+    [dict] config: Config for the page type.
+    [string] parser: Parser backend.
+    [bool] targeted: Only parse the elements listed in config.
+
+    Return:
+    [dict]: Extracted attributes.
+    """
+    html = get_html_content(path, parser, list(config.values()) if targeted else None)
+    if name == "webrtc_leak.html":
+        return extract_data_webRTC(html, config)
+    return extract_data(html, config)
+
+
+def benchmark(pages, config_path, repeat):
+    """
+    Time every backend on every page type.
+
+    Params:
+    [dict] pages: Page type mapped to list of paths.
+    [string] config_path: Path to config files.
+    [int] repeat: Number of times each page is parsed.
+
+    Return:
+    [list]: List of dictionaries with page, backend, time, speedup and if output matches.
+    """
+    backends = [("html.parser", False), ("html.parser", True)]
+    if LXML_INSTALLED:
+        backends += [("lxml", False), ("lxml", True)]
+
+    results = []
+    for name in pages:
+        if not pages[name]:
+            continue
+        config = get_json_data(os.path.join(config_path, LOOKUP[name]))
+        expected = [extract_page(path, name, config, "html.parser", False) for path in pages[name]]
+
+        base_time = None
+        for parser, targeted in backends:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                extracted = [extract_page(path, name, config, parser, targeted) for path in pages[name]]
+            elapsed = time.perf_counter() - start
+
+            if base_time is None:
+                base_time = elapsed
+            results.append({
+                "page": name,
+                "backend": parser + (" (targeted)" if targeted else ""),
+                "ms_per_page": elapsed / (repeat * len(pages[name])) * 1000,
+                "speedup": base_time / elapsed,
+                "equal": extracted == expected
+            })
+
+    return results
+
+
+def main():
+    """
+    Main function.
+    Print time per page and speedup compared to html.parser for each page type and backend.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", help="Path to test case folder")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Number of times each page is parsed")
+    args = parser.parse_args()
+
+    config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "extraction_config")
+    pages = find_html_files(args.source)
+
+    if not LXML_INSTALLED:
+        print("lxml is not installed, only html.parser is benchmarked.")
+
+    for r in benchmark(pages, config_path, args.repeat):
+        status = "OK" if r["equal"] else "MISMATCH"
+        print(f"{r['page']:<18} {r['backend']:<25} {r['ms_per_page']:8.2f} ms/page {r['speedup']:6.2f}x  {status}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,32 @@
-import json, os, argparse
-from bs4 import BeautifulSoup as bs
+import os, sys, argparse, traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from bs4 import BeautifulSoup as bs, SoupStrainer
+from extraction_cache import ExtractionCache, get_input_hash
+
+# Shared modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from fingerprint_store import FingerprintStore
+from fingerprint_db import FingerprintDatabase
+from fingerprint import Fingerprint, get_json_data
+from profiling import PROFILER
+
+# lxml is optional, it is only used as a faster parser backend if installed
+try:
+    import lxml
+    LXML_INSTALLED = True
+except ImportError:
+    LXML_INSTALLED = False
+
+# Increase when a change in the extraction changes the extracted fingerprints, this invalidates the extraction cache
+EXTRACTION_VERSION = 1
+
+# html file mapped to the config file that informs how to extract it
+LOOKUP = {
+    "http_header.html": "http_headers.json",
+    "javascript.html": "javascript.json",
+    "webrtc_leak.html": "webRTC.json"
+}
 
 
 def extract_list(html, seperator):
@@ -35,7 +62,8 @@ def extract_list(html, seperator):
         
         for element in br_lst:
             if "<br/>" not in str(element):
-                lst.append(element)
+                # Plain string, a NavigableString keeps a reference to the whole html tree
+                lst.append(str(element))
 
     return lst
 
@@ -138,12 +166,12 @@ def extract_data(bs_html, config):
 
     return fingerprint
 
-def save_data(data, path, filename):
+def save_data(fingerprint, path, filename):
     """
-    Will save json data to a given path. The path will be created if it does not exist.
+    Will save a fingerprint as json to a given path. The path will be created if it does not exist.
 
     Params:
-    [dict] data: Dictionary that contains data that is desired to be saved into a json format.
+    [Fingerprint] fingerprint: Fingerprint that is desired to be saved into a json format.
     [string] path: Path to save location.
     [string] filename: Desired filename.
 
@@ -151,75 +179,105 @@ def save_data(data, path, filename):
     -
     """
 
-    if not os.path.isdir(path):
-        os.makedirs(path)
+    # exist_ok since parallel workers may create the same folder
+    os.makedirs(path, exist_ok=True)
 
-    with open(os.path.join(path, filename), "w") as json_file:
-        json.dump(data, json_file, indent=1)
+    with PROFILER.stage("write json"):
+        fingerprint.save(os.path.join(path, filename))
+        PROFILER.add_written(os.path.join(path, filename))
 
-def get_html_content(html_path):
+def get_parser(name):
+    """
+    Get name of parser backend used by BeautifulSoup.
+
+    Params:
+    [string] name: "html.parser", "lxml" or "auto". Auto will use lxml if installed.
+
+    Return:
+    [string]: Parser backend.
+    """
+    if name == "auto":
+        return "lxml" if LXML_INSTALLED else "html.parser"
+    if name == "lxml" and not LXML_INSTALLED:
+        print("ERROR: lxml is not installed.")
+        exit(1)
+    return name
+
+def get_html_content(html_path, parser="html.parser", target_ids=None):
     """
     Read and return data from html file.
 
     Params:
     [string] path: Path to html file.
+    [string] parser: Parser backend used by BeautifulSoup.
+    [list] target_ids: If set, only elements with these ids (and their content) are parsed into the tree.
 
     Return:
     [dict]: html data.
     """
+    parse_only = SoupStrainer(id=target_ids) if target_ids else None
+
     # Get html content
-    with open(html_path, "r", encoding="UTF-8") as f:
-        soup = bs(f, "html.parser")
+    with PROFILER.stage("parse html"):
+        with open(html_path, "r", encoding="UTF-8") as f:
+            soup = bs(f, parser, parse_only=parse_only)
+        PROFILER.add_read(html_path)
     return soup
 
-def get_json_data(path):
+# Config files of each config path, read once per process by get_configs
+configs_cache = {}
+
+
+def get_configs(config_path):
     """
-    Read and return data from json file.
+    Get the config files that inform how to extract each html file. They are read the first time and then kept,
+    so each process reads them once instead of once per html file.
 
     Params:
-    [string] path: Path to json file.
+    [string] config_path: Path to config files.
 
     Return:
-    [dict]: json data.
+    [dict]: html file name mapped to its config.
     """
-    # Read json data that tells what and how to extract data
-    with open(path, "r") as json_file:
-        data = json.load(json_file)
+    if config_path not in configs_cache:
+        configs = {}
+        for html_file, config_file in LOOKUP.items():
+            with PROFILER.stage("read json"):
+                configs[html_file] = get_json_data(os.path.join(config_path, config_file))
+                PROFILER.add_read(os.path.join(config_path, config_file))
+        configs_cache[config_path] = configs
 
-    return data
+    return configs_cache[config_path]
 
-def get_html_files(html_path, config_path):
+
+def iter_html_files(html_path, configs, parser="html.parser", targeted=False):
     """
-    Given a path to folder with html files, it will read content to memory, and the config json file that informs
-    how to extract the html file's desired content.
+    Given a path to folder with html files, parse one html file at a time together with the config that informs
+    how to extract its desired content. The tree of a file is released when the next file is requested,
+    so only one tree is held in memory.
 
     Params:
     [string] html_path: Path to html files.
-    [string] config_path: Path to config files.
+    [dict] configs: html file name mapped to its config, see get_configs.
+    [string] parser: Parser backend used by BeautifulSoup.
+    [bool] targeted: Only parse the elements with ids listed in the config file.
 
     Return:
-    [list]: List of http data.
+    Generator of (html file name, parsed html, config).
     """
-    lookup = {
-        "http_header.html": "http_headers.json",
-        "javascript.html": "javascript.json",
-        "webrtc_leak.html": "webRTC.json"
-    }
-    http_lst = []
     for f in os.listdir(html_path):
         if ".json" in f:
             continue
-        if f not in lookup:
+        if f not in LOOKUP:
             print(f"ERROR: {f} is named incorrectly. Check spelling.")
         filepath = os.path.join(html_path, f)
         if os.path.isfile(filepath):
-            http_lst.append({
-                "name": f,
-                "html": get_html_content(filepath),
-                "config": get_json_data(os.path.join(config_path, lookup[f]))
-            })
-
-    return http_lst
+            config = configs[f]
+            target_ids = list(config.values()) if targeted else None
+            html = get_html_content(filepath, parser, target_ids)
+            yield f, html, config
+            # Break the references inside the tree so its memory is freed at once
+            html.decompose()
 
 def create_save_location(originPath, pv, browser):
     """
@@ -234,9 +292,9 @@ def create_save_location(originPath, pv, browser):
     [string]: Constructed path.
     """
 
-    test_date = originPath.split("\\")[-1]
+    test_date = os.path.basename(os.path.normpath(originPath))
 
-    save_path = os.path.join(originPath, "..\\..\\Fingerprints", test_date, pv, browser)  
+    save_path = os.path.join(originPath, "..", "..", "Fingerprints", test_date, pv, browser)
 
     return save_path
 
@@ -257,6 +315,224 @@ def strip_strings_in_dict(d):
     return d
 
 
+def extract_fingerprint(path, config_path, parser="html.parser", targeted=False):
+    """
+    Extract one fingerprint from a test folder's three html files and its m_data.json file.
+    Each html file is parsed, extracted and released before the next one is parsed.
+
+    Params:
+    [string] path: Path to test folder.
+    [string] config_path: Path to config files.
+    [string] parser: Parser backend used by BeautifulSoup.
+    [bool] targeted: Only parse the elements with ids listed in the config files.
+
+    Return:
+    [dict]: Extracted fingerprint.
+    """
+    with PROFILER.stage("read json"):
+        data = get_json_data(os.path.join(path, "m_data.json"))
+        PROFILER.add_read(os.path.join(path, "m_data.json"))
+    data = strip_strings_in_dict(data)
+
+    for name, html, config in iter_html_files(path, get_configs(config_path), parser, targeted):
+        with PROFILER.stage("extract"):
+            if "webrtc_leak" in name:
+                data.update(extract_data_webRTC(html, config))
+            else:
+                data.update(extract_data(html, config))
+
+    return data
+
+
+def get_output_location(unit):
+    """
+    Get where the fingerprint of one test number is saved.
+
+    Params:
+    [tuple] unit: (test_path, pv, browser, test_num, options).
+
+    Return:
+    Two variables. Save location and filename.
+    """
+    test_path, pv, browser, test_num, options = unit
+    save_location = create_save_location(test_path, pv, browser) if not options["debug"] else os.path.join(".", "extracted_data")
+    filename = "fingerprint_" + test_num + ".json"
+
+    return save_location, filename
+
+
+def filter_cached_units(units, cache):
+    """
+    Remove test numbers whose input is unchanged since they were last extracted.
+
+    Params:
+    [list] units: Units passed to extract_test_num.
+    [ExtractionCache] cache: Extraction cache.
+
+    Return:
+    Two variables. List of units to extract and dictionary mapping their test folder to (input hash, output path).
+    """
+    todo = []
+    pending = {}
+    for unit in units:
+        folder = os.path.join(*unit[:4])
+        input_hash = get_input_hash(folder, unit[4]["config_path"], LOOKUP)
+        output = os.path.join(*get_output_location(unit))
+        if cache.is_fresh(folder, input_hash, output):
+            continue
+        todo.append(unit)
+        pending[folder] = (input_hash, output)
+
+    return todo, pending
+
+
+def extract_test_num(unit):
+    """
+    Extract the fingerprint of one test number. One unit of work when extracting in parallel.
+    Any error is caught and returned so that one broken folder does not stop the whole run.
+
+    Params:
+    [tuple] unit: (test_path, pv, browser, test_num, options).
+        options is a dictionary with config_path, debug, parser and targeted.
+
+    Return:
+    Three variables. Path to test folder, error message or None if successful, and the fingerprint or None if failed.
+    """
+    test_path, pv, browser, test_num, options = unit
+    path = os.path.join(test_path, pv, browser, test_num)
+    try:
+        data = extract_fingerprint(path, options["config_path"], options["parser"], options["targeted"])
+        test_date = os.path.basename(os.path.normpath(test_path))
+        fingerprint = Fingerprint.from_data(data, test_date, pv, browser, test_num)
+    except Exception:
+        return path, traceback.format_exc(), None
+
+    return path, None, fingerprint
+
+
+def init_worker(timing):
+    """
+    Prepare a process for extracting test numbers.
+
+    Params:
+    [bool] timing: Record stages, they are returned by extract_in_worker.
+
+    Return:
+    -
+    """
+    if timing:
+        PROFILER.enable_worker()
+
+
+def extract_in_worker(unit):
+    """
+    Extract the fingerprint of one test number in a worker process.
+
+    Params:
+    [tuple] unit: Unit passed to extract_test_num.
+
+    Return:
+    Two variables. Result of extract_test_num and the stages recorded while extracting.
+    """
+    return extract_test_num(unit), PROFILER.take_stages()
+
+
+def extract_units(units, workers=1):
+    """
+    Extract the given test numbers, in parallel if more than one worker is used.
+    Results are yielded in the same order as units as soon as they are done, and at most a few results per worker
+    are waiting to be consumed, so memory use does not grow with the number of test numbers.
+
+    Params:
+    [list] units: Units passed to extract_test_num.
+    [int] workers: Number of processes.
+
+    Return:
+    Generator of (unit, path to test folder, error message or None, fingerprint or None).
+    """
+    if workers <= 1:
+        for unit in units:
+            yield (unit,) + extract_test_num(unit)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(PROFILER.enabled,)) as executor:
+        running = deque()
+        remaining = iter(units)
+        for unit in remaining:
+            running.append((unit, executor.submit(extract_in_worker, unit)))
+            if len(running) >= workers * 4:
+                break
+        while running:
+            unit, future = running.popleft()
+            result, stages = future.result()
+            PROFILER.merge_stages(stages)
+            for next_unit in remaining:
+                running.append((next_unit, executor.submit(extract_in_worker, next_unit)))
+                break
+            yield (unit,) + result
+
+
+def save_fingerprint(unit, fingerprint):
+    """
+    Save the fingerprint of one test number as json in its output location.
+
+    Params:
+    [tuple] unit: (test_path, pv, browser, test_num, options).
+    [Fingerprint] fingerprint: Extracted fingerprint.
+
+    Return:
+    -
+    """
+    save_location, filename = get_output_location(unit)
+    save_data(fingerprint, save_location, filename)
+
+
+def get_units(test_path, options):
+    """
+    List all test numbers in a test case folder, sorted to always give the same order.
+
+    Params:
+    [string] test_path: Path to test case folder.
+    [dict] options: Extraction options, see extract_test_num.
+
+    Return:
+    [list]: List of units passed to extract_test_num.
+    """
+    units = []
+    for pv in sorted(os.listdir(test_path)):
+        for browser in sorted(os.listdir(os.path.join(test_path, pv))):
+            for test_num in sorted(os.listdir(os.path.join(test_path, pv, browser))):
+                units.append((test_path, pv, browser, test_num, options))
+
+    return units
+
+
+def add_saved_to_store(store, test_path, units, extracted):
+    """
+    Add the fingerprints of test numbers that were not extracted, such as those skipped by the extraction cache,
+    to the fingerprint store or database. They are read from their saved json file if missing in the store.
+
+    Params:
+    store: FingerprintStore or FingerprintDatabase.
+    [string] test_path: Path to test case folder.
+    [list] units: All units of the test case.
+    [set] extracted: Paths to test folders that were extracted and already added.
+
+    Return:
+    -
+    """
+    test_date = os.path.basename(os.path.normpath(test_path))
+
+    for unit in units:
+        _, pv, browser, test_num, _ = unit
+        if os.path.join(*unit[:4]) in extracted:
+            continue
+        if not store.has(test_date, pv, browser, test_num):
+            output = os.path.join(*get_output_location(unit))
+            if os.path.isfile(output):
+                store.add(test_date, pv, browser, test_num, get_json_data(output))
+
+
 def main():
     """
     Main function.
@@ -265,37 +541,98 @@ def main():
 
     Positional arguments:
     [string] source: Path to test case folder.
+
+    Optional arguments:
+    -w, --workers: Number of processes used to extract test numbers in parallel.
+    -d, --debug: Save all fingerprints in a debug folder.
+    -p, --parser: Parser backend, html.parser, lxml or auto.
+    -t, --targeted: Only parse the elements listed in the config files.
+    -c, --cache: Path to extraction cache. Test numbers with unchanged input are skipped.
+    --cache-size: Max number of test numbers kept in the cache.
+    -s, --store: Path to fingerprint store. Fingerprints are also saved in the store.
+    --db: Path to fingerprint database. Fingerprints are also saved in the database.
+    --timing: Path to json report with time spent in each stage.
+    --profile: Folder where a cProfile dump of each stage is saved, used with --timing.
     """
 
     # Arguments
     parser = argparse.ArgumentParser()
     parser.add_argument("test_path", help="path to folder with test data for one test day.")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="number of processes used for extraction.")
+    parser.add_argument("-d", "--debug", action="store_true", help="save fingerprints in a debug folder.")
+    parser.add_argument("-p", "--parser", choices=["html.parser", "lxml", "auto"], default="html.parser", help="parser backend used for html files.")
+    parser.add_argument("-t", "--targeted", action="store_true", help="only parse elements with ids listed in the config files.")
+    parser.add_argument("-c", "--cache", help="path to extraction cache, unchanged test numbers are skipped.")
+    parser.add_argument("--cache-size", type=int, default=100000, help="max number of test numbers kept in the cache.")
+    parser.add_argument("-s", "--store", help="path to fingerprint store, fingerprints are also saved in the store.")
+    parser.add_argument("--db", help="path to fingerprint database, fingerprints are also saved in the database.")
+    parser.add_argument("--timing", help="path to json report with time spent in each stage.")
+    parser.add_argument("--profile", help="folder where a cProfile dump of each stage is saved, used with --timing.")
     args = parser.parse_args()
+
+    if args.timing:
+        PROFILER.enable(args.timing, args.profile)
     
-    exists = os.path.exists(".\\bl_extrator\\extraction_config")
-    config_path = ".\\bl_extrator\\extraction_config" if exists else ".\\extraction_config\\"
-
-    for pv in os.listdir(args.test_path):
-        for browser in os.listdir(os.path.join(args.test_path, pv)):
-            for test_num in os.listdir(os.path.join(args.test_path, pv, browser)):
-                path = os.path.join(args.test_path, pv, browser, test_num)
-
-                html_lst = get_html_files(path, config_path)
-
-                data = get_json_data(os.path.join(path, "m_data.json"))
-                data = strip_strings_in_dict(data)
-                for html in html_lst:
-                    if "webrtc_leak" in html["name"]:
-                        data.update(extract_data_webRTC(html["html"], html["config"]))
-                    else:
-                        data.update(extract_data(html["html"], html["config"]))
-
-                # Save data as json file
-                save_location = create_save_location(args.test_path, pv, browser) if not args.debug else ".\\extracted_data"
-                filename = "fingerprint_" + test_num + ".json"
-                save_data(data, save_location, filename)
-    
-    return 0
+    exists = os.path.exists(os.path.join(".", "bl_extrator", "extraction_config"))
+    config_path = os.path.join(".", "bl_extrator", "extraction_config") if exists else os.path.join(".", "extraction_config")
+
+    options = {
+        "config_path": config_path,
+        "debug": args.debug,
+        "parser": get_parser(args.parser),
+        "targeted": args.targeted
+    }
+    with PROFILER.stage("list"):
+        units = get_units(args.test_path, options)
+
+        all_units = units
+
+        cache = ExtractionCache(args.cache, EXTRACTION_VERSION, args.cache_size) if args.cache else None
+        if cache:
+            units, pending = filter_cached_units(units, cache)
+            print(f"Skipping {len(all_units) - len(units)} unchanged test numbers.")
+
+    store = FingerprintStore.load(args.store) if args.store else None
+    db = FingerprintDatabase(args.db) if args.db else None
+
+    # Fingerprints are written as soon as they are extracted, so no fingerprint is kept after it is written
+    extracted = set()
+    failed = []
+    with PROFILER.stage("extraction"):
+        for unit, path, error, fingerprint in extract_units(units, args.workers):
+            if error:
+                failed.append((path, error))
+                continue
+            save_fingerprint(unit, fingerprint)
+            extracted.add(path)
+            # Only successfully extracted folders are cached
+            if cache:
+                cache.update(path, *pending[path])
+            for sink in (store, db):
+                if sink:
+                    sink.add(fingerprint.date, fingerprint.pv, fingerprint.browser, fingerprint.test_num, fingerprint.to_data())
+
+    if cache:
+        with PROFILER.stage("cache"):
+            cache.save()
+
+    if store:
+        with PROFILER.stage("store"):
+            add_saved_to_store(store, args.test_path, all_units, extracted)
+            store.save(args.store)
+
+    if db:
+        with PROFILER.stage("db"):
+            add_saved_to_store(db, args.test_path, all_units, extracted)
+            db.close()
+
+    # Report failed folders after the whole run
+    for path, error in failed:
+        print(f"ERROR: Extraction of {path} failed.\n{error}")
+
+    PROFILER.save("bl_extract")
+
+    return 1 if failed else 0
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    exit(main())
\ No newline at end of file
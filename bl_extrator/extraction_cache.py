@@ -0,0 +1,159 @@
+"""
+Extraction Cache
+
+Description:
+Persistent cache used by bl_extract.py to skip test folders whose input has not changed.
+Each test folder is stored with a hash of its html files, m_data.json and matching config files.
+When the hash is unchanged and the saved fingerprint still exists, the folder does not need to be extracted again.
+The whole cache is discarded when the extraction version changes.
+
+"""
+
+
+import os, sys, json, hashlib
+
+# Shared modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from atomic_write import write_atomic
+
+
+def hash_file(path, h):
+    """
+    Add the content of a file to a hash.
+
+    Params:
+    [string] path: Path to file.
+    h: hashlib object.
+
+    Return:
+    -
+    """
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+
+
+def get_input_hash(path, config_path, lookup):
+    """
+    Hash all input used when extracting one test folder.
+
+    Params:
+    [string] path: Path to test folder.
+    [string] config_path: Path to config files.
+    [dict] lookup: html file name mapped to the name of its config file.
+
+    Return:
+    [string]: Hex digest.
+    """
+    h = hashlib.sha256()
+    for f in sorted(os.listdir(path)):
+        filepath = os.path.join(path, f)
+        if not os.path.isfile(filepath):
+            continue
+        h.update(f.encode("UTF-8") + b"\0")
+        hash_file(filepath, h)
+        if f in lookup:
+            h.update(lookup[f].encode("UTF-8") + b"\0")
+            hash_file(os.path.join(config_path, lookup[f]), h)
+
+    return h.hexdigest()
+
+
+class ExtractionCache:
+    """
+    Cache of extracted test folders, saved as a json file.
+
+    Each entry maps a test folder to the hash of its input, the path of the saved fingerprint
+    and the run it was last used in. When there are more than max_entries entries, the least recently used are evicted.
+    """
+
+    def __init__(self, path, version, max_entries=100000):
+        """
+        Load cache from file. A missing file or a different version gives an empty cache.
+
+        Params:
+        [string] path: Path to cache file.
+        version: Version of the extraction code.
+        [int] max_entries: Max number of saved entries.
+        """
+        self.path = path
+        self.version = version
+        self.max_entries = max_entries
+        self.run = 0
+        self.entries = {}
+
+        if os.path.isfile(path):
+            with open(path, "r") as json_file:
+                data = json.load(json_file)
+            self.run = data["run"]
+            if data["version"] == version:
+                self.entries = data["entries"]
+            else:
+                print("Extraction version has changed, the extraction cache is discarded.")
+
+        self.run += 1
+
+    def is_fresh(self, folder, input_hash, output):
+        """
+        Check if a test folder is already extracted from the same input.
+
+        Params:
+        [string] folder: Path to test folder.
+        [string] input_hash: Hash of current input.
+        [string] output: Path to saved fingerprint.
+
+        Return:
+        [bool]: True if extraction can be skipped.
+        """
+        entry = self.entries.get(folder)
+        if entry is None or entry["hash"] != input_hash or entry["output"] != output or not os.path.isfile(output):
+            return False
+
+        entry["used"] = self.run
+        return True
+
+    def update(self, folder, input_hash, output):
+        """
+        Add or replace the entry of an extracted test folder.
+
+        Params:
+        [string] folder: Path to test folder.
+        [string] input_hash: Hash of the input.
+        [string] output: Path to saved fingerprint.
+
+        Return:
+        -
+        """
+        self.entries[folder] = {
+            "hash": input_hash,
+            "output": output,
+            "used": self.run
+        }
+
+    def evict(self):
+        """
+        Remove the least recently used entries until at most max_entries remain.
+
+        Return:
+        -
+        """
+        if len(self.entries) <= self.max_entries:
+            return
+
+        keep = sorted(self.entries, key=lambda folder: self.entries[folder]["used"], reverse=True)[:self.max_entries]
+        self.entries = {folder: self.entries[folder] for folder in keep}
+
+    def save(self):
+        """
+        Save cache to file.
+
+        Return:
+        -
+        """
+        self.evict()
+
+        write_atomic(self.path, lambda json_file: json.dump({
+            "version": self.version,
+            "run": self.run,
+            "entries": self.entries
+        }, json_file, indent=1))
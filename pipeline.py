@@ -0,0 +1,390 @@
+"""
+Pipeline
+
+Description:
+Written to be run through the commandprompt with passing arguments, works on Windows and Linux.
+Run extraction, analysis, statistics and summary as a dependency graph, the Python alternative to Complete_analysis.ps1.
+Each test case is extracted and analysed by its own nodes, statistics depends on all extractions,
+and entropy and summary on statistics.
+
+A node is rebuilt when the signature of its input files differs from the one saved after its last successful run,
+or when one of its outputs is missing. The signature is built from the modification times and sizes of the input files,
+or from their content with --hash. Outputs of a node are inputs of the nodes depending on it, so a changed fingerprint
+makes its test case analysed again and the statistics counted again, while unchanged test cases are skipped.
+With --hash, a node whose dependency was rebuilt without changing its output is not rebuilt.
+The scripts themselves are inputs, so changed code rebuilds the nodes that use it.
+
+Nodes whose dependencies are done are run at the same time, for example the extraction of one test case
+together with the analysis of another. Analysis nodes share the results journal and are run one at a time,
+in test case order, so results are appended to the journal in the same order on every run.
+
+Optional arguments:
+--workspace: Folder with test_data, Pointsystem and results, the scripts are run in it. Default is the current folder.
+-j, --jobs: Number of nodes run at the same time.
+-w, --workers: Number of processes used by each extraction and analysis.
+--hash: Compare content hashes of input files instead of modification times.
+--force: Rebuild all nodes.
+--dry-run: Only print the nodes that would be rebuilt.
+--exclude: Test cases that are not extracted or analysed.
+--analysis-exclude: Test cases that are extracted but not analysed.
+-h: Print argument usage.
+
+"""
+
+
+import os, sys, json, time, hashlib, argparse, subprocess
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Shared modules
+sys.path.append(os.path.join(ROOT, "Common"))
+from atomic_write import write_atomic
+
+
+class Node:
+    """
+    One step of the pipeline.
+
+    inputs: Files and folders read by the node, folders are read recursively.
+    outputs: Files and folders written by the node.
+    deps: Names of nodes that must be done before this node.
+    lock: Nodes with the same lock are not run at the same time, and are started in the order they are given.
+    stdout: If given, output of the command is saved in this file.
+    """
+
+    def __init__(self, name, command, inputs, outputs, deps=(), lock=None, stdout=None):
+        self.name = name
+        self.command = command
+        self.inputs = inputs
+        self.outputs = outputs
+        self.deps = list(deps)
+        self.lock = lock
+        self.stdout = stdout
+
+
+def list_files(paths):
+    """
+    List all files in the given files and folders, compiled python files are left out.
+
+    Params:
+    [list] paths: Paths to files and folders.
+
+    Return:
+    [list]: Sorted paths to files.
+    """
+    files = []
+    for path in paths:
+        if os.path.isfile(path):
+            files.append(path)
+            continue
+        for root, dirs, filenames in os.walk(path):
+            dirs[:] = [d for d in dirs if d != "__pycache__"]
+            files.extend(os.path.join(root, f) for f in filenames)
+
+    return sorted(files)
+
+
+def get_signature(node, use_hash):
+    """
+    Get the signature of the input of a node.
+
+    Params:
+    [Node] node: Node.
+    [bool] use_hash: Use content of the files instead of their modification times and sizes.
+
+    Return:
+    [string]: Signature.
+    """
+    h = hashlib.sha1()
+    for path in list_files(node.inputs):
+        h.update(path.encode() + b"\0")
+        if use_hash:
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+        else:
+            stat = os.stat(path)
+            h.update(f"{stat.st_mtime_ns} {stat.st_size}".encode())
+        h.update(b"\0")
+
+    return h.hexdigest()
+
+
+def is_fresh(node, state, signature):
+    """
+    Check if a node does not need to be rebuilt.
+
+    Params:
+    [Node] node: Node.
+    [dict] state: Node name mapped to the signature of its last successful run.
+    [string] signature: Current signature of the node.
+
+    Return:
+    [bool]: True if the node is up to date.
+    """
+    return state.get(node.name) == signature and all(os.path.exists(path) for path in node.outputs)
+
+
+def load_state(path):
+    """
+    Read saved signatures, an empty state is used if the file does not exist.
+
+    Params:
+    [string] path: Path to state file.
+
+    Return:
+    [dict]: Node name mapped to signature.
+    """
+    if not os.path.isfile(path):
+        return {}
+
+    with open(path, "r") as json_file:
+        return json.load(json_file)
+
+
+def save_state(state, path):
+    """
+    Save signatures.
+
+    Params:
+    [dict] state: Node name mapped to signature.
+    [string] path: Path to state file.
+
+    Return:
+    -
+    """
+    write_atomic(path, lambda json_file: json.dump(state, json_file, indent=1))
+
+
+def get_test_cases(workspace, exclude):
+    """
+    Get all test cases in the test_data folder, sorted by name.
+
+    Params:
+    [string] workspace: Path to workspace.
+    [list] exclude: Test cases to skip.
+
+    Return:
+    [list]: Names of test cases.
+    """
+    test_data = os.path.join(workspace, "test_data")
+    if not os.path.isdir(test_data):
+        print(f"ERROR: {test_data} does not exist.")
+        exit(1)
+
+    return sorted(d for d in os.listdir(test_data) if d not in exclude and os.path.isdir(os.path.join(test_data, d)))
+
+
+def get_nodes(args, state_dir):
+    """
+    Build the nodes of the pipeline. Paths are relative to the workspace, scripts are given by absolute paths.
+
+    Params:
+    args: Commandline arguments.
+    [string] state_dir: Folder with the pipeline state, relative to the workspace.
+
+    Return:
+    [list]: Nodes, every node comes after its dependencies.
+    """
+    python = sys.executable
+    common = os.path.join(ROOT, "Common")
+    pointsystem = os.path.join("Pointsystem", "pointsystem.json")
+    workers = ["--workers", str(args.workers)]
+
+    nodes = []
+    extract_nodes = []
+    for test_case in get_test_cases(args.workspace, args.exclude):
+        extract = f"extract {test_case}"
+        command = [python, os.path.join(ROOT, "bl_extrator", "bl_extract.py"), os.path.join("test_data", test_case), "--parser", "auto", "--targeted"] + workers
+        if not args.force:
+            # Each test case has its own extraction cache, so extractions run at the same time never write the same file
+            command += ["--cache", os.path.join(state_dir, f"extraction_cache_{test_case}.json")]
+        nodes.append(Node(extract, command,
+                          inputs=[os.path.join("test_data", test_case), os.path.join("bl_extrator", "extraction_config"),
+                                  os.path.join(ROOT, "bl_extrator"), common],
+                          outputs=[os.path.join("Fingerprints", test_case)]))
+        extract_nodes.append(extract)
+
+        if test_case in args.analysis_exclude:
+            continue
+        # Browser folders analysed again replace their earlier results in the journal
+        nodes.append(Node(f"analyze {test_case}",
+                          [python, os.path.join(ROOT, "Analysis_script", "batch_analysis.py"), "Fingerprints", "--include", test_case] + workers,
+                          inputs=[os.path.join("Fingerprints", test_case), pointsystem, os.path.join(ROOT, "Analysis_script"), common],
+                          outputs=[os.path.join("results", "analysis_results.json")],
+                          deps=[extract], lock="analysis results"))
+
+    # Statistics only counts new and changed fingerprints, unless everything is rebuilt
+    command = [python, os.path.join(ROOT, "Fingerprint_Statistics", "fingerprint_statistics.py")]
+    nodes.append(Node("statistics", command + ["--full"] if args.force else command,
+                      inputs=["Fingerprints", pointsystem, os.path.join(ROOT, "Fingerprint_Statistics"), common],
+                      outputs=[os.path.join("results", "statistics.json"), os.path.join("results", "statistics_raw.json")],
+                      deps=extract_nodes))
+
+    nodes.append(Node("entropy", [python, os.path.join(ROOT, "Fingerprint_Statistics", "fingerprint_entropy.py")],
+                      inputs=[os.path.join("results", "statistics_raw.json"), "Fingerprints", pointsystem,
+                              os.path.join(ROOT, "Fingerprint_Statistics"), common],
+                      outputs=[os.path.join("results", "entropy.json")], deps=["statistics"]))
+
+    summary_path = os.path.join("results", "statistics_summary.txt")
+    nodes.append(Node("summary", [python, os.path.join(ROOT, "Statistics_summary.py")],
+                      inputs=[os.path.join("results", "statistics.json"), os.path.join(ROOT, "Statistics_summary.py")],
+                      outputs=[summary_path], deps=["statistics"], stdout=summary_path))
+
+    return nodes
+
+
+def run_node(node, workspace):
+    """
+    Run the command of a node.
+
+    Params:
+    [Node] node: Node.
+    [string] workspace: Working directory.
+
+    Return:
+    [tuple]: (succeeded, seconds, output of the command).
+    """
+    start = time.perf_counter()
+    result = subprocess.run(node.command, cwd=workspace, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    seconds = time.perf_counter() - start
+
+    if result.returncode == 0 and node.stdout:
+        with open(os.path.join(workspace, node.stdout), "w") as f:
+            f.write(result.stdout)
+
+    return result.returncode == 0, seconds, result.stdout
+
+
+def run_pipeline(nodes, state, state_path, args):
+    """
+    Run all stale nodes, nodes whose dependencies are done are run at the same time.
+    The state is saved after every successful node, so an interrupted run continues where it stopped.
+    Nodes depending on a failed node are skipped. Nodes with the same lock are started in the order of nodes.
+
+    Params:
+    [list] nodes: Nodes, every node comes after its dependencies.
+    [dict] state: Node name mapped to signature, updated in place.
+    [string] state_path: Path to state file.
+    args: Commandline arguments.
+
+    Return:
+    [dict]: Node name mapped to "built", "fresh", "failed" or "skipped".
+    """
+    status = {}
+    pending = list(nodes)
+    running = {}
+    locks = set()
+
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        while pending or running:
+            # Locks of nodes that wait for their dependencies, later nodes with the same lock wait for them
+            waiting = set()
+            for node in list(pending):
+                if any(dep not in status for dep in node.deps) or (node.lock and (node.lock in locks or node.lock in waiting)):
+                    if node.lock:
+                        waiting.add(node.lock)
+                    continue
+                pending.remove(node)
+
+                if any(status[dep] in ("failed", "skipped") for dep in node.deps):
+                    status[node.name] = "skipped"
+                    print(f"Skipped {node.name}, a dependency failed")
+                    continue
+
+                # Signatures are taken when the dependencies are done, so their new outputs are included
+                signature = get_signature(node, args.hash)
+                if not args.force and is_fresh(node, state, signature):
+                    status[node.name] = "fresh"
+                    continue
+
+                print(f"Working with {node.name}")
+                if node.lock:
+                    locks.add(node.lock)
+                running[executor.submit(run_node, node, args.workspace)] = (node, signature)
+
+            if not running:
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                node, signature = running.pop(future)
+                locks.discard(node.lock)
+                succeeded, seconds, output = future.result()
+                if succeeded:
+                    status[node.name] = "built"
+                    state[node.name] = signature
+                    save_state(state, state_path)
+                    print(f"Built {node.name} in {seconds:.2f} s")
+                else:
+                    status[node.name] = "failed"
+                    print(f"ERROR: {node.name} failed.\n{output}")
+
+    return status
+
+
+def print_stale(nodes, state, args):
+    """
+    Print the nodes that would be rebuilt. Nodes depending on a stale node are counted as stale.
+
+    Params:
+    [list] nodes: Nodes, every node comes after its dependencies.
+    [dict] state: Node name mapped to signature.
+    args: Commandline arguments.
+
+    Return:
+    -
+    """
+    stale = set()
+    for node in nodes:
+        if args.force or any(dep in stale for dep in node.deps) or not is_fresh(node, state, get_signature(node, args.hash)):
+            stale.add(node.name)
+            print(f"Stale: {node.name}")
+
+    print(f"{len(stale)} of {len(nodes)} nodes would be rebuilt")
+
+
+def main():
+    """
+    Main function.
+    Rebuild all stale nodes of the pipeline.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workspace", default=".", help="Folder with test_data, Pointsystem and results")
+    parser.add_argument("-j", "--jobs", type=int, default=2, help="Number of nodes run at the same time")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Number of processes used by each extraction and analysis")
+    parser.add_argument("--hash", action="store_true", help="Compare content hashes of input files instead of modification times")
+    parser.add_argument("--force", action="store_true", help="Rebuild all nodes")
+    parser.add_argument("--dry-run", action="store_true", help="Only print the nodes that would be rebuilt")
+    parser.add_argument("--exclude", nargs="*", default=["test", "omitted"], help="Test cases that are not extracted or analysed")
+    parser.add_argument("--analysis-exclude", nargs="*", default=["2022-03-11"], help="Test cases that are extracted but not analysed")
+    args = parser.parse_args()
+
+    # Paths of inputs and outputs are relative to the workspace
+    args.workspace = os.path.abspath(args.workspace)
+    os.chdir(args.workspace)
+
+    state_dir = ".pipeline"
+    os.makedirs(state_dir, exist_ok=True)
+    os.makedirs("results", exist_ok=True)
+    state_path = os.path.join(state_dir, "state.json")
+    state = load_state(state_path)
+
+    nodes = get_nodes(args, state_dir)
+
+    if args.dry_run:
+        print_stale(nodes, state, args)
+        return
+
+    status = run_pipeline(nodes, state, state_path, args)
+
+    counts = {s: list(status.values()).count(s) for s in ("built", "fresh", "failed", "skipped")}
+    print(f"Done! {counts['built']} built, {counts['fresh']} up to date, {counts['failed']} failed, {counts['skipped']} skipped")
+
+    if counts["failed"]:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
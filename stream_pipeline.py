@@ -0,0 +1,305 @@
+"""
+Stream Pipeline
+
+Description:
+Written to be run through the commandprompt with passing arguments.
+Extract, analyse and count all test cases in one pass over test_data, without writing fingerprints to disk and reading them back.
+Each extracted fingerprint is put on a queue as soon as it is done. For each fingerprint taken from the queue, its values
+are counted in the statistics and it is kept with the other fingerprints of its browser folder. Once fingerprint_1,
+fingerprint_2 and fingerprint_3 of a browser folder are there, the folder is ready, ready folders are analysed in batches
+(see batch_compare.py) and their fingerprints are released. Saving fingerprints as json files, in a fingerprint store
+or in a fingerprint database are optional sinks.
+
+The results are the same as running bl_extract.py on each test case, then batch_analysis.py and fingerprint_statistics.py --full,
+so test_data should hold all test cases. With more than one worker, extraction runs in worker processes fed by a thread,
+so analysis and counting overlap with extraction. With one worker the fingerprints are extracted in the main process
+between the other steps, as stages of the profiler can not be recorded from two threads.
+
+Positional arguments:
+[string] source: Path to test_data folder, with one folder per test case.
+
+Optional arguments:
+-w, --workers: Number of processes used for extraction.
+-p, --parser: Parser backend, html.parser, lxml or auto.
+-t, --targeted: Only parse the elements listed in the config files.
+-e, --exclude: Test cases that are not extracted.
+--analysis-exclude: Test cases that are extracted and counted but not analysed.
+-f, --fingerprints: Also save fingerprints as json files in the Fingerprints folder.
+-s, --store: Path to fingerprint store, fingerprints are also saved in the store.
+--db: Path to fingerprint database, fingerprints and analysis results are also saved in the database.
+--timing: Path to json report with time spent in each stage.
+--profile: Folder where a cProfile dump of each stage is saved, used with --timing.
+-h: Print argument usage.
+
+"""
+
+
+import os, sys, queue, argparse, threading
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(ROOT, "bl_extrator"))
+sys.path.append(os.path.join(ROOT, "Analysis_script"))
+sys.path.append(os.path.join(ROOT, "Fingerprint_Statistics"))
+from bl_extract import get_parser, get_units, extract_units, save_fingerprint
+from batch_analysis import analyze_groups, CHUNK_SIZE
+from analysis_script import get_pointsystem_path
+from results_journal import append_results, save_materialized
+from fingerprint_statistics import new_state, add_value, get_scored_values, genereate_statistics, save_results
+
+# Shared modules
+sys.path.append(os.path.join(ROOT, "Common"))
+from fingerprint_store import FingerprintStore
+from fingerprint_db import FingerprintDatabase
+from compiled_pointsystem import CompiledPointsystem
+from value_dictionary import ValueDictionary
+from normalize import get_comparison_key, get_statistics_key
+from fingerprint import get_json_data
+from profiling import PROFILER
+
+# Test numbers compared by the analysis
+ANALYSED_TEST_NUMS = ("1", "2", "3")
+
+# Put on the queue after the last extracted fingerprint
+DONE = object()
+
+
+def get_test_cases(source, exclude):
+    """
+    Get all test cases in the test_data folder, sorted by name.
+
+    Params:
+    [string] source: Path to test_data folder.
+    [list] exclude: Test cases to skip.
+
+    Return:
+    [list]: Paths to test case folders.
+    """
+    return [os.path.join(source, d) for d in sorted(os.listdir(source))
+            if d not in exclude and d != "__pycache__" and os.path.isdir(os.path.join(source, d))]
+
+
+def stream_units(units, workers):
+    """
+    Extract test numbers and yield them in order as they are done.
+    With more than one worker, a thread puts the results of extract_units on a bounded queue, so extraction goes on
+    while the consumer handles earlier fingerprints, and at most a few fingerprints per worker wait on the queue.
+
+    Params:
+    [list] units: Units passed to extract_test_num.
+    [int] workers: Number of processes.
+
+    Return:
+    Generator of (unit, path to test folder, error message or None, fingerprint or None).
+    """
+    if workers <= 1:
+        yield from extract_units(units)
+        return
+
+    results = queue.Queue(maxsize=workers * 4)
+
+    def produce():
+        try:
+            for result in extract_units(units, workers):
+                results.put(result)
+        except Exception as e:
+            results.put(e)
+        results.put(DONE)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    while True:
+        result = results.get()
+        if result is DONE:
+            break
+        if isinstance(result, Exception):
+            raise result
+        yield result
+    thread.join()
+
+
+class StreamAnalysis:
+    """
+    Analysis fed one fingerprint at a time. Browser folders are analysed in batches once their fingerprints are there.
+
+    waiting: (date, pv, browser) mapped to test number mapped to fingerprint, for folders that are not ready.
+    results: (folder, browser, pv, point_result, raw_result, changes) of each analysed folder, folder as date/pv/browser.
+    """
+
+    def __init__(self, pointsystem, exclude):
+        """
+        Params:
+        [CompiledPointsystem] pointsystem: Used pointsystem.
+        [list] exclude: Test cases that are not analysed.
+        """
+        self.pointsystem = pointsystem
+        self.exclude = exclude
+        self.values = ValueDictionary(get_comparison_key)
+        self.waiting = {}
+        self.ready = []
+        self.results = []
+
+    def add(self, fingerprint):
+        """
+        Add an extracted fingerprint. Ready folders are analysed once there are enough for a batch.
+
+        Params:
+        [Fingerprint] fingerprint: Fingerprint.
+
+        Return:
+        -
+        """
+        if fingerprint.date in self.exclude or fingerprint.test_num not in ANALYSED_TEST_NUMS:
+            return
+
+        folder = (fingerprint.date, fingerprint.pv, fingerprint.browser)
+        fingerprints = self.waiting.setdefault(folder, {})
+        fingerprints[fingerprint.test_num] = fingerprint
+        if len(fingerprints) == len(ANALYSED_TEST_NUMS):
+            del self.waiting[folder]
+            self.ready.append((folder, [fingerprints[t] for t in ANALYSED_TEST_NUMS]))
+            if len(self.ready) >= CHUNK_SIZE:
+                self.flush()
+
+    def flush(self):
+        """
+        Analyse all ready folders and release their fingerprints.
+
+        Return:
+        -
+        """
+        if not self.ready:
+            return
+
+        with PROFILER.stage("analysis"):
+            results, changes = analyze_groups([fingerprints for _, fingerprints in self.ready], self.pointsystem, self.values)
+        for ((date, pv, browser), _), (point_result, raw_result), folder_changes in zip(self.ready, results, changes):
+            self.results.append(("/".join([date, pv, browser]), browser, pv, point_result, raw_result, folder_changes))
+        self.ready = []
+
+
+class StreamStatistics:
+    """
+    Statistics fed one fingerprint at a time, counted as fingerprint_statistics.py counts them.
+
+    statistics_raw: Counted values.
+    """
+
+    def __init__(self, pointsystem):
+        """
+        Params:
+        [dict] pointsystem: Used pointsystem.
+        """
+        self.pointsystem = pointsystem
+        self.statistics_raw = new_state(pointsystem)["statistics_raw"]
+        self.index = {}
+        self.values = ValueDictionary(get_statistics_key)
+
+    def add(self, fingerprint):
+        """
+        Count the values of an extracted fingerprint.
+
+        Params:
+        [Fingerprint] fingerprint: Fingerprint.
+
+        Return:
+        -
+        """
+        with PROFILER.stage("count"):
+            for category, attribute, value in get_scored_values(fingerprint, self.pointsystem):
+                add_value(self.statistics_raw, self.index, self.values, fingerprint.browser, fingerprint.pv, category, attribute, value)
+
+
+def main():
+    """
+    Main function.
+    Extract all test cases, analyse their browser folders and count their values in one pass, and save the results.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", help="Path to test_data folder")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Number of processes used for extraction")
+    parser.add_argument("-p", "--parser", choices=["html.parser", "lxml", "auto"], default="html.parser", help="Parser backend used for html files")
+    parser.add_argument("-t", "--targeted", action="store_true", help="Only parse elements with ids listed in the config files")
+    parser.add_argument("-e", "--exclude", nargs="*", default=["test", "omitted"], help="Test cases that are not extracted")
+    parser.add_argument("--analysis-exclude", nargs="*", default=["2022-03-11"], help="Test cases that are extracted but not analysed")
+    parser.add_argument("-f", "--fingerprints", action="store_true", help="Also save fingerprints as json files")
+    parser.add_argument("-s", "--store", help="Path to fingerprint store, fingerprints are also saved in the store")
+    parser.add_argument("--db", help="Path to fingerprint database, fingerprints and results are also saved in the database")
+    parser.add_argument("--timing", help="Path to json report with time spent in each stage")
+    parser.add_argument("--profile", help="Folder where a cProfile dump of each stage is saved, used with --timing")
+    args = parser.parse_args()
+
+    if args.timing:
+        PROFILER.enable(args.timing, args.profile)
+
+    if not os.path.isdir(args.source):
+        print("Source path does not exist.")
+        exit(1)
+
+    result_path = os.path.join(".", "results")
+    exists = os.path.exists(os.path.join(".", "bl_extrator", "extraction_config"))
+    options = {
+        "config_path": os.path.join(".", "bl_extrator", "extraction_config") if exists else os.path.join(".", "extraction_config"),
+        "debug": False,
+        "parser": get_parser(args.parser),
+        "targeted": args.targeted
+    }
+
+    with PROFILER.stage("list"):
+        units = [unit for test_path in get_test_cases(args.source, args.exclude) for unit in get_units(test_path, options)]
+
+    analysis = StreamAnalysis(CompiledPointsystem(get_json_data(get_pointsystem_path())), args.analysis_exclude)
+    statistics = StreamStatistics(get_json_data(os.path.join(".", "Pointsystem", "pointsystem.json")))
+    store = FingerprintStore.load(args.store) if args.store else None
+    db = FingerprintDatabase(args.db) if args.db else None
+
+    failed = []
+    with PROFILER.stage("stream"):
+        for unit, path, error, fingerprint in stream_units(units, args.workers):
+            if error:
+                failed.append((path, error))
+                continue
+
+            if args.fingerprints:
+                with PROFILER.stage("write fingerprints"):
+                    save_fingerprint(unit, fingerprint)
+            for sink in (store, db):
+                if sink:
+                    sink.add(fingerprint.date, fingerprint.pv, fingerprint.browser, fingerprint.test_num, fingerprint.to_data())
+
+            statistics.add(fingerprint)
+            analysis.add(fingerprint)
+
+        analysis.flush()
+
+    # Results are appended to the journal once, as by batch_analysis.py
+    with PROFILER.stage("write results"):
+        results_path = os.path.join(result_path, "analysis_results.json")
+        append_results(results_path, [result[1:5] for result in analysis.results], [result[0] for result in analysis.results])
+        save_materialized(results_path)
+
+        save_results(statistics.statistics_raw, genereate_statistics(statistics.statistics_raw), result_path)
+
+    if store:
+        with PROFILER.stage("store"):
+            store.save(args.store)
+
+    if db:
+        with PROFILER.stage("db"):
+            for folder, browser, pv, point_result, raw_result, changes in analysis.results:
+                db.add_comparison(folder.split("/")[0], pv, browser, point_result, raw_result, changes)
+            db.close()
+
+    # Report failed folders and folders that could not be analysed after the whole run
+    for path, error in failed:
+        print(f"ERROR: Extraction of {path} failed.\n{error}")
+    for (date, pv, browser), fingerprints in sorted(analysis.waiting.items()):
+        missing = ", ".join(f"fingerprint_{t}" for t in ANALYSED_TEST_NUMS if t not in fingerprints)
+        print(f"ERROR: {date}/{pv}/{browser} is not analysed, {missing} is missing.")
+
+    PROFILER.save("stream_pipeline")
+
+    return 1 if failed or analysis.waiting else 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,333 @@
+"""
+Generate Corpus
+
+Description:
+Written to be run through the commandprompt with passing arguments.
+Generate a synthetic test data corpus at a configurable scale, with the same structure as a real test:
+date/pv/browser/test_num folders, each with browserleaks-like html files matching the ids in extraction_config
+and a m_data.json file. Optionally the fingerprints are also written directly as json, as bl_extract.py would save them.
+
+Every browser and PV has a baseline value for each attribute. With probability 'entropy' a capture gets one of
+'variants' other values instead, so the entropy of the corpus is controlled. The corpus is deterministic for a seed.
+
+Positional arguments:
+[string] output: Path to folder where test case folders are created.
+
+Optional arguments:
+--days: Number of test days.
+--start: Date of first test day, YYYY-MM-DD.
+--pvs: Prefixed versions.
+--browsers: Browsers.
+--tests: Number of test numbers per browser.
+--entropy: Probability that an attribute differs from its baseline.
+--variants: Number of alternative values of each attribute.
+--padding: Kilobytes of unrelated markup added to each html file.
+--fingerprints: Also write fingerprint json files to this folder.
+--seed: Random seed.
+-h: Print argument usage.
+
+"""
+
+
+import os, json, random, hashlib, argparse, html
+from datetime import date, timedelta
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Categories saved in m_data.json, the rest are extracted from html files
+M_DATA_CATEGORIES = ["Canvas Fingerprinting", "WebGL Report", "Font Fingerprinting", "Features Detection", "Client Rects"]
+
+# Attributes extracted as lists, with the values they are picked from
+LIST_VALUES = {
+    "plugins": ["PDF Viewer", "Chrome PDF Viewer", "Chromium PDF Viewer", "Microsoft Edge PDF Viewer", "WebKit built-in PDF"],
+    "mimeTypes": ["application/pdf", "text/pdf"],
+    "languages": ["en-US", "en", "sv-SE", "sv", "de-DE", "de"],
+    "Speech Voices": [
+        "Microsoft David - English (United States)",
+        "Microsoft Mark - English (United States)",
+        "Microsoft Zira - English (United States)",
+        "Microsoft Bengt - Swedish (Sweden)",
+        "Google US English",
+        "Google UK English Female"
+    ]
+}
+
+USER_AGENTS = {
+    "Chrome": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{version}.0.0.0 Safari/537.36",
+    "Edge": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{version}.0.0.0 Safari/537.36 Edg/{version}.0.1185.44",
+    "Firefox": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:{version}.0) Gecko/20100101 Firefox/{version}.0"
+}
+
+ACCEPT = "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q={quality}"
+
+
+def get_value(category, attribute, browser, pv, variant):
+    """
+    Get a deterministic value of an attribute.
+
+    Params:
+    [string] category: Category.
+    [string] attribute: Attribute.
+    [string] browser: Browser.
+    [string] pv: Prefixed version.
+    [int] variant: 0 for the baseline, else the number of an alternative value.
+
+    Return:
+    Attribute value, a string or a list of strings.
+    """
+    digest = hashlib.sha256(f"{category};{attribute};{browser};{pv};{variant}".encode("UTF-8")).hexdigest()
+    number = int(digest[:8], 16)
+
+    if attribute in LIST_VALUES:
+        rng = random.Random(number)
+        values = LIST_VALUES[attribute]
+        return rng.sample(values, rng.randint(1, len(values)))
+    if attribute in ["User-Agent", "userAgent", "appVersion"]:
+        return USER_AGENTS[browser].format(version=90 + number % 15)
+    if attribute == "Accept":
+        return ACCEPT.format(quality=f"0.{1 + number % 9}")
+    if attribute == "Local IP Address":
+        return f"192.168.{number % 256}.{1 + number % 254}"
+    if attribute == "Public IP Address":
+        return f"{1 + number % 223}.{number % 256}.{(number >> 8) % 256}.{(number >> 16) % 256}"
+    if category in M_DATA_CATEGORIES:
+        return digest[:32]
+    return f"{attribute.lower().replace(' ', '-')}-{number % 100000}"
+
+
+def get_media_devices(browser, pv, variant):
+    """
+    Get deterministic media devices.
+
+    Params:
+    [string] browser: Browser.
+    [string] pv: Prefixed version.
+    [int] variant: 0 for the baseline, else the number of an alternative value.
+
+    Return:
+    [list]: List of media device dictionaries.
+    """
+    rng = random.Random(f"{browser};{pv};{variant}")
+    devices = []
+    for i in range(rng.randint(1, 3)):
+        devices.append({
+            "kind": rng.choice(["audioinput", "audiooutput", "videoinput"]),
+            "label": rng.choice(["", f"Microphone ({i + 1}- USB Audio)", f"Speakers ({i + 1}- Realtek Audio)"]),
+            "deviceId": "%064x" % rng.getrandbits(256),
+            "groupId": "%064x" % rng.getrandbits(256)
+        })
+    return devices
+
+
+def get_attributes(pointsystem, browser):
+    """
+    Get the attributes captured from a browser. Each browser lacks a fixed part of the attributes, as real browsers do.
+
+    Params:
+    [dict] pointsystem: Pointsystem, lists all attributes.
+    [string] browser: Browser.
+
+    Return:
+    [dict]: Category mapped to list of attributes.
+    """
+    attributes = {}
+    for category in pointsystem:
+        if category == "pointsystem":
+            continue
+        attributes[category] = []
+        for attribute in pointsystem[category]:
+            if attribute.startswith("Media Devices:"):
+                continue
+            digest = hashlib.sha256(f"{browser};{category};{attribute}".encode("UTF-8")).digest()
+            if category in M_DATA_CATEGORIES or category == "WebRTC Leak" or digest[0] >= 40:
+                attributes[category].append(attribute)
+    attributes["WebRTC Leak"].append("Media Devices")
+    return attributes
+
+
+def generate_fingerprint(attributes, browser, pv, rng, entropy, variants):
+    """
+    Generate the fingerprint of one capture.
+
+    Params:
+    [dict] attributes: Category mapped to list of attributes.
+    [string] browser: Browser.
+    [string] pv: Prefixed version.
+    [Random] rng: Random generator.
+    [float] entropy: Probability that an attribute differs from its baseline.
+    [int] variants: Number of alternative values of each attribute.
+
+    Return:
+    [dict]: Fingerprint data, in the order bl_extract.py saves it.
+    """
+    fingerprint = {}
+    for category in attributes:
+        fingerprint[category] = {}
+        for attribute in attributes[category]:
+            variant = rng.randint(1, variants) if rng.random() < entropy else 0
+            if attribute == "Media Devices":
+                fingerprint[category][attribute] = get_media_devices(browser, pv, variant)
+            else:
+                fingerprint[category][attribute] = get_value(category, attribute, browser, pv, variant)
+    return fingerprint
+
+
+def get_padding(kilobytes):
+    """
+    Get unrelated markup, making the html files closer in size to real pages.
+
+    Params:
+    [int] kilobytes: Size of the markup.
+
+    Return:
+    [string]: Markup.
+    """
+    row = "<div class=\"nav\"><a href=\"/\">Home</a><span>Unrelated content that is parsed but not extracted.</span></div>\n"
+    return row * (kilobytes * 1024 // len(row))
+
+
+def render_table(tbody_id, values, extra=""):
+    """
+    Render attributes as a browserleaks table.
+
+    Params:
+    [string] tbody_id: Id of the table body.
+    [dict] values: Attribute mapped to value.
+    [string] extra: Markup of rows added last.
+
+    Return:
+    [string]: Markup.
+    """
+    rows = []
+    for attribute, value in values.items():
+        if attribute == "Speech Voices":
+            text = "<div>" + "<br/>".join(html.escape(v) for v in value) + "</div>"
+        elif attribute == "languages":
+            text = html.escape(",".join(f"\"{v}\"" for v in value))
+        elif isinstance(value, list):
+            text = html.escape(", ".join(value))
+        else:
+            text = html.escape(value)
+        rows.append(f"<tr><td>{html.escape(attribute)}</td><td>{text}</td></tr>")
+    return f"<table><tbody id=\"{tbody_id}\">" + "".join(rows) + extra + "</tbody></table>\n"
+
+
+def render_test(path, fingerprint, configs, padding):
+    """
+    Write the html files and m_data.json of one test number.
+
+    Params:
+    [string] path: Path to test number folder.
+    [dict] fingerprint: Fingerprint data.
+    [dict] configs: Config file name mapped to config.
+    [int] padding: Kilobytes of unrelated markup added to each html file.
+
+    Return:
+    -
+    """
+    os.makedirs(path, exist_ok=True)
+    pad = get_padding(padding)
+
+    m_data = {category: fingerprint[category] for category in M_DATA_CATEGORIES}
+    with open(os.path.join(path, "m_data.json"), "w") as json_file:
+        json.dump(m_data, json_file, indent=1)
+
+    for filename, config_name in [("http_header.html", "http_headers.json"), ("javascript.html", "javascript.json")]:
+        config = configs[config_name]
+        tables = ""
+        for category in config:
+            # A row that bl_extract.py filters out, as on browserleaks
+            extra = "<tr><td>Fullscreen Leak Test</td><td>Run</td></tr>" if category == "Screen Object" else ""
+            tables += render_table(config[category], fingerprint[category], extra)
+        with open(os.path.join(path, filename), "w", encoding="UTF-8") as f:
+            f.write(f"<html><head><title>BrowserLeaks</title></head><body>\n{pad}{tables}{pad}</body></html>\n")
+
+    config = configs["webRTC.json"]
+    rtc = fingerprint["WebRTC Leak"]
+    devices = "".join(f"kind: {d['kind']}\nlabel: {d['label']}\ndeviceId: {d['deviceId']}\ngroupId: {d['groupId']}\n\n" for d in rtc["Media Devices"])
+    with open(os.path.join(path, "webrtc_leak.html"), "w", encoding="UTF-8") as f:
+        f.write(
+            f"<html><head><title>BrowserLeaks</title></head><body>\n{pad}"
+            f"<span id=\"{config['Local IP Address']}\">{html.escape(rtc['Local IP Address'])}</span>\n"
+            f"<span id=\"{config['Public IP Address']}\">{html.escape(rtc['Public IP Address'])}</span>\n"
+            f"<table><tr><td id=\"{config['Media Devices']}\">{html.escape(devices)}</td></tr></table>\n"
+            f"{pad}</body></html>\n")
+
+
+def generate_corpus(output, days=1, start="2022-04-01", pvs=("PV1", "PV2"), browsers=("Chrome", "Edge", "Firefox"),
+                    tests=3, entropy=0.1, variants=4, padding=0, fingerprints=None, seed=0):
+    """
+    Generate a synthetic corpus.
+
+    Params:
+    [string] output: Path to folder where test case folders are created.
+    [int] days: Number of test days.
+    [string] start: Date of first test day, YYYY-MM-DD.
+    [list] pvs: Prefixed versions.
+    [list] browsers: Browsers.
+    [int] tests: Number of test numbers per browser.
+    [float] entropy: Probability that an attribute differs from its baseline.
+    [int] variants: Number of alternative values of each attribute.
+    [int] padding: Kilobytes of unrelated markup added to each html file.
+    [string] fingerprints: If given, fingerprint json files are also written to this folder.
+    [int] seed: Random seed.
+
+    Return:
+    [list]: Paths to the created test case folders.
+    """
+    with open(os.path.join(ROOT, "Pointsystem", "pointsystem.json"), "r") as json_file:
+        pointsystem = json.load(json_file)
+    configs = {}
+    for name in ["http_headers.json", "javascript.json", "webRTC.json"]:
+        with open(os.path.join(ROOT, "bl_extrator", "extraction_config", name), "r") as json_file:
+            configs[name] = json.load(json_file)
+
+    rng = random.Random(seed)
+    first = date.fromisoformat(start)
+    test_cases = []
+    for day in range(days):
+        test_date = str(first + timedelta(days=day))
+        for pv in pvs:
+            for browser in browsers:
+                attributes = get_attributes(pointsystem, browser)
+                for test_num in range(1, tests + 1):
+                    fingerprint = generate_fingerprint(attributes, browser, pv, rng, entropy, variants)
+                    render_test(os.path.join(output, test_date, pv, browser, str(test_num)), fingerprint, configs, padding)
+
+                    if fingerprints:
+                        path = os.path.join(fingerprints, test_date, pv, browser)
+                        os.makedirs(path, exist_ok=True)
+                        with open(os.path.join(path, f"fingerprint_{test_num}.json"), "w") as json_file:
+                            json.dump(fingerprint, json_file, indent=1)
+        test_cases.append(os.path.join(output, test_date))
+
+    return test_cases
+
+
+def main():
+    """
+    Main function.
+    Generate a synthetic corpus from the commandline arguments.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("output", help="Path to folder where test case folders are created")
+    parser.add_argument("--days", type=int, default=1, help="Number of test days")
+    parser.add_argument("--start", default="2022-04-01", help="Date of first test day, YYYY-MM-DD")
+    parser.add_argument("--pvs", nargs="+", default=["PV1", "PV2"], help="Prefixed versions")
+    parser.add_argument("--browsers", nargs="+", default=["Chrome", "Edge", "Firefox"], help="Browsers")
+    parser.add_argument("--tests", type=int, default=3, help="Number of test numbers per browser")
+    parser.add_argument("--entropy", type=float, default=0.1, help="Probability that an attribute differs from its baseline")
+    parser.add_argument("--variants", type=int, default=4, help="Number of alternative values of each attribute")
+    parser.add_argument("--padding", type=int, default=0, help="Kilobytes of unrelated markup added to each html file")
+    parser.add_argument("--fingerprints", help="Also write fingerprint json files to this folder")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    test_cases = generate_corpus(args.output, args.days, args.start, args.pvs, args.browsers, args.tests,
+                                 args.entropy, args.variants, args.padding, args.fingerprints, args.seed)
+    print(f"Generated {len(test_cases)} test cases in {args.output}")
+
+
+if __name__ == "__main__":
+    main()